@@ -1,14 +1,43 @@
 import sys
+import os
+import itertools
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                               QTextEdit, QPlainTextEdit, QLabel, QScrollArea, QSplitter, QSizePolicy)
-from PySide6.QtGui import QFont, QColor, QPalette              
-from PySide6.QtCore import Qt, Signal, QTimer
+                               QTextEdit, QPlainTextEdit, QLabel, QSplitter)
+from PySide6.QtGui import QFont
+from PySide6.QtCore import Qt, Signal, QEvent, QObject, QTimer
+# With PM_AGENT_URL set, talk to a running server.py instead of loading the agent in-process
+if os.environ.get("PM_AGENT_URL"):
+    from agent_client import stream_user_input, warm_up, shutdown
+else:
+    from agent import stream_user_input, warm_up, shutdown
+from agent_worker import AgentWorker, TokenThrottle
+from qt_chat_log import ChatLog
+from resize_controller import ResizeController
+
+class CallAfter(QObject):
+    # Qt counterpart of wx.CallAfter: emitting from a worker thread queues the call
+    # onto the GUI thread
+    called = Signal(object, tuple)
+
+    def __init__(self):
+        super().__init__()
+        self.called.connect(self.run)
+
+    def __call__(self, func, *args):
+        self.called.emit(func, args)
+
+    def run(self, func, args):
+        func(*args)
 
 class InputTextEdit(QPlainTextEdit):
     enter_pressed = Signal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        # Typing and resizing change the height at most once per debounce interval,
+        # and only when the line count changes
+        self.line_height = self.fontMetrics().height()
+        self.resizer = ResizeController(self.input_height, self.setFixedHeight, QTimer.singleShot)
         self.setPlaceholderText("Ask your questions here")
         font = QFont()
         font.setPointSize(14)
@@ -19,9 +48,7 @@ class InputTextEdit(QPlainTextEdit):
         self.setLineWrapMode(QPlainTextEdit.WidgetWidth)
         
         self.document().contentsChanged.connect(self.adjust_height)
-        # Set initial height to one line
-        single_line_height = self.fontMetrics().height()
-        self.setFixedHeight(single_line_height+10)
+        self.resizer.apply()
     
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Return:
@@ -29,141 +56,32 @@ class InputTextEdit(QPlainTextEdit):
                 cursor = self.textCursor()
                 cursor.insertText("\n")
                 self.setTextCursor(cursor)
-                self.adjust_height()
             else:
                 self.enter_pressed.emit()
                 # Shrink the input area back to one line
-                single_line_height = self.fontMetrics().height()
-                self.setFixedHeight(single_line_height+10)
+                self.adjust_height()
                 event.accept()
         else:
             super().keyPressEvent(event)
 
     def adjust_height(self):
-        pixels_per_unit = self.fontMetrics().height()
-        # how many lines are there already
-        doc_height = self.document().size().height()
-        if doc_height < 5:
-            new_pixel_height = doc_height * pixels_per_unit + 1
-            if new_pixel_height != self.height():
-                self.setFixedHeight(new_pixel_height+10)
-
-class CustomTextBlock(QTextEdit):
-    def __init__(self, text, is_user=False, parent_width=None):
-        super().__init__()
-        self.setReadOnly(True)
-        self.setFont(QFont("Arial", 12 if is_user else 14))
-        self.setPlainText(text)
-        self.setSizePolicy (QSizePolicy.Preferred, QSizePolicy.Minimum)
-        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        
-        self.is_user = is_user
-        self.parent_width = parent_width
-
-        palette = self.palette()
-
-        if is_user:
-            palette.setColor(QPalette.Base, QColor(64, 64, 64))  # Dark gray
-            self.setStyleSheet("""
-                QTextEdit {
-                    border-radius: 15px;
-                    padding: 5px;
-                    background-color: #404040;
-                }
-            """)
-        else:
-            palette.setColor(QPalette.Base, Qt.black)
-            self.setStyleSheet("""
-                QTextEdit {
-                    padding: 5px;
-                    background-color: black;
-                }
-            """)
-        palette.setColor(QPalette.Text, Qt.white)
-        self.setPalette(palette)
-
-        self.document().contentsChanged.connect(self.adjust_size)
-        self.adjust_size()
-
-
-
-    # def sizeHint(self):
-    #     # Get the size needed to display all the text
-    #     doc_size = self.document().size().toSize()
-    #     # Add any margins or padding you have
-    #     return QSize(doc_size.width() + 20, doc_size.height() + 20)
-    
-   
-    def adjust_size(self):
+        self.resizer.request()
 
-        
-        docuSize = self.document().size()
-        print(f"selfwidth: {docuSize}")
-        # width doesn't exceed 400px
-        widthNeeded = min (400, docuSize.width())
-        print (widthNeeded)
-        margins = self.contentsMargins()
-        width = docuSize.width() + margins.left() + margins.right() + 5  # Adding a small buffer
-        self.setFixedWidth(width)
-        print (f"final: {width}")
-
-        
-        
-        # these numbers are very important for the radius to show!!!!
-        # self.document().setTextWidth(self.viewport().width() - 10)
-        # size = self.document().size()
-        # self.setFixedSize(size.width() + 20, size.height() + 10)
+    def input_height(self):
+        # The document of a QPlainTextEdit measures its height in lines
+        lines = min(max(1, int(self.document().size().height())), 4)
+        return lines * self.line_height + 10
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        self.adjust_size()
+        # A new width can change how many lines the text wraps to
+        self.adjust_height()
 
-class ChatLog(QWidget):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.layout = QVBoxLayout(self)
-        self.layout.setAlignment(Qt.AlignTop)
-        self.layout.setSpacing(5)
-        self.layout.setContentsMargins(5, 5, 5, 5)
-        self.setLayout(self.layout)
-        
-        # Set black background
-        palette = self.palette()
-        palette.setColor(QPalette.Window, Qt.black)
-        self.setAutoFillBackground(True)
-        self.setPalette(palette)
-
-    def add_message(self, text, is_user=False):
-        block = CustomTextBlock(text, is_user)
-
-        if is_user:
-            wrapper = QWidget()
-            wrapper_layout = QHBoxLayout(wrapper)
-            # this line adds an invisible box in front of the next widget
-            wrapper_layout.addStretch()
-            wrapper_layout.addWidget(block)
-            self.layout.addWidget(wrapper)
-        else:
-            self.layout.addWidget(block)
-        
-
-        # Scroll to the bottom
-        QTimer.singleShot(0, self.scroll_to_bottom)
-    
-    def scroll_to_bottom(self):
-        if self.parent() and isinstance(self.parent(), QScrollArea):
-            scrollbar = self.parent().verticalScrollBar()
-            scrollbar.setValue(scrollbar.maximum())
-
-    def resizeEvent(self, event):
-        super().resizeEvent(event)
-        for i in range(self.layout.count()):
-            item = self.layout.itemAt(i)
-            if item.widget():
-                if isinstance(item.widget(), CustomTextBlock):
-                    item.widget().setMaximumWidth(self.width() * 0.7)
-                item.widget().adjustSize()
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.FontChange:
+            self.line_height = self.fontMetrics().height()
+            self.adjust_height()
 
 class ChatbotGUI(QMainWindow):
     def __init__(self):
@@ -182,21 +100,13 @@ class ChatbotGUI(QMainWindow):
         chat_widget = QWidget()
         chat_layout = QVBoxLayout(chat_widget)
 
+        # Scrolls itself and paints only the visible messages
         self.chat_log = ChatLog()
-        self.chat_scroll_area = QScrollArea()
-        self.chat_scroll_area.setWidgetResizable(True)
-        self.chat_scroll_area.setWidget(self.chat_log)
-
-        # Set black background for chat scroll area
-        chat_scroll_palette = self.chat_scroll_area.palette()
-        chat_scroll_palette.setColor(QPalette.Window, Qt.black)
-        self.chat_scroll_area.setAutoFillBackground(True)
-        self.chat_scroll_area.setPalette(chat_scroll_palette)
 
         self.msg_entry = InputTextEdit()
         self.msg_entry.enter_pressed.connect(self.send_message)
 
-        chat_layout.addWidget(self.chat_scroll_area)
+        chat_layout.addWidget(self.chat_log)
         chat_layout.addWidget(self.msg_entry)
 
         # Right side: Project Knowledge Base
@@ -228,6 +138,12 @@ class ChatbotGUI(QMainWindow):
 
         main_layout.addWidget(splitter)
 
+        # Agent calls run on a background thread; the answer is streamed back to the GUI thread
+        self.call_after = CallAfter()
+        self.worker = AgentWorker(self.stream_agent_response, self.call_after)
+        self.stream_ids = itertools.count(1)
+        self.streams = {}
+
         self.update_chat_log("PM Helper", "Welcome! How can I assist you today?")
         self.update_knowledge_base("Initial project knowledge will be displayed here.")
 
@@ -236,22 +152,43 @@ class ChatbotGUI(QMainWindow):
         if user_message:
             self.update_chat_log("You", user_message)
             self.msg_entry.clear()
-            self.process_response(user_message)
-
-    def process_response(self, user_message):
-        response = self.get_agent_response(user_message)
-        self.update_chat_log("PM Helper", response)
+            self.worker.submit(user_message, self.process_response, self.process_error)
+
+    def stream_agent_response(self, user_message):
+        # Runs on the worker thread. Tokens are batched so the chat log repaints at
+        # most every 50 ms instead of once per token.
+        stream_id = next(self.stream_ids)
+        self.call_after(self.begin_streamed_message, stream_id)
+        throttle = TokenThrottle(self.call_after, lambda text: self.append_streamed_text(stream_id, text))
+        try:
+            for token in stream_user_input(user_message):
+                throttle.push(token)
+        finally:
+            throttle.close()
+        return stream_id
+
+    def begin_streamed_message(self, stream_id):
+        self.streams[stream_id] = self.chat_log.add_message("PM Helper: ", False)
+
+    def append_streamed_text(self, stream_id, text):
+        self.chat_log.append_to_message(self.streams[stream_id], text)
+
+    def process_response(self, stream_id):
+        self.streams.pop(stream_id, None)
         self.update_knowledge_base("Updated knowledge based on the conversation.")
 
+    def process_error(self, error):
+        self.update_chat_log("PM Helper", f"Error: {str(error)}")
+
+    def closeEvent(self, event):
+        # Let a running turn finish, then apply its KB update before the process exits
+        self.worker.shutdown(wait=True)
+        shutdown()
+        super().closeEvent(event)
+
     def update_chat_log(self, sender, message):
         self.chat_log.add_message(f"{sender}: {message}", sender == "You")
-        self.chat_scroll_area.verticalScrollBar().setValue(
-            self.chat_scroll_area.verticalScrollBar().maximum()
-        )
         
-    def get_agent_response(self, user_message):
-        return "This is a placeholder response from the PM Helper."
-    
     def update_knowledge_base(self, content):
         self.kb_text.setPlainText(content)
 
@@ -259,4 +196,5 @@ if __name__ == '__main__':
     app = QApplication([])
     window = ChatbotGUI()
     window.show()
+    warm_up()
     app.exec()
\ No newline at end of file
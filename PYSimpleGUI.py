@@ -1,7 +1,11 @@
 import PySimpleGUI as sg
 import json
 import os
-from agent import process_user_input, read_knowledge_base, write_knowledge_base
+# With PM_AGENT_URL set, talk to a running server.py instead of loading the agent in-process
+if os.environ.get("PM_AGENT_URL"):
+    from agent_client import process_user_input, read_knowledge_base, warm_up, shutdown
+else:
+    from agent import process_user_input, read_knowledge_base, warm_up, shutdown
 
 # Set the PySimpleGUI backend to PyQt5
 sg.set_options(dpi_awareness=True)
@@ -86,4 +90,6 @@ class ChatbotGUI:
 
 if __name__ == '__main__':
     gui = ChatbotGUI()
+    warm_up()
     gui.run()
+    shutdown()
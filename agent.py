@@ -1,76 +1,345 @@
 import os
 import json
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents.format_scratchpad import format_to_openai_function_messages
-from langchain.agents import AgentExecutor
-from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
-from langchain.tools import StructuredTool
-
-# Load the environment variables
-OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import functools
+import queue
+import threading
+import time
+import types
+from conversation_memory import ConversationStore
+from kb_batch import KB_UPDATE_BATCH_SIZE, UpdateBatcher
+from kb_events import KBChange, KBEventBus, KBFileWatcher
+from kb_index import KBIndex, estimate_tokens, select_context
+from kb_journal import JournaledKBStore
+from kb_patch import PatchError, changed_paths, diff, merge_to_patch, parse_pointer
+from kb_projects import ProjectKB, ProjectRegistry
+from kb_sqlite import FTSIndex, SQLiteKBStore
+from metrics import MetricsRegistry
+from response_cache import ALL_CATEGORIES, ResponseCache, cache_key, is_follow_up
+from turn_classifier import TurnClassifier, mutation_score
 
 KB_FILE = "project_kb.json"
+# KB changes are appended here as JSON lines and periodically folded into KB_FILE
+KB_JOURNAL_FILE = "project_kb.journal.jsonl"
+# "json" (KB_FILE plus journal, the default) or "sqlite" (one row per entry in
+# KB_SQLITE_FILE, searched with FTS5). Move data between them with
+# `python kb_sqlite.py import|export project_kb.json project_kb.sqlite3`.
+KB_BACKEND = os.environ.get("KB_BACKEND", "json")
+KB_SQLITE_FILE = "project_kb.sqlite3"
+# The "default" project uses the files above in the working directory; every other
+# project keeps the same files in KB_PROJECTS_DIR/<project id>/
+DEFAULT_PROJECT = "default"
+KB_PROJECTS_DIR = "projects"
 
-# Initialize the language model
-llm = ChatOpenAI(model="gpt-3.5-turbo")
+# Token budget for the KB context injected into each prompt. Knowledge bases smaller
+# than KB_FULL_CONTEXT_TOKENS are always sent whole.
+KB_TOKEN_BUDGET = int(os.environ.get("KB_TOKEN_BUDGET", 2000))
+KB_FULL_CONTEXT_TOKENS = int(os.environ.get("KB_FULL_CONTEXT_TOKENS", 1000))
 
-def read_knowledge_base():
-    if os.path.exists(KB_FILE):
-        with open(KB_FILE, 'r') as f:
-            return json.load(f)
-    return {
-        "project_overview": {},
-        "scope": {},
-        "schedule": {},
-        "cost": {},
-        "quality": {},
-        "resource": {},
-        "communications": {},
-        "risk": {},
-        "procurement": {},
-        "stakeholder": {}
-    }
+# Token counts, KB context sizes, stage timings and retries of every turn.
+# AGENT_METRICS_LOG=path (or "-" for stderr) writes each observation as a JSON line;
+# AGENT_METRICS_FILE=path.json (or .prom) dumps the totals at exit.
+metrics = MetricsRegistry(event_log=os.environ.get("AGENT_METRICS_LOG"))
+AGENT_METRICS_FILE = os.environ.get("AGENT_METRICS_FILE")
+# LangChain's chain-by-chain printing; AGENT_VERBOSE=0 leaves only the metrics above
+AGENT_VERBOSE = os.environ.get("AGENT_VERBOSE", "1") == "1"
+
+@functools.cache
+def _callbacks():
+    # The LangChain callback handlers, defined on first use: importing
+    # langchain_core.callbacks is most of what importing this module would cost
+    from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackHandler
+
+    class _LLMUsageHandler(BaseCallbackHandler):
+        """Records the tokens and time of every LLM call made on behalf of one agent.
+
+        Streaming responses carry no usage data, so token counts fall back to the same
+        characters-per-token estimate used for the KB budget.
+        """
+
+        def __init__(self, agent_name):
+            self.agent_name = agent_name
+            self._calls = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            prompt_tokens = sum(estimate_tokens(str(message.content)) for batch in messages for message in batch)
+            self._calls[run_id] = (time.perf_counter(), prompt_tokens)
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            start, prompt_tokens = self._calls.pop(run_id, (None, 0))
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            completion_tokens = usage.get("completion_tokens")
+            if completion_tokens is None:
+                completion_tokens = sum(estimate_tokens(g.text) for gens in response.generations for g in gens)
+            metrics.inc("llm_calls", agent=self.agent_name)
+            metrics.inc("prompt_tokens", usage.get("prompt_tokens", prompt_tokens), agent=self.agent_name)
+            metrics.inc("completion_tokens", completion_tokens, agent=self.agent_name)
+            if start is not None:
+                metrics.observe("llm_seconds", time.perf_counter() - start, agent=self.agent_name)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._calls.pop(run_id, None)
+            metrics.inc("llm_errors", agent=self.agent_name)
+
+        def on_retry(self, retry_state, **kwargs):
+            metrics.inc("llm_retries", agent=self.agent_name)
+
+    class _ToolUseHandler(BaseCallbackHandler):
+        def __init__(self):
+            self.used = False
+
+        def on_tool_start(self, serialized, input_str, **kwargs):
+            self.used = True
+
+    class _TokenQueueHandler(BaseCallbackHandler):
+        def __init__(self, tokens):
+            self.tokens = tokens
+
+        def on_llm_new_token(self, token, **kwargs):
+            if token:
+                self.tokens.put(token)
+
+    class _AsyncTokenQueueHandler(AsyncCallbackHandler):
+        def __init__(self, tokens):
+            self.tokens = tokens
+
+        async def on_llm_new_token(self, token, **kwargs):
+            if token:
+                self.tokens.put_nowait(token)
+
+    return types.SimpleNamespace(LLMUsageHandler=_LLMUsageHandler, ToolUseHandler=_ToolUseHandler,
+                                 TokenQueueHandler=_TokenQueueHandler,
+                                 AsyncTokenQueueHandler=_AsyncTokenQueueHandler)
+
+PM_CATEGORIES = [
+    "project_overview",
+    "scope",
+    "schedule",
+    "cost",
+    "quality",
+    "resource",
+    "communications",
+    "risk",
+    "procurement",
+    "stakeholder",
+]
+
+def default_knowledge_base():
+    return {category: {} for category in PM_CATEGORIES}
+
+def _open_project(project_id):
+    directory = "" if project_id == DEFAULT_PROJECT else os.path.join(KB_PROJECTS_DIR, project_id)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if KB_BACKEND == "sqlite":
+        store = SQLiteKBStore(os.path.join(directory, KB_SQLITE_FILE), default_knowledge_base)
+        project = ProjectKB(project_id, store, FTSIndex(store))
+    else:
+        store = JournaledKBStore(os.path.join(directory, KB_FILE), default_knowledge_base,
+                                 journal_path=os.path.join(directory, KB_JOURNAL_FILE))
+        project = ProjectKB(project_id, store, KBIndex())
+    # Reopened after an LRU eviction: keep watching it for its subscribers
+    if project_id in _watch_subscriptions.values():
+        _watch(project)
+    return project
+
+# Open project KBs, each parsed once and shared by the agents, the tool and the UIs
+kb_projects = ProjectRegistry(_open_project)
+
+# The project the current turn works on. The agents and get_kb_tool are shared by all
+# projects; they find their KB through this variable.
+current_project = contextvars.ContextVar("current_project", default=DEFAULT_PROJECT)
+# The conversation the current turn belongs to, for its chat history
+current_session = contextvars.ContextVar("current_session", default="default")
+
+def project_kb(project_id=None):
+    # The project may be closed by an LRU eviction once others are opened; use
+    # using_project() to keep it open while working on it
+    return kb_projects.get(project_id or current_project.get())
+
+def using_project(project_id=None):
+    return kb_projects.use(project_id or current_project.get())
+
+def turn_context(project_id=None, session_id=None):
+    # A copy of the current context with the given project and conversation selected
+    context = contextvars.copy_context()
+    if project_id is not None:
+        context.run(current_project.set, project_id)
+    if session_id is not None:
+        context.run(current_session.set, session_id)
+    return context
+
+# Every change to a project KB made through this module, plus edits by other
+# processes for projects someone subscribed to with subscribe_kb_changes
+kb_events = KBEventBus()
+_watch_subscriptions = {}       # callback -> project id, for subscribe_kb_changes
+_watch_lock = threading.Lock()
+_publish_lock = threading.Lock()
+
+def subscribe_kb_changes(callback, project_id=None):
+    """Call callback(KBChange) after every change to a project KB (the current one
+    by default), including edits to its files by other processes.
+
+    The callback runs on the thread that made the change, or on the file watcher's
+    thread; a GUI should pass the event on to its own thread. The same change may
+    occasionally be delivered twice.
+    """
+    project = project_kb(project_id)
+    with _watch_lock:
+        _watch_subscriptions[callback] = project.project_id
+    kb_events.subscribe(callback, project.project_id)
+    _watch(project)
+    return callback
+
+def unsubscribe_kb_changes(callback):
+    kb_events.unsubscribe(callback)
+    with _watch_lock:
+        project_id = _watch_subscriptions.pop(callback, None)
+        if project_id is None or project_id in _watch_subscriptions.values():
+            return
+    # Not under _watch_lock: opening a project takes the registry lock and then _watch_lock
+    project = kb_projects.peek(project_id)
+    if project is not None:
+        with _watch_lock:
+            watcher, project.watcher = project.watcher, None
+        if watcher is not None:
+            watcher.stop()
+
+def _watch(project):
+    with _watch_lock:
+        if project.watcher is not None:
+            return
+        paths = project.files()
+        if KB_BACKEND == "sqlite":
+            paths += [path + "-wal" for path in paths]
+        with _publish_lock:
+            if project.published is None:
+                project.published = project.store.read()
+        project.watcher = KBFileWatcher(paths, lambda: _kb_file_changed(project)).start()
+
+def _kb_file_changed(project):
+    # Runs on the watcher thread. Our own writes wake it up too, but by then the
+    # store already holds the KB they wrote and it has been published.
+    with _publish_lock:
+        old = project.published
+        indexed_version = project.index.signature
+        kb = project.store.read()
+        if kb is old:
+            return
+        paths = changed_paths(diff(old or {}, kb))
+        if not paths:
+            project.published = kb
+            return
+    if old is not None and indexed_version == project.store.version - 1:
+        project.index.update(kb, paths, project.store.version)
+    else:
+        project.index.build(kb, project.store.version)
+    _kb_changed(project, kb, paths, "file")
+
+def read_knowledge_base(project_id=None):
+    # Shared, cached copy: do not modify it in place, use project_kb().store.snapshot() for that
+    with using_project(project_id) as project:
+        return project.store.read()
 
 def write_knowledge_base(kb):
-    with open(KB_FILE, 'w') as f:
-        json.dump(kb, f, indent=2)
+    with using_project() as project:
+        old = project.store.read()
+        project.store.write(kb)
+        project.index.build(kb, project.store.version)
+        _kb_changed(project, kb, changed_paths(diff(old, kb)), "write")
+
+def update_knowledge_base(mutate):
+    # Optimistic read-modify-write: mutate is replayed on a fresh copy if another
+    # process wrote the KB in the meantime, so concurrent updates are not lost
+    with using_project() as project:
+        old = project.store.read()
+        retries = project.store.retries
+        with metrics.timer("stage_seconds", stage="write"):
+            project.store.update(mutate)
+        if project.store.retries > retries:
+            metrics.inc("kb_write_retries", project.store.retries - retries)
+        kb = project.store.read()
+        project.index.build(kb, project.store.version)
+        _kb_changed(project, kb, changed_paths(diff(old, kb)), "update")
+
+def _kb_changed(project, kb, paths, source):
+    with _publish_lock:
+        project.published = kb
+    kb_events.publish(KBChange(project.project_id, paths, project.store.version, source))
+
+def patch_knowledge_base(ops):
+    """Apply kb_patch operations (add/replace/remove/append on JSON Pointer paths).
+
+    Only the changed paths are copied and re-indexed, and the applied operations
+    are appended to KB_JOURNAL_FILE. Operations outside the known categories or
+    that don't fit the current KB are skipped, and so are operations that would
+    remove a whole category or make it anything but an object. Returns the applied
+    operations.
+    """
+    known = []
+    for op in ops:
+        problem = _update_op_problem(op)
+        if problem is None:
+            known.append(op)
+        else:
+            _report_patch_error(op, problem)
+    with using_project() as project:
+        indexed_version = project.index.signature
+        with metrics.timer("stage_seconds", stage="write"):
+            applied = project.store.apply_patch(known, on_error=_report_patch_error)
+        metrics.inc("kb_ops_applied", len(applied))
+        if applied:
+            kb = project.store.read()
+            if indexed_version == project.store.version - 1:
+                project.index.update(kb, changed_paths(applied), project.store.version)
+            else:
+                project.index.build(kb, project.store.version)
+            _kb_changed(project, kb, changed_paths(applied), "patch")
+    return applied
+
+def _update_op_problem(op):
+    # Why an operation from the update agent must not be applied, or None
+    try:
+        parts = parse_pointer(op["path"])
+    except (TypeError, KeyError, PatchError):
+        parts = None
+    if not parts or parts[0] not in PM_CATEGORIES:
+        return "unknown category"
+    if len(parts) == 1:
+        if op.get("op") in ("replace", "remove"):
+            return "a whole category cannot be replaced or removed"
+        if op.get("op") == "append" or not isinstance(op.get("value"), dict):
+            return "a category must stay an object"
+    return None
+
+def undo_kb_update(seq=None):
+    # Revert the latest KB update (or the journal entry with the given seq)
+    with using_project() as project:
+        applied = project.store.undo(seq)
+        if applied:
+            kb = project.store.read()
+            project.index.build(kb, project.store.version)
+            _kb_changed(project, kb, changed_paths(applied), "undo")
+    return applied
+
+def get_kb_context(kb, query):
+    # Keep the index in sync with edits made outside write_knowledge_base
+    with using_project() as project:
+        project.index.sync(kb, project.store.version)
+        return select_context(kb, project.index, query, KB_TOKEN_BUDGET, KB_FULL_CONTEXT_TOKENS)
 
 def get_knowledge_base(dummy: str) -> str:
     return json.dumps(read_knowledge_base())
 
-get_kb_tool = StructuredTool.from_function(
-    func=get_knowledge_base,
-    name="get_knowledge_base",
-    description="Retrieves the current project knowledge base"
-)
-
 # Agent for answering queries
 ANSWER_SYSTEM_PROMPT = """You are an AI assistant tasked with answering questions about a project using the provided knowledge base.
 Your goal is to provide informed and helpful answers based on the information available in the knowledge base.
 Always refer to the knowledge base first when answering questions.
 If the knowledge base doesn't contain relevant information, politely state that you don't have that information and suggest what kind of information might be helpful to add to the knowledge base."""
 
-answer_prompt = ChatPromptTemplate.from_messages([
-    ("system", ANSWER_SYSTEM_PROMPT),
-    MessagesPlaceholder(variable_name="chat_history"),
-    ("human", "{input}"),
-    MessagesPlaceholder(variable_name="agent_scratchpad"),
-])
-
-answer_agent = (
-    {
-        "input": lambda x: x["input"],
-        "agent_scratchpad": lambda x: format_to_openai_function_messages(x["intermediate_steps"]),
-        "chat_history": lambda x: x["chat_history"],
-    }
-    | answer_prompt
-    | llm
-    | OpenAIFunctionsAgentOutputParser()
-)
-
-answer_agent_executor = AgentExecutor(agent=answer_agent, tools=[get_kb_tool], verbose=True)
-
 # Agent for updating the knowledge base
 UPDATE_SYSTEM_PROMPT = """You are an AI assistant tasked with updating a project knowledge base based on new information from user interactions.
 Your goals are:
@@ -91,58 +360,582 @@ The knowledge base is structured around the following aspects of Project Managem
 - procurement
 - stakeholder
 
-Provide your updates as a JSON string that can be merged into the existing knowledge base."""
+Provide your updates as a JSON array of patch operations, and nothing else. Each operation has an "op", a "path" and (except for remove) a "value":
+- add: create or overwrite the value at path
+- replace: change a value that already exists
+- remove: delete the value at path
+- append: add one item to the list at path
+Paths are JSON Pointers starting with the category, for example:
+[{{"op": "add", "path": "/risk/vendor_delay", "value": "Main supplier may deliver two weeks late"}},
+ {{"op": "append", "path": "/scope/deliverables", "value": "User training"}}]
+Only include what changed. If nothing in the conversation should change the knowledge base, return []."""
 
-update_prompt = ChatPromptTemplate.from_messages([
-    ("system", UPDATE_SYSTEM_PROMPT),
-    ("human", "User message: {user_message}\nAI response: {ai_response}\nCurrent KB: {current_kb}\n\nProvide KB updates:"),
-])
+UPDATE_HUMAN_PROMPT = "User message: {user_message}\nAI response: {ai_response}\nCurrent KB: {current_kb}\n\nProvide KB updates:"
 
-update_agent = (
-    {
-        "user_message": lambda x: x["user_message"],
-        "ai_response": lambda x: x["ai_response"],
-        "current_kb": lambda x: x["current_kb"],
-    }
-    | update_prompt
-    | llm
-    | OpenAIFunctionsAgentOutputParser()
-)
+# Folds older chat turns into the rolling summary kept by conversation_memory
+SUMMARY_SYSTEM_PROMPT = """You maintain a short running summary of a conversation between a user and a project management assistant.
+Merge the new turns into the existing summary. Keep decisions, open questions and facts about the project; drop greetings and repetition.
+Answer with the updated summary only, in at most five sentences."""
 
-update_agent_executor = AgentExecutor(agent=update_agent, tools=[], verbose=True)
+SUMMARY_HUMAN_PROMPT = "Existing summary: {summary}\n\nNew turns:\n{turns}\n\nUpdated summary:"
 
-def process_user_input(user_input):
-    # Step 1: Answer the query using the knowledge base
-    knowledge_base = read_knowledge_base()
-    kb_context = json.dumps(knowledge_base, indent=2)  # Convert the knowledge base to a formatted string
+def _summary_inputs(summary, turns):
+    text = "\n".join(f"User: {user_message}\nAI: {ai_response}" for user_message, ai_response in turns)
+    return {"summary": summary or "(none)", "turns": text}
 
-    answer_response = answer_agent_executor.invoke({
-        "input": f"Knowledge Base:\n{kb_context}\n\nUser Question: {user_input}",
-        "chat_history": []   # not using chat history for now
-    })
-    
-    ai_response = answer_response['output']
+def summarize_conversation(summary, turns):
+    with metrics.timer("stage_seconds", stage="summary"):
+        return get_agents().summary_chain.invoke(_summary_inputs(summary, turns),
+                                                  config={"callbacks": [_callbacks().LLMUsageHandler("summary")]}).content
 
-    # Step 2: Update the knowledge base
-    update_response = update_agent_executor.invoke({
-        "user_message": user_input,
+async def asummarize_conversation(summary, turns):
+    agents = await _aget_agents()
+    with metrics.timer("stage_seconds", stage="summary"):
+        response = await agents.summary_chain.ainvoke(_summary_inputs(summary, turns),
+                                                       config={"callbacks": [_callbacks().LLMUsageHandler("summary")]})
+    return response.content
+
+def build_agents(model):
+    # LangChain is imported here rather than at the top of the module, see get_agents()
+    from langchain.agents import AgentExecutor
+    from langchain.agents.format_scratchpad import format_to_openai_function_messages
+    from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
+    from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain.tools import StructuredTool
+
+    get_kb_tool = StructuredTool.from_function(
+        func=get_knowledge_base,
+        name="get_knowledge_base",
+        description="Retrieves the current project knowledge base"
+    )
+
+    answer_prompt = ChatPromptTemplate.from_messages([
+        ("system", ANSWER_SYSTEM_PROMPT),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{input}"),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ])
+    update_prompt = ChatPromptTemplate.from_messages([
+        ("system", UPDATE_SYSTEM_PROMPT),
+        ("human", UPDATE_HUMAN_PROMPT),
+    ])
+
+    answer_agent = (
+        {
+            "input": lambda x: x["input"],
+            "agent_scratchpad": lambda x: format_to_openai_function_messages(x["intermediate_steps"]),
+            "chat_history": lambda x: x["chat_history"],
+        }
+        | answer_prompt
+        | model
+        | OpenAIFunctionsAgentOutputParser()
+    )
+
+    update_agent = (
+        {
+            "user_message": lambda x: x["user_message"],
+            "ai_response": lambda x: x["ai_response"],
+            "current_kb": lambda x: x["current_kb"],
+        }
+        | update_prompt
+        | model
+        | OpenAIFunctionsAgentOutputParser()
+    )
+
+    return (
+        AgentExecutor(agent=answer_agent, tools=[get_kb_tool], verbose=AGENT_VERBOSE),
+        AgentExecutor(agent=update_agent, tools=[], verbose=AGENT_VERBOSE),
+    )
+
+class _Agents:
+    def __init__(self, model):
+        from langchain.prompts import ChatPromptTemplate
+        self.llm = model
+        self.answer_executor, self.update_executor = build_agents(model)
+        self.summary_chain = ChatPromptTemplate.from_messages([
+            ("system", SUMMARY_SYSTEM_PROMPT),
+            ("human", SUMMARY_HUMAN_PROMPT),
+        ]) | model
+
+# Importing LangChain and the OpenAI client takes seconds, so the agents are built on
+# first use (or ahead of time by warm_up()) and importing this module stays fast: a UI
+# can show its window before paying for them.
+_agents = None
+_agents_lock = threading.Lock()
+
+def get_agents():
+    global _agents
+    if _agents is None:
+        with _agents_lock:
+            if _agents is None:
+                from langchain_openai import ChatOpenAI
+                # Streaming makes tokens available to stream_user_input as they
+                # arrive; invoke() still returns the whole message.
+                _agents = _Agents(ChatOpenAI(model="gpt-3.5-turbo", streaming=True,
+                                             api_key=os.environ["OPENAI_API_KEY"]))
+    return _agents
+
+async def _aget_agents():
+    # Build the agents off the event loop the first time
+    if _agents is None:
+        return await asyncio.to_thread(get_agents)
+    return _agents
+
+def warm_up():
+    """Build the agents on a background thread; returns the thread.
+
+    Call it once the window is up so the first message doesn't wait for the imports.
+    """
+    thread = threading.Thread(target=_warm_up, name="agent-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def _warm_up():
+    try:
+        get_agents()
+    except Exception as e:
+        # The first turn tries again and reports the error to the user
+        print(f"Error: could not set up the agents: {e}")
+
+def use_llm(model):
+    # Swap the chat model, e.g. for a local fake model in tests and benchmarks
+    global _agents
+    with _agents_lock:
+        _agents = _Agents(model)
+
+# Older callers use these as module attributes
+_AGENT_ATTRIBUTES = {"llm": "llm", "answer_agent_executor": "answer_executor",
+                     "update_agent_executor": "update_executor"}
+
+def __getattr__(name):
+    if name in _AGENT_ATTRIBUTES:
+        return getattr(get_agents(), _AGENT_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# KB updates only affect future turns. With BACKGROUND_KB_UPDATES=1 they run on a
+# single background thread (so they stay ordered) and the answer is returned at once.
+BACKGROUND_KB_UPDATES = os.environ.get("BACKGROUND_KB_UPDATES", "0") == "1"
+
+# Pure questions ("What is the schedule?") can't add anything to the KB; a local
+# classifier skips the update agent for them. KB_UPDATE_CLASSIFIER=0 runs it on every turn.
+KB_UPDATE_CLASSIFIER = os.environ.get("KB_UPDATE_CLASSIFIER", "1") == "1"
+turn_classifier = TurnClassifier()
+
+_update_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-update")
+_pending_updates = []
+_pending_updates_lock = threading.Lock()
+
+def _update_inputs(turns):
+    # Several turns are numbered and passed in one prompt, so one update call (and
+    # one KB commit) covers all of them
+    if len(turns) == 1:
+        user_message, ai_response = turns[0]
+    else:
+        user_message = "\n".join(f"[Turn {i}] {u}" for i, (u, _) in enumerate(turns, 1))
+        ai_response = "\n".join(f"[Turn {i}] {a}" for i, (_, a) in enumerate(turns, 1))
+    with metrics.timer("stage_seconds", stage="kb_read"):
+        knowledge_base = read_knowledge_base()
+        kb_context = get_kb_context(knowledge_base, f"{user_message} {ai_response}")
+    metrics.observe("kb_context_bytes", len(kb_context.encode("utf-8")), agent="update")
+    return {
+        "user_message": user_message,
         "ai_response": ai_response,
         "current_kb": kb_context
-    })
+    }
 
-    # Parse the JSON string returned by the update agent
+def update_kb_from_turn(user_input, ai_response):
+    update_kb_from_turns([(user_input, ai_response)])
+
+def update_kb_from_turns(turns):
+    inputs = _update_inputs(turns)
+    with metrics.timer("stage_seconds", stage="update"):
+        update_response = get_agents().update_executor.invoke(inputs, config=_update_config())
+
+    kb_updates = _parse_kb_updates(update_response['output'])
+    if kb_updates:
+        patch_knowledge_base(kb_updates)
+
+async def aupdate_kb_from_turn(user_input, ai_response):
+    inputs = _update_inputs([(user_input, ai_response)])
+    with metrics.timer("stage_seconds", stage="update"):
+        update_response = await (await _aget_agents()).update_executor.ainvoke(inputs, config=_update_config())
+    kb_updates = _parse_kb_updates(update_response['output'])
+    if kb_updates:
+        # The write takes a file lock and fsyncs; keep it off the event loop
+        await asyncio.to_thread(patch_knowledge_base, kb_updates)
+
+def _update_config():
+    return {"callbacks": [_callbacks().LLMUsageHandler("update")]}
+
+def _parse_kb_updates(output):
+    with metrics.timer("stage_seconds", stage="parse"):
+        kb_updates = _parse_patch(output)
+    if kb_updates is None:
+        metrics.inc("kb_update_parse_errors")
+    return kb_updates
+
+def _parse_patch(output):
+    # Parse the patch returned by the update agent. Models sometimes wrap it in a
+    # markdown code fence, and older prompts produced a dict to merge instead.
+    text = output.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
     try:
-        kb_updates = json.loads(update_response['output'])
-        kb = read_knowledge_base()
-        for category, updates in kb_updates.items():
-            if category in kb:
-                kb[category].update(updates)
-        write_knowledge_base(kb)
+        kb_updates = json.loads(text)
     except json.JSONDecodeError:
         print("Error: Could not parse knowledge base updates.")
+        return None
+    if isinstance(kb_updates, dict):
+        kb_updates = merge_to_patch(kb_updates)
+    if not isinstance(kb_updates, list):
+        print("Error: Knowledge base updates must be a list of patch operations.")
+        return None
+    return kb_updates
+
+def _report_patch_error(op, error):
+    print(f"Error: Skipping knowledge base update {op!r}: {error}")
+
+def _run_kb_update(turns):
+    try:
+        update_kb_from_turns(turns)
+    except Exception as e:
+        print(f"Error: Knowledge base update failed: {e}")
+
+def submit_kb_update(user_input, ai_response):
+    # The update runs on another thread; take the current project along
+    return _submit_kb_update(contextvars.copy_context(), [(user_input, ai_response)])
+
+def _submit_kb_update(context, turns):
+    with _pending_updates_lock:
+        try:
+            future = _update_executor.submit(context.run, _run_kb_update, turns)
+        except RuntimeError:
+            # The interpreter is exiting (batches flushed at exit): run it here
+            context.run(_run_kb_update, turns)
+            return None
+        _pending_updates.append(future)
+    future.add_done_callback(_forget_update)
+    return future
+
+# With KB_UPDATE_BATCH_SIZE > 1, turns are collected per project and every batch
+# (KB_UPDATE_BATCH_SIZE turns, or KB_UPDATE_BATCH_SECONDS after its first turn)
+# is sent to the update agent in one call on the update thread.
+kb_update_batcher = UpdateBatcher(
+    lambda project_id, turns: _submit_kb_update(turn_context(project_id), turns))
+
+def _forget_update(future):
+    with _pending_updates_lock:
+        if future in _pending_updates:
+            _pending_updates.remove(future)
+
+def flush_kb_updates(timeout=None):
+    """Send buffered batches and wait for queued background KB updates.
+
+    Returns True if none are left pending.
+    """
+    kb_update_batcher.flush()
+    return _wait_for_kb_updates(timeout)
+
+def _wait_for_kb_updates(timeout=None):
+    # Buffered turns stay buffered: with batching the KB may lag by up to one batch
+    with _pending_updates_lock:
+        pending = list(_pending_updates)
+    _, not_done = concurrent.futures.wait(pending, timeout=timeout)
+    return not not_done
+
+def shutdown():
+    """Apply buffered and queued KB updates, then close the project KBs.
+
+    Call it before the program exits; the GUIs do when their window is closed.
+    It runs again at exit, but by then concurrent.futures accepts no new work and
+    LangChain runs part of every agent call on an executor, so turns still buffered
+    for a batch (KB_UPDATE_BATCH_SIZE > 1) can no longer reach the update agent.
+    """
+    flush_kb_updates()
+    # Leave an up-to-date project_kb.json behind for anyone reading the file directly
+    kb_projects.close_all()
+    if AGENT_METRICS_FILE:
+        metrics.dump(AGENT_METRICS_FILE)
+
+atexit.register(shutdown)
+
+# Answers to repeated questions, keyed on the normalized question and the KB context
+# it was answered from. RESPONSE_CACHE_SIZE=0 disables it.
+response_cache = ResponseCache()
+
+def _invalidate_cached_answers(change):
+    # Cached answers based on the changed categories are no longer valid
+    response_cache.invalidate(change.project_id, change.categories)
+
+kb_events.subscribe(_invalidate_cached_answers)
+
+# SEMANTIC_CACHE=1 also reuses answers to similar questions (paraphrases) asked
+# against the same KB version; needs numpy
+if os.environ.get("SEMANTIC_CACHE", "0") == "1":
+    from semantic_cache import SemanticCache
+    semantic_cache = SemanticCache()
+else:
+    semantic_cache = None
+
+# Chat history per conversation: recent turns verbatim, older ones summarized, within
+# CHAT_MEMORY_TOKENS tokens (0 disables history)
+conversations = ConversationStore(lambda summary, turns: summarize_conversation(summary, turns),
+                                  asummarize=lambda summary, turns: asummarize_conversation(summary, turns))
+
+def _chat_history():
+    if not conversations.enabled:
+        return []
+    return conversations.get(current_project.get(), current_session.get()).messages()
+
+def _remember_turn(user_input, ai_response):
+    if conversations.enabled:
+        conversations.get(current_project.get(), current_session.get()).add_turn(user_input, ai_response)
+
+async def _aremember_turn(user_input, ai_response):
+    # Folding old turns into the summary may call the LLM
+    if conversations.enabled:
+        await conversations.get(current_project.get(), current_session.get()).aadd_turn(user_input, ai_response)
+
+def _answer_context(user_input):
+    # Only the entries relevant to the question
+    with metrics.timer("stage_seconds", stage="kb_read"), using_project():
+        kb_context = get_kb_context(read_knowledge_base(), user_input)
+    metrics.observe("kb_context_bytes", len(kb_context.encode("utf-8")), agent="answer")
+    return kb_context
+
+def _cached_answer(user_input, kb_context, history):
+    # Returns (cache key, cached answer or None). The answer to a follow-up question
+    # depends on the conversation, so the history is part of its key; other answers
+    # are shared across turns and sessions.
+    follow_up = bool(history) and is_follow_up(user_input)
+    key = cache_key(current_project.get(), user_input, kb_context, history if follow_up else None)
+    cached = response_cache.get(key)
+    if cached is None and not follow_up and _semantic_cacheable(user_input):
+        match = semantic_cache.lookup(user_input, current_project.get(), project_kb().store.version)
+        if match is not None:
+            cached = match[0]
+    metrics.inc("answer_cache", result="miss" if cached is None else "hit")
+    return key, cached
+
+def _semantic_cacheable(user_input):
+    # Only informational turns: a paraphrase of an earlier update ("moved to March 3"
+    # vs "moved to April 9") must reach the update agent, not get the earlier reply
+    return semantic_cache is not None and mutation_score(user_input) < turn_classifier.threshold
+
+def _cache_answer(key, user_input, kb_context, ai_response, used_tool):
+    if key is None:
+        return
+    if used_tool:
+        # The agent read the whole KB through get_kb_tool
+        categories = {ALL_CATEGORIES}
+    else:
+        categories = {category for category, items in json.loads(kb_context).items() if items}
+    response_cache.put(key, ai_response, current_project.get(), categories)
+    if _semantic_cacheable(user_input) and not is_follow_up(user_input):
+        semantic_cache.store(user_input, ai_response, current_project.get(), project_kb().store.version)
+
+def _answer_inputs(user_input, kb_context, history):
+    return {
+        "input": f"Knowledge Base:\n{kb_context}\n\nUser Question: {user_input}",
+        "chat_history": history
+    }
+
+def _finish_turn(user_input, ai_response, background_update):
+    # The KB update only matters for future turns, so in background mode the answer
+    # is returned without waiting for it.
+    _remember_turn(user_input, ai_response)
+    if KB_UPDATE_CLASSIFIER and not turn_classifier.needs_update(user_input):
+        return
+    if KB_UPDATE_BATCH_SIZE > 1:
+        kb_update_batcher.add(current_project.get(), (user_input, ai_response))
+        return
+    if background_update is None:
+        background_update = BACKGROUND_KB_UPDATES
+    if background_update:
+        submit_kb_update(user_input, ai_response)
+    else:
+        update_kb_from_turn(user_input, ai_response)
+
+def process_user_input(user_input, background_update=None, project_id=None, session_id=None):
+    """Answer user_input from the KB of project_id (default: current_project) and update it."""
+    return turn_context(project_id, session_id).run(_process_user_input, user_input, background_update)
+
+def _process_user_input(user_input, background_update):
+    # Updates queued by earlier turns must land before this turn reads the KB
+    _wait_for_kb_updates()
+
+    # Repeated question on an unchanged KB: the answer and the KB update are both known
+    kb_context = _answer_context(user_input)
+    history = _chat_history()
+    key, cached = _cached_answer(user_input, kb_context, history)
+    if cached is not None:
+        _remember_turn(user_input, cached)
+        return cached
+
+    # Step 1: Answer the query using the knowledge base
+    callbacks = _callbacks()
+    tool_use = callbacks.ToolUseHandler()
+    with metrics.timer("stage_seconds", stage="answer"):
+        answer_response = get_agents().answer_executor.invoke(_answer_inputs(user_input, kb_context, history),
+                                                       config={"callbacks": [tool_use, callbacks.LLMUsageHandler("answer")]})
+    ai_response = answer_response['output']
+    _cache_answer(key, user_input, kb_context, ai_response, tool_use.used)
+
+    # Step 2: Update the knowledge base
+    _finish_turn(user_input, ai_response, background_update)
+
+    return ai_response
+
+async def aprocess_user_input(user_input, background_update=None, project_id=None, session_id=None):
+    """asyncio version of process_user_input, so one event loop can serve many conversations."""
+    return await asyncio.get_running_loop().create_task(
+        _aprocess_user_input(user_input, background_update), context=turn_context(project_id, session_id))
+
+async def _aprocess_user_input(user_input, background_update):
+    if _pending_updates:
+        await asyncio.to_thread(_wait_for_kb_updates)
+
+    # Selecting the context searches and serializes KB entries; keep it off the event loop
+    kb_context = await asyncio.to_thread(_answer_context, user_input)
+    history = _chat_history()
+    key, cached = _cached_answer(user_input, kb_context, history)
+    if cached is not None:
+        await _aremember_turn(user_input, cached)
+        return cached
+
+    # Builds the agents off the event loop, which also imports langchain_core.callbacks
+    agents = await _aget_agents()
+    callbacks = _callbacks()
+    tool_use = callbacks.ToolUseHandler()
+    with metrics.timer("stage_seconds", stage="answer"):
+        answer_response = await agents.answer_executor.ainvoke(
+            _answer_inputs(user_input, kb_context, history),
+            config={"callbacks": [tool_use, callbacks.LLMUsageHandler("answer")]})
+    ai_response = answer_response['output']
+    _cache_answer(key, user_input, kb_context, ai_response, tool_use.used)
+
+    await _afinish_turn(user_input, ai_response, background_update)
 
     return ai_response
 
+async def _afinish_turn(user_input, ai_response, background_update):
+    await _aremember_turn(user_input, ai_response)
+    if KB_UPDATE_CLASSIFIER and not turn_classifier.needs_update(user_input):
+        return
+    if KB_UPDATE_BATCH_SIZE > 1:
+        kb_update_batcher.add(current_project.get(), (user_input, ai_response))
+        return
+    if background_update is None:
+        background_update = BACKGROUND_KB_UPDATES
+    if background_update:
+        submit_kb_update(user_input, ai_response)
+    else:
+        await aupdate_kb_from_turn(user_input, ai_response)
+
+_STREAM_DONE = object()
+
+def stream_user_input(user_input, background_update=None, project_id=None, session_id=None):
+    """Like process_user_input, but yields the answer piece by piece as the LLM produces it.
+
+    The KB update runs once the answer is complete, before the generator is exhausted
+    (or in the background, as with process_user_input).
+    """
+    # Not set in the generator itself: that would leak into the caller between yields
+    context = turn_context(project_id, session_id)
+    _wait_for_kb_updates()
+
+    kb_context = context.run(_answer_context, user_input)
+    history = context.run(_chat_history)
+    key, cached = context.run(_cached_answer, user_input, kb_context, history)
+    if cached is not None:
+        yield cached
+        context.run(_remember_turn, user_input, cached)
+        return
+
+    tokens = queue.Queue()
+    result = {}
+    callbacks = _callbacks()
+    tool_use = callbacks.ToolUseHandler()
+
+    def run_answer_agent():
+        try:
+            with metrics.timer("stage_seconds", stage="answer"):
+                result["response"] = get_agents().answer_executor.invoke(
+                    _answer_inputs(user_input, kb_context, history),
+                    config={"callbacks": [callbacks.TokenQueueHandler(tokens), tool_use,
+                                          callbacks.LLMUsageHandler("answer")]},
+                )
+        except BaseException as e:
+            result["error"] = e
+        finally:
+            tokens.put(_STREAM_DONE)
+
+    threading.Thread(target=context.run, args=(run_answer_agent,), name="answer-stream", daemon=True).start()
+
+    streamed = []
+    while True:
+        token = tokens.get()
+        if token is _STREAM_DONE:
+            break
+        streamed.append(token)
+        yield token
+
+    if "error" in result:
+        raise result["error"]
+    ai_response = result["response"]['output']
+    # Models that don't stream (or answers produced without an LLM token stream)
+    # arrive in one piece
+    if not streamed:
+        yield ai_response
+
+    context.run(_cache_answer, key, user_input, kb_context, ai_response, tool_use.used)
+    context.run(_finish_turn, user_input, ai_response, background_update)
+
+async def astream_user_input(user_input, background_update=None, project_id=None, session_id=None):
+    """Async iterator counterpart of stream_user_input."""
+    context = turn_context(project_id, session_id)
+    loop = asyncio.get_running_loop()
+    if _pending_updates:
+        await asyncio.to_thread(_wait_for_kb_updates)
+
+    kb_context = await loop.run_in_executor(None, context.run, _answer_context, user_input)
+    history = context.run(_chat_history)
+    key, cached = context.run(_cached_answer, user_input, kb_context, history)
+    if cached is not None:
+        yield cached
+        await loop.create_task(_aremember_turn(user_input, cached), context=context)
+        return
+
+    tokens = asyncio.Queue()
+    agents = await _aget_agents()
+    callbacks = _callbacks()
+    tool_use = callbacks.ToolUseHandler()
+    task = loop.create_task(agents.answer_executor.ainvoke(
+        _answer_inputs(user_input, kb_context, history),
+        config={"callbacks": [callbacks.AsyncTokenQueueHandler(tokens), tool_use, callbacks.LLMUsageHandler("answer")]},
+    ), context=context)
+    task.add_done_callback(lambda _: tokens.put_nowait(_STREAM_DONE))
+
+    streamed = False
+    try:
+        while True:
+            token = await tokens.get()
+            if token is _STREAM_DONE:
+                break
+            streamed = True
+            yield token
+    finally:
+        # The consumer went away (e.g. a client disconnected); stop the LLM call
+        if not task.done():
+            task.cancel()
+
+    ai_response = task.result()['output']
+    if not streamed:
+        yield ai_response
+
+    context.run(_cache_answer, key, user_input, kb_context, ai_response, tool_use.used)
+    await loop.create_task(_afinish_turn(user_input, ai_response, background_update), context=context)
+
 """ if __name__ == "__main__":
     chat_history = []
     while True:
@@ -152,4 +945,4 @@ def process_user_input(user_input):
         response = process_user_input(user_input, chat_history)
         print("AI:", response)
         chat_history.append(("human", user_input))
-        chat_history.append(("ai", response)) """
+        chat_history.append(("ai", response)) """
\ No newline at end of file
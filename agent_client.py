@@ -0,0 +1,88 @@
+import codecs
+import http.client
+import json
+import os
+import threading
+import uuid
+from urllib.parse import urlsplit
+
+# Thin-client drop-in for the agent functions the GUIs use, talking to server.py.
+# Enabled in the GUIs by setting PM_AGENT_URL, e.g. http://127.0.0.1:8765
+AGENT_URL = os.environ.get("PM_AGENT_URL", "http://127.0.0.1:8765")
+
+# One conversation per GUI process
+SESSION_ID = uuid.uuid4().hex
+# Project KB to work on (the server's default project if unset)
+PROJECT_ID = os.environ.get("PM_PROJECT")
+
+_local = threading.local()
+
+
+def _connection():
+    # Keep-alive: each thread reuses one HTTP/1.1 connection to the server
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        url = urlsplit(AGENT_URL)
+        conn = _local.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=300)
+    return conn
+
+
+def _request(method, path, body=None):
+    payload = None if body is None else json.dumps(body).encode("utf-8")
+    headers = {"Content-Type": "application/json"} if payload is not None else {}
+    conn = _connection()
+    try:
+        conn.request(method, path, body=payload, headers=headers)
+        response = conn.getresponse()
+    except (http.client.HTTPException, ConnectionError):
+        # The server closed the idle connection; reconnect once
+        conn.close()
+        conn.request(method, path, body=payload, headers=headers)
+        response = conn.getresponse()
+    if response.status != 200:
+        raise RuntimeError(f"Agent server error {response.status}: {response.read().decode('utf-8', 'replace')}")
+    return response
+
+
+def process_user_input(user_input, background_update=None):
+    body = {"message": user_input, "background_update": background_update, "project_id": PROJECT_ID}
+    response = _request("POST", f"/sessions/{SESSION_ID}/answer", body)
+    return json.loads(response.read())["response"]
+
+
+def stream_user_input(user_input, background_update=None):
+    body = {"message": user_input, "background_update": background_update, "project_id": PROJECT_ID}
+    response = _request("POST", f"/sessions/{SESSION_ID}/stream", body)
+    # A multi-byte character can be split across chunks
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    while True:
+        chunk = response.read1(4096)
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+
+def warm_up():
+    # The server builds its agents when it starts
+    return None
+
+
+def shutdown():
+    # The server applies its pending KB updates when it stops
+    return None
+
+
+def read_knowledge_base():
+    path = "/kb" if PROJECT_ID is None else f"/kb?project={PROJECT_ID}"
+    return json.loads(_request("GET", path).read())
+
+
+def subscribe_kb_changes(callback, project_id=None):
+    # server.py does not push KB changes; returns None so the GUIs reload after each turn
+    return None
+
+
+def unsubscribe_kb_changes(callback):
+    return None
@@ -0,0 +1,123 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AgentWorker:
+    """Runs agent calls off the GUI thread.
+
+    `post` is the toolkit's "run this on the GUI thread" function (wx.CallAfter,
+    or a queue in the headless harness); results and errors are always delivered
+    through it, so callbacks can touch widgets. With the default single worker,
+    requests submitted while one is running are queued and answered in order.
+    Every request ends in exactly one callback: on_done, on_error, or on_cancel
+    (without arguments) when it was cancelled, so the GUI can always reset its
+    status. Nothing is posted any more after shutdown().
+    """
+
+    def __init__(self, func, post, max_workers=1):
+        self.func = func
+        self.post = post
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        self._pending = []
+        self._discarded = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def submit(self, message, on_done, on_error=None, on_cancel=None):
+        with self._lock:
+            future = self._executor.submit(self.func, message)
+            self._pending.append(future)
+        future.add_done_callback(lambda f: self._finish(f, on_done, on_error, on_cancel))
+        return future
+
+    def _finish(self, future, on_done, on_error, on_cancel):
+        with self._lock:
+            if future in self._pending:
+                self._pending.remove(future)
+            discarded = future in self._discarded
+            self._discarded.discard(future)
+            closed = self._closed
+        if closed:
+            return
+        if future.cancelled() or discarded:
+            if on_cancel is not None:
+                self.post(on_cancel)
+            return
+        error = future.exception()
+        if error is None:
+            self.post(on_done, future.result())
+        elif on_error is not None:
+            self.post(on_error, error)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def cancel_pending(self):
+        # Queued requests are dropped; a request already talking to the LLM cannot be
+        # interrupted, so its result is discarded when it arrives instead. Either way
+        # the request no longer counts as pending.
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            if not future.cancel():
+                with self._lock:
+                    # Unless it finished in the meantime
+                    if future in self._pending:
+                        self._pending.remove(future)
+                        self._discarded.add(future)
+        return len(pending)
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            self._closed = True
+        self.cancel_pending()
+        self._executor.shutdown(wait=wait)
+
+
+class TokenThrottle:
+    """Coalesces streamed tokens so the GUI repaints at most once per `interval`.
+
+    push() is called from the worker thread for every token; the accumulated text is
+    handed to `on_text` through `post`. The first token goes out immediately, later
+    ones are batched, and close() delivers whatever is left.
+    """
+
+    def __init__(self, post, on_text, interval=0.05):
+        self.post = post
+        self.on_text = on_text
+        self.interval = interval
+        self._buffer = []
+        self._last_flush = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def push(self, text):
+        with self._lock:
+            self._buffer.append(text)
+            wait = self._last_flush + self.interval - time.monotonic()
+            if wait > 0:
+                # A flush is due soon; make sure one is scheduled so a pause in the
+                # stream doesn't leave text sitting in the buffer
+                if self._timer is None:
+                    self._timer = threading.Timer(wait, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            text = "".join(self._buffer)
+            self._buffer = []
+            self._last_flush = time.monotonic()
+            # Post while holding the lock so chunks reach the GUI in order
+            if text:
+                self.post(self.on_text, text)
+
+    def close(self):
+        self.flush()
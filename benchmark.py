@@ -0,0 +1,818 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import tracemalloc
+
+from agent_worker import AgentWorker
+from chat_layout import ChatLayout
+from kb_events import KBFileWatcher
+from kb_index import KBIndex
+from kb_journal import JournaledKBStore
+from kb_patch import apply_patch, changed_keys
+from kb_sqlite import SQLiteKBStore
+from kb_store import KBStore, atomic_write
+from resize_controller import ResizeController
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# ---------------------------------------------------------------------------
+# KB write stress test: many processes doing read-modify-write on one KB file
+
+def _open_stress_store(kb_path, journal):
+    if journal:
+        # Small compaction interval so compaction races with the other writers too
+        return JournaledKBStore(kb_path, dict, compact_every=25)
+    return KBStore(kb_path, dict)
+
+
+def _stress_writer(kb_path, writer_id, updates, journal):
+    store = _open_stress_store(kb_path, journal)
+    for i in range(updates):
+        def add_entry(kb):
+            kb.setdefault("stress", {})[f"writer{writer_id}-{i}"] = i
+        store.update(add_entry, max_retries=1000)
+
+
+def run_stress(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        kb_path = os.path.join(tmp, "project_kb.json")
+        _open_stress_store(kb_path, args.journal).write({"stress": {}})
+
+        start = time.perf_counter()
+        procs = [
+            multiprocessing.Process(target=_stress_writer, args=(kb_path, w, args.updates, args.journal))
+            for w in range(args.writers)
+        ]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - start
+
+        kb = _open_stress_store(kb_path, args.journal).read()
+
+    expected = {f"writer{w}-{i}" for w in range(args.writers) for i in range(args.updates)}
+    lost = expected - set(kb["stress"])
+    failed = [p.exitcode for p in procs if p.exitcode != 0]
+    print(f"{args.writers} writers x {args.updates} updates in {elapsed:.2f}s, "
+          f"{len(lost)} lost updates, {len(failed)} failed writers")
+    return 1 if lost or failed else 0
+
+
+# ---------------------------------------------------------------------------
+# Headless GUI harness: how long does the event loop stall while the agent works?
+
+UI_TICK = 0.005
+
+
+def _fake_agent(latency):
+    def respond(message):
+        time.sleep(latency)
+        return f"Answer to {message}"
+    return respond
+
+
+def _measure_ui_stall(mode, requests, latency):
+    # Stand-in for the wx main loop: runs callbacks posted with "CallAfter" and
+    # records how late each tick is
+    posted = queue.SimpleQueue()
+    post = lambda func, *args: posted.put((func, args))
+    agent = _fake_agent(latency)
+    answered = []
+    worker = AgentWorker(agent, post) if mode == "worker" else None
+
+    def send(message):
+        if worker is not None:
+            worker.submit(message, answered.append)
+        else:
+            answered.append(agent(message))
+
+    stalls = []
+    sent = 0
+    last = time.perf_counter()
+    while len(answered) < requests:
+        if sent < requests:
+            send(f"question {sent}")
+            sent += 1
+        while not posted.empty():
+            func, args = posted.get()
+            func(*args)
+        time.sleep(UI_TICK)
+        now = time.perf_counter()
+        stalls.append(max(0.0, now - last - UI_TICK))
+        last = now
+    if worker is not None:
+        worker.shutdown(wait=True)
+    return stalls
+
+
+def run_ui_stall(args):
+    for mode in ("blocking", "worker"):
+        stalls = _measure_ui_stall(mode, args.requests, args.latency)
+        print(f"{mode:>8}: max stall {max(stalls) * 1000:8.1f} ms, "
+              f"p99 {percentile(stalls, 99) * 1000:8.1f} ms, "
+              f"total {sum(stalls) * 1000:8.1f} ms over {len(stalls)} ticks")
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# KB backends: load, per-entry write and search latency, JSON journal vs SQLite
+
+BENCH_WORDS = ("vendor", "delay", "budget", "review", "milestone", "design", "testing",
+               "sponsor", "contract", "training", "release", "migration", "audit", "staffing")
+
+
+def _synthetic_kb(entries, categories=10):
+    kb = {f"category_{c}": {} for c in range(categories)}
+    for i in range(entries):
+        words = [BENCH_WORDS[(i * k) % len(BENCH_WORDS)] for k in (1, 3, 7)]
+        kb[f"category_{i % categories}"][f"item_{i}"] = f"Item {i}: {' '.join(words)} note {i % 97}"
+    return kb
+
+
+def _bench_backend(backend, kb_path, kb, writes, queries):
+    open_store = {
+        "json": lambda: JournaledKBStore(kb_path, dict),
+        "sqlite": lambda: SQLiteKBStore(kb_path, dict),
+    }[backend]
+    open_store().write(kb)
+
+    start = time.perf_counter()
+    store = open_store()
+    store.read()
+    load = time.perf_counter() - start
+
+    write_times = []
+    for i in range(writes):
+        ops = [{"op": "add", "path": f"/category_{i % 10}/bench_{i}", "value": f"budget review {i}"}]
+        start = time.perf_counter()
+        store.apply_patch(ops)
+        write_times.append(time.perf_counter() - start)
+
+    index_build = 0.0
+    if backend == "json":
+        index = KBIndex()
+        start = time.perf_counter()
+        index.build(store.read())
+        index_build = time.perf_counter() - start
+        search = index.search
+    else:
+        search = store.search
+    query_times = []
+    for i in range(queries):
+        start = time.perf_counter()
+        search(f"{BENCH_WORDS[i % len(BENCH_WORDS)]} {BENCH_WORDS[(i * 5) % len(BENCH_WORDS)]} milestone")
+        query_times.append(time.perf_counter() - start)
+    return load, write_times, index_build, query_times
+
+
+def run_backends(args):
+    for entries in args.entries:
+        kb = _synthetic_kb(entries)
+        for backend in ("json", "sqlite"):
+            with tempfile.TemporaryDirectory() as tmp:
+                kb_path = os.path.join(tmp, "project_kb." + ("json" if backend == "json" else "sqlite3"))
+                load, writes, index_build, queries = _bench_backend(backend, kb_path, kb, args.writes, args.queries)
+            print(f"{entries:>7} entries {backend:>6}: load {load * 1000:8.1f} ms, "
+                  f"write p50 {percentile(writes, 50) * 1000:6.2f} ms, "
+                  f"query p50 {percentile(queries, 50) * 1000:7.2f} ms"
+                  + (f" (+ {index_build * 1000:.0f} ms index build)" if index_build else ""))
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Semantic cache: hit rate and false hits on a recorded query set
+
+def _evaluate_semantic_cache(queries, threshold):
+    # Replays the queries in order: every miss is answered (stored), every hit is
+    # checked against the group of the question it matched
+    from semantic_cache import SemanticCache
+
+    cache = SemanticCache(threshold=threshold, max_entries=len(queries))
+    groups = {}
+    seen = set()
+    hits = false_hits = repeats = 0
+    for query in queries:
+        question, group = query["question"], query["group"]
+        repeats += group in seen
+        match = cache.lookup(question, "eval", 0)
+        if match is None:
+            cache.store(question, question, "eval", 0)
+            groups[question] = group
+        else:
+            hits += 1
+            false_hits += groups[match[1]] != group
+        seen.add(group)
+    return hits, false_hits, repeats
+
+
+def run_semantic_cache(args):
+    with open(args.queries) as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+    for threshold in args.thresholds:
+        hits, false_hits, repeats = _evaluate_semantic_cache(queries, threshold)
+        true_hits = hits - false_hits
+        print(f"threshold {threshold:.2f}: hit rate {hits / len(queries):5.1%}, "
+              f"false-hit rate {false_hits / hits if hits else 0:5.1%}, "
+              f"repeats caught {true_hits}/{repeats}")
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Agent pipeline against a local fake chat model
+
+def _load_agent(workdir, **model_args):
+    # agent.py keeps its KB in the working directory and needs an API key at import
+    os.chdir(workdir)
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    import agent
+    from fake_llm import FakeChatModel
+    agent.use_llm(FakeChatModel(**model_args))
+    agent.answer_agent_executor.verbose = False
+    agent.update_agent_executor.verbose = False
+    return agent
+
+
+def run_stream(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        agent = _load_agent(tmp, latency=args.latency, token_delay=args.token_delay)
+        first, total = [], []
+        for i in range(args.turns):
+            start = time.perf_counter()
+            for n, _token in enumerate(agent.stream_user_input(f"What is the status of item {i}?")):
+                if n == 0:
+                    first.append(time.perf_counter() - start)
+            total.append(time.perf_counter() - start)
+        agent.kb_projects.close_all()
+    print(f"time to first token: p50 {percentile(first, 50) * 1000:.0f} ms, "
+          f"full answer + update: p50 {percentile(total, 50) * 1000:.0f} ms")
+    return 0
+
+
+def run_concurrency(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        agent = _load_agent(tmp, latency=args.latency)
+
+        async def session(session_id, latencies):
+            for turn in range(args.turns):
+                start = time.perf_counter()
+                await agent.aprocess_user_input(f"Session {session_id}: what is the status of task {turn}?")
+                latencies.append(time.perf_counter() - start)
+
+        async def drive():
+            latencies = []
+            start = time.perf_counter()
+            await asyncio.gather(*(session(i, latencies) for i in range(args.sessions)))
+            return latencies, time.perf_counter() - start
+
+        latencies, elapsed = asyncio.run(drive())
+        agent.kb_projects.close_all()
+
+    turns = len(latencies)
+    print(f"{args.sessions} concurrent sessions, {turns} turns in {elapsed:.2f}s: "
+          f"{turns / elapsed:.1f} turns/s, p50 {percentile(latencies, 50) * 1000:.0f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.0f} ms")
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Full pipeline: scripted conversations through process_user_input at several KB sizes
+
+PIPELINE_CONVERSATION = (
+    "The design review for work package {i} moved to next Tuesday.",
+    "What is the status of the vendor contract?",
+    "Budget for milestone {i} was increased by 10k after the audit.",
+    "Who is the sponsor of the migration?",
+    "We decided to cut the training scope for release {i}.",
+    "What are the open risks for the testing phase?",
+)
+
+
+def _proc_io():
+    # Bytes and calls of read/write system calls so far (Linux only)
+    try:
+        with open("/proc/self/io") as f:
+            return {name: int(value) for name, value in (line.split(": ") for line in f)}
+    except OSError:
+        return None
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _histogram_summary(data, name, label):
+    return {entry["labels"][label]: {"count": entry["count"],
+                                     "mean": entry["sum"] / entry["count"] if entry["count"] else 0.0,
+                                     "p50": entry["p50"], "p95": entry["p95"], "max": entry["max"]}
+            for entry in data["histograms"].get(name, [])}
+
+
+def _counter_summary(data, name, label):
+    return {entry["labels"][label]: entry["value"] for entry in data["counters"].get(name, [])}
+
+
+def _bench_pipeline(agent, entries, turns, trace_memory):
+    project_id = f"bench-{entries}"
+    project = agent.project_kb(project_id)
+    # Synthetic entries spread over the real PM categories
+    synthetic = _synthetic_kb(entries, categories=len(agent.PM_CATEGORIES))
+    project.store.write(dict(zip(agent.PM_CATEGORIES, synthetic.values())))
+
+    agent.metrics.reset()
+    if trace_memory:
+        tracemalloc.start()
+    io_before = _proc_io()
+    latencies = []
+    start = time.perf_counter()
+    for turn in range(turns):
+        message = PIPELINE_CONVERSATION[turn % len(PIPELINE_CONVERSATION)].format(i=turn)
+        turn_start = time.perf_counter()
+        agent.process_user_input(message, project_id=project_id, session_id=f"bench-{entries}")
+        latencies.append(time.perf_counter() - turn_start)
+    agent.flush_kb_updates()
+    elapsed = time.perf_counter() - start
+    io_after = _proc_io()
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    data = agent.metrics.to_json()
+    io = None
+    if io_before and io_after:
+        io = {name: io_after[name] - io_before[name] for name in ("rchar", "wchar", "syscr", "syscw")}
+    return {
+        "entries": entries,
+        "turns": turns,
+        "seconds": elapsed,
+        "turns_per_second": turns / elapsed,
+        "turn_latency": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "max": max(latencies)},
+        "stages": _histogram_summary(data, "stage_seconds", "stage"),
+        "kb_context_bytes": _histogram_summary(data, "kb_context_bytes", "agent"),
+        "llm_calls": _counter_summary(data, "llm_calls", "agent"),
+        "prompt_tokens": _counter_summary(data, "prompt_tokens", "agent"),
+        "completion_tokens": _counter_summary(data, "completion_tokens", "agent"),
+        "memory_mb": {"max_rss": _max_rss_mb(), "traced_peak": traced_peak},
+        "io": io,
+        "kb_file_bytes": project.size(),
+    }
+
+
+def run_pipeline(args):
+    os.environ["KB_BACKEND"] = args.backend
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        from fake_llm import recording_responder
+        agent = _load_agent(tmp, latency=args.latency, token_delay=args.token_delay, responder=recording_responder)
+        for entries in args.entries:
+            result = _bench_pipeline(agent, entries, args.turns, args.trace_memory)
+            results.append(result)
+            stages = ", ".join(f"{name} {stats['p50'] * 1000:.1f}" for name, stats in result["stages"].items())
+            io = result["io"]
+            print(f"{entries:>7} entries: {result['turns_per_second']:6.1f} turns/s, "
+                  f"turn p50 {result['turn_latency']['p50'] * 1000:7.1f} ms, "
+                  f"stage p50 (ms): {stages}; "
+                  f"answer prompt {result['prompt_tokens'].get('answer', 0) // args.turns} tokens/turn, "
+                  f"max RSS {result['memory_mb']['max_rss'] or 0:.0f} MB"
+                  + (f", wrote {io['wchar'] / 1024:.0f} KiB" if io else ""))
+        agent.kb_projects.close_all()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "pipeline",
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "settings": {"backend": args.backend, "turns": args.turns, "latency": args.latency,
+                             "token_delay": args.token_delay, "trace_memory": args.trace_memory},
+                "results": results,
+            }, f, indent=2)
+        print(f"results written to {args.output}")
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Chat log: layout and paint cost of a long conversation in the custom-drawn wx log
+
+def _chat_messages(count):
+    rng = random.Random(0)
+    return [("You" if i % 2 else "PM Helper",
+             " ".join(rng.choice(BENCH_WORDS) for _ in range(rng.randint(5, 150 if i % 2 else 400))))
+            for i in range(count)]
+
+
+def _paint_wx_chat_log(messages, width, height, paints):
+    # Real drawing into an off-screen bitmap with the CustomChatLog of "chatUI-wx textctrl.py"
+    import importlib.util
+    import wx
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chatUI-wx textctrl.py")
+    spec = importlib.util.spec_from_file_location("chat_ui_wx_textctrl", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    app = wx.App(False)
+    frame = wx.Frame(None, size=(width, height))
+    log = module.CustomChatLog(frame)
+    log.SetSize((width, height))
+    log.layout.set_width(width)
+    for sender, message in messages:
+        log.layout.add(sender, message)
+    dc = wx.MemoryDC(wx.Bitmap(width, height))
+    total = log.layout.total_height
+    times = []
+    for i in range(paints):
+        top = (total - height) * i // max(1, paints - 1)
+        start = time.perf_counter()
+        dc.SetDeviceOrigin(0, -top)
+        dc.Clear()
+        log.DrawMessages(dc, top, top + height)
+        times.append(time.perf_counter() - start)
+    frame.Destroy()
+    app.Destroy()
+    return times
+
+
+def run_chat_log(args):
+    messages = _chat_messages(args.messages)
+    char_width, line_height = args.char_width, args.line_height
+
+    # What the previous CustomChatLog did on every paint and again on every resize
+    start = time.perf_counter()
+    for sender, message in messages:
+        share = 0.7 if sender == "You" else 0.9
+        textwrap.fill(message if sender == "You" else f"{sender}: {message}",
+                      width=int(args.width * share / char_width))
+    full_wrap = time.perf_counter() - start
+
+    layout = ChatLayout(char_width, line_height)
+    layout.set_width(args.width)
+    start = time.perf_counter()
+    for sender, message in messages:
+        layout.add(sender, message)
+    add = (time.perf_counter() - start) / len(messages)
+
+    total = layout.total_height
+    paints = []
+    for i in range(args.paints):
+        top = (total - args.height) * i // max(1, args.paints - 1)
+        start = time.perf_counter()
+        layout.visible(top, top + args.height)
+        paints.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    layout.set_width(args.width + 200)
+    layout.visible(layout.total_height - args.height, layout.total_height)
+    resize = time.perf_counter() - start
+    start = time.perf_counter()
+    while layout.refine():
+        pass
+    refine = time.perf_counter() - start
+    start = time.perf_counter()
+    layout.set_width(args.width)
+    resize_back = time.perf_counter() - start
+
+    print(f"{len(messages)} messages, {args.width}x{args.height} px")
+    print(f"  re-wrap all messages (old paint):  {full_wrap * 1000:9.1f} ms")
+    print(f"  add one message:                   {add * 1000:9.3f} ms")
+    print(f"  layout of one paint: p50 {percentile(paints, 50) * 1000:.3f} ms, max {max(paints) * 1000:.3f} ms")
+    print(f"  resize until repainted:            {resize * 1000:9.1f} ms "
+          f"(+ {refine * 1000:.0f} ms of idle-time re-wrapping)")
+    print(f"  resize back to a cached width:     {resize_back * 1000:9.1f} ms")
+    try:
+        import wx  # noqa: F401
+    except ImportError:
+        print("  (wxPython is not installed: skipped painting into a bitmap)")
+        return 0
+    times = _paint_wx_chat_log(messages, args.width, args.height, args.paints)
+    print(f"  wx paint: p50 {percentile(times, 50) * 1000:.2f} ms, max {max(times) * 1000:.2f} ms")
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# KB side panel: cost of refreshing it after a turn that changed one entry
+
+def _panel_diff(old, new):
+    # The comparison KBTreeCtrl.show does, down to the entries of changed categories
+    changed = changed_keys(old, new)
+    return {category: changed_keys(old.get(category) or {}, new.get(category) or {}) for category in changed}
+
+
+def _time_panel_diff(old, new, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        changes = _panel_diff(old, new)
+        times.append(time.perf_counter() - start)
+    return times, sum(len(keys) for keys in changes.values())
+
+
+def _show_wx_kb_tree(kb, patched, runs):
+    import wx
+    from wx_kb_tree import KBTreeCtrl
+    app = wx.App(False)
+    frame = wx.Frame(None, size=(400, 800))
+    tree = KBTreeCtrl(frame)
+    start = time.perf_counter()
+    tree.show(kb)
+    first = time.perf_counter() - start
+    for item in tree._categories.values():
+        tree.Expand(item)
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        tree.show(patched if i % 2 == 0 else kb)
+        times.append(time.perf_counter() - start)
+    frame.Destroy()
+    app.Destroy()
+    return first, times
+
+
+def run_kb_panel(args):
+    kb = _synthetic_kb(args.entries)
+    key = next(iter(kb["category_0"]))
+    patched, _ = apply_patch(kb, [{"op": "replace", "path": f"/category_0/{key}", "value": "changed"}])
+
+    # What load_knowledge_base did: one AppendText per category and per entry
+    start = time.perf_counter()
+    lines = []
+    for category, items in patched.items():
+        lines.append(f"{category}:\n")
+        for entry, value in items.items():
+            lines.append(f"  {entry}: {value}\n")
+        lines.append("\n")
+    rebuild = time.perf_counter() - start
+
+    local, changed = _time_panel_diff(kb, patched, args.runs)
+    # Through agent_client every read is a new object, so nothing can be skipped by identity
+    remote, _ = _time_panel_diff(kb, json.loads(json.dumps(patched)), args.runs)
+
+    print(f"{args.entries} entries in {len(kb)} categories, one entry changed")
+    print(f"  full rebuild: {len(lines)} control updates, {rebuild * 1000:.1f} ms formatting the text alone")
+    print(f"  diff, in-process KB:  p50 {percentile(local, 50) * 1000:.3f} ms -> {changed} tree update(s)")
+    print(f"  diff, KB from server: p50 {percentile(remote, 50) * 1000:.3f} ms")
+    try:
+        import wx  # noqa: F401
+    except ImportError:
+        print("  (wxPython is not installed: skipped the KBTreeCtrl timings)")
+        return 0
+    first, times = _show_wx_kb_tree(kb, patched, args.runs)
+    print(f"  KBTreeCtrl first show: {first * 1000:.1f} ms, "
+          f"refresh with all categories expanded: p50 {percentile(times, 50) * 1000:.2f} ms")
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# KB file watcher: how soon an edit by another process is noticed
+
+def _watch_latency(kb_path, edits, use_inotify, interval):
+    # Time from an atomic rewrite of the KB file (as another process does it) to on_change
+    changed = threading.Event()
+    watcher = KBFileWatcher([kb_path], changed.set, interval=interval, use_inotify=use_inotify).start()
+    times = []
+    try:
+        for i in range(edits):
+            changed.clear()
+            start = time.perf_counter()
+            atomic_write(kb_path, json.dumps({"risk": {"edit": i}}))
+            if not changed.wait(10):
+                raise RuntimeError(f"{watcher.method} watcher missed an edit")
+            times.append(time.perf_counter() - start)
+            time.sleep(0.01)
+    finally:
+        watcher.stop()
+    return watcher.method, times
+
+
+def run_kb_watch(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        kb_path = os.path.join(tmp, "project_kb.json")
+        atomic_write(kb_path, "{}")
+        for use_inotify in (True, False):
+            method, times = _watch_latency(kb_path, args.edits, use_inotify, args.interval)
+            print(f"{method:8} {args.edits} external edits: change noticed after p50 "
+                  f"{percentile(times, 50) * 1000:.1f} ms, max {max(times) * 1000:.1f} ms")
+            if method == "poll":
+                break
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Resize controller: layout passes per typed character and per window resize event
+
+class _VirtualTimers:
+    # Single-shot timers on a simulated clock, in place of wx.CallLater / QTimer.singleShot
+    def __init__(self):
+        self.now = 0
+        self._due = []
+        self._order = itertools.count()
+
+    def schedule(self, delay_ms, callback):
+        heapq.heappush(self._due, (self.now + delay_ms, next(self._order), callback))
+
+    def advance(self, ms):
+        end = self.now + ms
+        while self._due and self._due[0][0] <= end:
+            self.now, _, callback = heapq.heappop(self._due)
+            callback()
+        self.now = end
+
+
+class _SimulatedInputBox:
+    # The input boxes' height rule (up to 5 wrapped lines) on a fixed-width font
+    def __init__(self, width, timers, char_width=9, line_height=18):
+        self.text = ""
+        self.width = width
+        self.char_width = char_width
+        self.line_height = line_height
+        self.controller = ResizeController(self.height, self.resize, timers.schedule)
+
+    def height(self):
+        columns = max(1, int(self.width / self.char_width))
+        lines = sum(len(textwrap.wrap(line, columns)) or 1 for line in self.text.split("\n"))
+        return min(lines, 5) * self.line_height + 10
+
+    def resize(self, height):
+        # Laying out the parent sends the box a size event of its own
+        self.controller.request()
+
+
+def run_resize(args):
+    message = " ".join(BENCH_WORDS[(i * 5) % len(BENCH_WORDS)] for i in range(args.chars))[:args.chars]
+    for typing_ms in args.typing_ms:
+        timers = _VirtualTimers()
+        box = _SimulatedInputBox(args.width, timers)
+        box.controller.apply()
+        passes = box.controller.layout_passes
+        for char in message:
+            box.text += char
+            box.controller.request()
+            timers.advance(typing_ms)
+        timers.advance(1000)
+        passes = box.controller.layout_passes - passes
+        print(f"typing {len(message)} chars at {typing_ms:>3} ms/char: before {len(message)} layout passes "
+              f"(1.00/char), now {passes} ({passes / len(message):.3f}/char)")
+
+    timers = _VirtualTimers()
+    box = _SimulatedInputBox(args.width, timers)
+    # Short enough that the number of wrapped lines changes during the drag
+    box.text = message[:200]
+    box.controller.apply()
+    passes = box.controller.layout_passes
+    for event in range(args.resize_events):
+        # Drag the window narrower, one size event per frame
+        box.width = args.width - event * 400 // args.resize_events
+        box.controller.request()
+        timers.advance(16)
+    timers.advance(1000)
+    passes = box.controller.layout_passes - passes
+    print(f"window drag, {args.resize_events} size events at 16 ms: before {args.resize_events} layout passes "
+          f"(1.00/event), now {passes} ({passes / args.resize_events:.3f}/event)")
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Cold start: what a UI pays for `import agent` before its window can show
+
+_IMPORT_PROBE = """
+import json, time
+start = time.perf_counter()
+import agent
+imported = time.perf_counter() - start
+agent.get_agents()
+print(json.dumps({"import": imported, "import_and_build": time.perf_counter() - start}))
+"""
+
+
+def run_import_time(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=here + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    env.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    timings = {"import": [], "import_and_build": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(args.runs):
+            # A fresh interpreter per run, so every import is a cold one
+            output = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], cwd=tmp, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            for name, value in json.loads(output.splitlines()[-1]).items():
+                timings[name].append(value)
+    print(f"import agent:                  p50 {percentile(timings['import'], 50) * 1000:7.0f} ms "
+          f"(the UI can show its window after this)")
+    print(f"import agent and build agents: p50 {percentile(timings['import_and_build'], 50) * 1000:7.0f} ms "
+          f"(cold start when the agents were built at import)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks and stress tests for the PM agent")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    stress = sub.add_parser("stress", help="parallel writers against one KB, checks no update is lost")
+    stress.add_argument("--writers", type=int, default=8)
+    stress.add_argument("--updates", type=int, default=50)
+    stress.add_argument("--journal", action="store_true", help="use the journaled store")
+    stress.set_defaults(func=run_stress)
+
+    backends = sub.add_parser("backends", help="load/write/search latency of the JSON and SQLite KB backends")
+    backends.add_argument("--entries", type=int, nargs="+", default=[1000, 10000, 100000])
+    backends.add_argument("--writes", type=int, default=50)
+    backends.add_argument("--queries", type=int, default=50)
+    backends.set_defaults(func=run_backends)
+
+    semantic = sub.add_parser("semantic-cache", help="hit and false-hit rates of the semantic cache")
+    semantic.add_argument("--queries",
+                          default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "semantic_queries.jsonl"),
+                          help='JSON lines {"question": ..., "group": ...}; same group = same question')
+    semantic.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.65, 0.7, 0.75, 0.8, 0.9])
+    semantic.set_defaults(func=run_semantic_cache)
+
+    ui_stall = sub.add_parser("ui-stall", help="event-loop stall time with and without the agent worker")
+    ui_stall.add_argument("--requests", type=int, default=5)
+    ui_stall.add_argument("--latency", type=float, default=0.2, help="fake agent latency in seconds")
+    ui_stall.set_defaults(func=run_ui_stall)
+
+    stream = sub.add_parser("stream", help="time to first streamed token with a fake chat model")
+    stream.add_argument("--turns", type=int, default=5)
+    stream.add_argument("--latency", type=float, default=0.3)
+    stream.add_argument("--token-delay", type=float, default=0.02)
+    stream.set_defaults(func=run_stream)
+
+    concurrency = sub.add_parser("concurrency", help="N concurrent sessions through aprocess_user_input")
+    concurrency.add_argument("--sessions", type=int, default=50)
+    concurrency.add_argument("--turns", type=int, default=4)
+    concurrency.add_argument("--latency", type=float, default=0.2, help="fake LLM latency per call")
+    concurrency.set_defaults(func=run_concurrency)
+
+    chat_log = sub.add_parser("chat-log", help="layout and paint cost of a long conversation in the wx chat log")
+    chat_log.add_argument("--messages", type=int, default=10000)
+    chat_log.add_argument("--width", type=int, default=800)
+    chat_log.add_argument("--height", type=int, default=600)
+    chat_log.add_argument("--paints", type=int, default=100)
+    chat_log.add_argument("--char-width", type=int, default=9, help="width of 'W' without wxPython")
+    chat_log.add_argument("--line-height", type=int, default=18)
+    chat_log.set_defaults(func=run_chat_log)
+
+    resize = sub.add_parser("resize", help="layout passes per typed character and per resize event")
+    resize.add_argument("--chars", type=int, default=400)
+    resize.add_argument("--typing-ms", type=int, nargs="+", default=[80, 10], help="delay between keystrokes")
+    resize.add_argument("--resize-events", type=int, default=60)
+    resize.add_argument("--width", type=int, default=900, help="input box width in pixels at the start")
+    resize.set_defaults(func=run_resize)
+
+    kb_panel = sub.add_parser("kb-panel", help="cost of refreshing the wx KB side panel after a one-entry change")
+    kb_panel.add_argument("--entries", type=int, default=10000)
+    kb_panel.add_argument("--runs", type=int, default=100)
+    kb_panel.set_defaults(func=run_kb_panel)
+
+    kb_watch = sub.add_parser("kb-watch", help="delay until the KB file watcher notices an external edit")
+    kb_watch.add_argument("--edits", type=int, default=20)
+    kb_watch.add_argument("--interval", type=float, default=1.0, help="polling interval of the fallback watcher")
+    kb_watch.set_defaults(func=run_kb_watch)
+
+    import_time = sub.add_parser("import-time", help="cold-start time of import agent, with and without building the agents")
+    import_time.add_argument("--runs", type=int, default=5)
+    import_time.set_defaults(func=run_import_time)
+
+    pipeline = sub.add_parser("pipeline", help="scripted conversation through process_user_input at several KB sizes")
+    pipeline.add_argument("--entries", type=int, nargs="+", default=[0, 1000, 10000])
+    pipeline.add_argument("--turns", type=int, default=30)
+    pipeline.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    pipeline.add_argument("--latency", type=float, default=0.0, help="fake LLM latency per call")
+    pipeline.add_argument("--token-delay", type=float, default=0.0)
+    pipeline.add_argument("--trace-memory", action="store_true",
+                          help="also report the peak Python heap (tracemalloc; slows the run down)")
+    pipeline.add_argument("--output", help="write the results as JSON to this file")
+    pipeline.set_defaults(func=run_pipeline)
+
+    args = parser.parse_args()
+    raise SystemExit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,19 @@ import wx.richtext as rt
 import json
 import os
 
+from resize_controller import ResizeController
+
 class InputTextCtrl(wx.TextCtrl):
     def __init__(self, parent, id=wx.ID_ANY, value="", pos=wx.DefaultPosition, size=wx.DefaultSize, style=0, validator=wx.DefaultValidator, name=wx.TextCtrlNameStr):
         super().__init__(parent, id, value, pos, size, style, validator, name)
+        # Typing and resizing lay out the parent at most once per debounce interval,
+        # and only when the height actually changes
+        self.resizer = ResizeController(self.InputBoxHeight, self.SetInputBoxHeight, wx.CallLater)
+        self.char_height = self.GetCharHeight()
         self.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
         self.Bind(wx.EVT_TEXT, self.OnText)
-        self.SetMinSize(wx.Size(-1, self.GetCharHeight() + 10))
+        self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.resizer.apply()
         self.SetHint("Ask your questions here")
         font = wx.Font(14, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL)
         self.SetFont(font)
@@ -27,10 +34,24 @@ class InputTextCtrl(wx.TextCtrl):
         self.AdjustInputBoxSize()
         event.Skip()
 
+    def OnSize(self, event):
+        # A new width can change how many lines the text wraps to
+        self.AdjustInputBoxSize()
+        event.Skip()
+
+    def SetFont(self, font):
+        result = super().SetFont(font)
+        self.char_height = self.GetCharHeight()
+        self.AdjustInputBoxSize()
+        return result
+
     def AdjustInputBoxSize(self):
-        numLines = self.GetNumberOfLines()
-        charHeight = self.GetCharHeight()
-        height = min(numLines * charHeight + 10, 5 * charHeight + 10)
+        self.resizer.request()
+
+    def InputBoxHeight(self):
+        return min(self.GetNumberOfLines() * self.char_height + 10, 5 * self.char_height + 10)
+
+    def SetInputBoxHeight(self, height):
         self.SetMinSize(wx.Size(-1, height))
         self.GetParent().Layout()
 
@@ -1,12 +1,19 @@
 import wx
-import textwrap
+
+from chat_layout import ChatLayout
+from resize_controller import ResizeController
 
 class InputTextCtrl(wx.TextCtrl):
     def __init__(self, parent, id=wx.ID_ANY, value="", pos=wx.DefaultPosition, size=wx.DefaultSize, style=0, validator=wx.DefaultValidator, name=wx.TextCtrlNameStr):
         super().__init__(parent, id, value, pos, size, style, validator, name)
+        # Typing and resizing lay out the parent at most once per debounce interval,
+        # and only when the height actually changes
+        self.resizer = ResizeController(self.InputBoxHeight, self.SetInputBoxHeight, wx.CallLater)
+        self.char_height = self.GetCharHeight()
         self.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
         self.Bind(wx.EVT_TEXT, self.OnText)
-        self.SetMinSize(wx.Size(-1, self.GetCharHeight() + 10))
+        self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.resizer.apply()
         self.SetHint("Ask your questions here")
         font = wx.Font(14, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL)
         self.SetFont(font)
@@ -25,70 +32,92 @@ class InputTextCtrl(wx.TextCtrl):
         self.AdjustInputBoxSize()
         event.Skip()
 
+    def OnSize(self, event):
+        # A new width can change how many lines the text wraps to
+        self.AdjustInputBoxSize()
+        event.Skip()
+
+    def SetFont(self, font):
+        result = super().SetFont(font)
+        self.char_height = self.GetCharHeight()
+        self.AdjustInputBoxSize()
+        return result
+
     def AdjustInputBoxSize(self):
-        numLines = self.GetNumberOfLines()
-        charHeight = self.GetCharHeight()
-        height = min(numLines * charHeight + 10, 5 * charHeight + 10)
+        self.resizer.request()
+
+    def InputBoxHeight(self):
+        return min(self.GetNumberOfLines() * self.char_height + 10, 5 * self.char_height + 10)
+
+    def SetInputBoxHeight(self, height):
         self.SetMinSize(wx.Size(-1, height))
         self.GetParent().Layout()
 
 class CustomChatLog(wx.ScrolledWindow):
     def __init__(self, parent):
         super().__init__(parent, style=wx.VSCROLL)
-        self.messages = []
+        self.font = wx.Font(12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL)
+        dc = wx.ClientDC(self)
+        dc.SetFont(self.font)
+        # Wrapping and heights are cached per message, see chat_layout.ChatLayout
+        self.layout = ChatLayout(dc.GetTextExtent('W')[0], dc.GetCharHeight())
+        self.messages = self.layout.messages
+        # A window drag sends many size events; re-wrap once the width settles
+        self.resizer = ResizeController(lambda: self.GetClientSize().width, self.Relayout, wx.CallLater)
         self.Bind(wx.EVT_PAINT, self.OnPaint)
         self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.Bind(wx.EVT_IDLE, self.OnIdle)
         self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
         self.SetScrollRate(0, 20)
 
     def AddMessage(self, sender, message):
-        self.messages.append((sender, message))
+        self.layout.set_width(self.GetClientSize().width)
+        self.layout.add(sender, message)
         self.UpdateVirtualSize()
         self.Refresh()
         self.ScrollToBottom()
+
     def OnSize(self, event):
-        self.UpdateVirtualSize()
+        self.resizer.request()
         self.Refresh()
         event.Skip()
 
+    def Relayout(self, width):
+        if self.layout.set_width(width):
+            self.UpdateVirtualSize()
+            self.Refresh()
+
+    def OnIdle(self, event):
+        # Wrap the messages that were only estimated after a resize, a slice at a time
+        if self.layout.stale:
+            if self.layout.refine():
+                event.RequestMore()
+            self.UpdateVirtualSize()
+
     def UpdateVirtualSize(self):
-        dc = wx.ClientDC(self)
-        dc.SetFont(wx.Font(12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
-        width, height = self.GetClientSize()
-        total_height = self.CalculateTotalHeight(dc, width)
-        self.SetVirtualSize((width, total_height))
-
-    def CalculateTotalHeight(self, dc, width):
-        y = 10
-        for sender, message in self.messages:
-            if sender == "You":
-                wrapped_text = textwrap.fill(message, width=int(width * 0.7 / dc.GetTextExtent('W')[0]))
-                lines = wrapped_text.split('\n')
-                text_height = len(lines) * dc.GetCharHeight()
-                y += text_height + 30
-            else:
-                wrapped_text = textwrap.fill(f"{sender}: {message}", width=int(width * 0.9 / dc.GetTextExtent('W')[0]))
-                lines = wrapped_text.split('\n')
-                y += len(lines) * dc.GetCharHeight() + 20
-        return y
+        self.SetVirtualSize((self.GetClientSize().width, self.layout.total_height))
 
     def OnPaint(self, event):
         dc = wx.BufferedPaintDC(self)
+        self.DoPrepareDC(dc)
         dc.Clear()
-        dc.SetFont(wx.Font(12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
-
-        width, height = self.GetClientSize()
-        y = 10
-        for sender, message in self.messages:
+        top = self.GetViewStart()[1] * self.GetScrollPixelsPerUnit()[1]
+        self.DrawMessages(dc, top, top + self.GetClientSize().height)
+
+    def DrawMessages(self, dc, top, bottom):
+        # Draw the messages between the logical y coordinates top and bottom
+        dc.SetFont(self.font)
+        width = self.GetClientSize().width
+        char_height = self.layout.line_height
+        for y, sender, lines in self.layout.visible(top, bottom):
             if sender == "You":
                 # User message
-                wrapped_text = textwrap.fill(message, width=int(width * 0.7 / dc.GetTextExtent('W')[0]))
-                lines = wrapped_text.split('\n')
-                max_width = min(max(dc.GetTextExtent(line)[0] for line in lines) + 40, width * 0.75)
-                text_height = len(lines) * dc.GetCharHeight()
+                extents = [dc.GetTextExtent(line)[0] for line in lines]
+                max_width = min(max(extents) + 40, width * 0.75)
+                text_height = len(lines) * char_height
 
                 # Draw rounded rectangle
-                rect = wx.Rect(width - max_width - 10, y, max_width, text_height + 20)
+                rect = wx.Rect(int(width - max_width - 10), y, int(max_width), text_height + 20)
                 dc.SetBrush(wx.Brush(wx.Colour(64, 64, 64)))  # Dark grey
                 dc.SetPen(wx.Pen(wx.Colour(64, 64, 64)))
                 dc.DrawRoundedRectangle(rect, 10)
@@ -96,20 +125,15 @@ class CustomChatLog(wx.ScrolledWindow):
                 # Draw text
                 dc.SetTextForeground(wx.WHITE)
                 text_y = y + 10
-                for line in lines:
-                    dc.DrawText(line, width - dc.GetTextExtent(line)[0] - 30, text_y)
-                    text_y += dc.GetCharHeight()
-
-                y += text_height + 30
+                for line, extent in zip(lines, extents):
+                    dc.DrawText(line, width - extent - 30, text_y)
+                    text_y += char_height
             else:
                 # System message
                 dc.SetTextForeground(wx.BLACK)
-                wrapped_text = textwrap.fill(f"{sender}: {message}", width=int(width * 0.9 / dc.GetTextExtent('W')[0]))
-                lines = wrapped_text.split('\n')
                 for line in lines:
                     dc.DrawText(line, 10, y)
-                    y += dc.GetCharHeight()
-                y += 20
+                    y += char_height
 
     def ScrollToBottom(self):
         if self.GetScrollRange(wx.VERTICAL) > 0:
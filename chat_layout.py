@@ -0,0 +1,146 @@
+import bisect
+import itertools
+import textwrap
+
+# Geometry shared by the custom-drawn chat logs, in pixels
+TOP_MARGIN = 10
+USER_PADDING = 30       # bubble padding and spacing below a user message
+OTHER_PADDING = 20      # spacing below any other message
+USER_WIDTH = 0.7        # share of the window width user messages wrap at
+OTHER_WIDTH = 0.9
+# Wrapped lines kept per message, one entry per column count, so resizing back and
+# forth between two widths does not re-wrap anything
+WRAP_CACHE_WIDTHS = 2
+
+
+class ChatLayout:
+    """Wrapped lines and vertical positions of chat messages, for virtualized painting.
+
+    Messages are wrapped to a number of columns derived from the window width and the
+    font's character width, and each message caches its wrapped lines per column
+    count. The y offsets of all messages are kept as a prefix sum, so the messages in
+    a scroll region are found with a binary search and a repaint costs O(visible).
+
+    When the width changes, only the messages that are painted get re-wrapped right
+    away; the others get a height estimated from their previous line count and are
+    marked stale until refine() wraps them (a chat log calls it when idle).
+    """
+
+    def __init__(self, char_width, line_height, user="You"):
+        self.char_width = max(1, char_width)
+        self.line_height = line_height
+        self.user = user
+        self.width = 0
+        self.messages = []          # (sender, message)
+        self._wrapped = []          # per message: {columns: lines}
+        self._heights = []
+        self._tops = [TOP_MARGIN]   # _tops[i] is the y of message i, _tops[-1] the total height
+        self._tops_dirty = False
+        self._stale = set()         # messages whose height is an estimate
+
+    def __len__(self):
+        return len(self.messages)
+
+    @property
+    def total_height(self):
+        return self._offsets()[-1]
+
+    @property
+    def stale(self):
+        return bool(self._stale)
+
+    def _columns(self, sender):
+        share = USER_WIDTH if sender == self.user else OTHER_WIDTH
+        return max(1, int(self.width * share / self.char_width))
+
+    def _text(self, index):
+        sender, message = self.messages[index]
+        return message if sender == self.user else f"{sender}: {message}"
+
+    def lines(self, index):
+        """The wrapped lines of message index at the current width."""
+        columns = self._columns(self.messages[index][0])
+        cache = self._wrapped[index]
+        lines = cache.get(columns)
+        if lines is None:
+            lines = textwrap.wrap(self._text(index), width=columns) or [""]
+            if len(cache) >= WRAP_CACHE_WIDTHS:
+                del cache[next(iter(cache))]
+            cache[columns] = lines
+        return lines
+
+    def _height(self, sender, line_count):
+        padding = USER_PADDING if sender == self.user else OTHER_PADDING
+        return line_count * self.line_height + padding
+
+    def _settle(self, index):
+        # Replace an estimated height by the real one; True if it changed
+        self._stale.discard(index)
+        height = self._height(self.messages[index][0], len(self.lines(index)))
+        if height == self._heights[index]:
+            return False
+        self._heights[index] = height
+        self._tops_dirty = True
+        return True
+
+    def _offsets(self):
+        if self._tops_dirty:
+            self._tops = list(itertools.accumulate(self._heights, initial=TOP_MARGIN))
+            self._tops_dirty = False
+        return self._tops
+
+    def add(self, sender, message):
+        self.messages.append((sender, message))
+        self._wrapped.append({})
+        self._heights.append(self._height(sender, len(self.lines(len(self.messages) - 1))))
+        if not self._tops_dirty:
+            self._tops.append(self._tops[-1] + self._heights[-1])
+        return len(self.messages) - 1
+
+    def set_width(self, width):
+        """Lay out for a new window width; returns True if the layout changed."""
+        old_columns = (self._columns(self.user), self._columns(None))
+        self.width = width
+        if (self._columns(self.user), self._columns(None)) == old_columns:
+            return False
+        changed = False
+        for index, (sender, _) in enumerate(self.messages):
+            columns = self._columns(sender)
+            cache = self._wrapped[index]
+            if columns in cache:
+                lines = len(cache[columns])
+                self._stale.discard(index)
+            else:
+                # Same text at a new width: scale the last known line count
+                last_columns, last_lines = next(reversed(cache.items()))
+                lines = max(1, round(len(last_lines) * last_columns / columns))
+                self._stale.add(index)
+            height = self._height(sender, lines)
+            if height != self._heights[index]:
+                self._heights[index] = height
+                changed = True
+        if changed:
+            self._tops_dirty = True
+        return True
+
+    def visible(self, top, bottom):
+        """(y, sender, lines) of every message that intersects [top, bottom)."""
+        # Settling a message can move the ones below it, so repeat until stable
+        while True:
+            tops = self._offsets()
+            first = max(0, bisect.bisect_right(tops, top) - 1)
+            last = bisect.bisect_left(tops, bottom, lo=first)
+            indices = range(first, min(last, len(self.messages)))
+            moved = False
+            for index in indices:
+                if index in self._stale:
+                    moved |= self._settle(index)
+            if not moved:
+                break
+        return [(tops[index], self.messages[index][0], self.lines(index)) for index in indices]
+
+    def refine(self, limit=500):
+        """Wrap up to limit stale messages; returns True while some remain."""
+        for index in itertools.islice(sorted(self._stale), limit):
+            self._settle(index)
+        return bool(self._stale)
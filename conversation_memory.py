@@ -0,0 +1,162 @@
+import asyncio
+import os
+import threading
+
+from kb_index import CHARS_PER_TOKEN, estimate_tokens
+
+# Token budget for the chat history passed to the answer agent (0 disables history),
+# and how many recent turns are kept word for word at most
+CHAT_MEMORY_TOKENS = int(os.environ.get("CHAT_MEMORY_TOKENS", 1000))
+CHAT_MEMORY_TURNS = int(os.environ.get("CHAT_MEMORY_TURNS", 6))
+
+
+class ConversationMemory:
+    """Chat history for one conversation, kept within a token budget.
+
+    Recent turns are kept verbatim in a sliding window. When the window holds more
+    than max_turns turns or the history goes over token_budget, the oldest turns are
+    folded into a rolling summary by summarize(previous_summary, turns) -> str, or
+    by the coroutine asummarize in aadd_turn(). To avoid a summarization call on
+    every turn, the window is then trimmed to half the budget. Token counts are
+    computed once per message and cached alongside it.
+
+    The summary is made without holding the lock, so readers of the history are not
+    blocked by the LLM call. The folded turns are only dropped once it succeeded;
+    if it fails they stay in the window and folding is tried again on the next turn.
+    """
+
+    def __init__(self, summarize, token_budget=CHAT_MEMORY_TOKENS, max_turns=CHAT_MEMORY_TURNS, asummarize=None):
+        self.summarize = summarize
+        self.asummarize = asummarize
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.turns = []             # (user_message, ai_response, tokens)
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summary_errors = 0
+        self._folding = False
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        return self.summary_tokens + sum(turn[2] for turn in self.turns)
+
+    def messages(self):
+        """The history as (role, content) pairs for a MessagesPlaceholder."""
+        with self._lock:
+            history = []
+            if self.summary:
+                history.append(("system", f"Summary of the earlier conversation: {self.summary}"))
+            for user_message, ai_response, _ in self.turns:
+                history.append(("human", user_message))
+                history.append(("ai", ai_response))
+            return history
+
+    def add_turn(self, user_message, ai_response):
+        fold = self._add(user_message, ai_response)
+        if fold is None:
+            return
+        summary, folded = fold
+        try:
+            summary = self.summarize(summary, [turn[:2] for turn in folded])
+        except Exception as e:
+            self._fold_failed(e)
+            return
+        self._fold_done(folded, summary)
+
+    async def aadd_turn(self, user_message, ai_response):
+        fold = self._add(user_message, ai_response)
+        if fold is None:
+            return
+        summary, folded = fold
+        turns = [turn[:2] for turn in folded]
+        try:
+            if self.asummarize is not None:
+                summary = await self.asummarize(summary, turns)
+            else:
+                summary = await asyncio.to_thread(self.summarize, summary, turns)
+        except Exception as e:
+            self._fold_failed(e)
+            return
+        self._fold_done(folded, summary)
+
+    def _add(self, user_message, ai_response):
+        # Returns (summary, turns to fold into it) if the window has to be folded
+        with self._lock:
+            tokens = estimate_tokens(user_message) + estimate_tokens(ai_response)
+            self.turns.append((user_message, ai_response, tokens))
+            if self._folding or (len(self.turns) <= self.max_turns and self.tokens <= self.token_budget):
+                return None
+            folded = self._oldest_turns()
+            if not folded:
+                return None
+            self._folding = True
+            return self.summary, folded
+
+    def _oldest_turns(self):
+        # The oldest turns to fold so that the rest fits in half the budget, always
+        # keeping the latest turn verbatim
+        target = self.token_budget // 2
+        window_tokens = sum(turn[2] for turn in self.turns)
+        count = 0
+        while len(self.turns) - count > 1 and (len(self.turns) - count > self.max_turns // 2 or window_tokens > target):
+            window_tokens -= self.turns[count][2]
+            count += 1
+        return self.turns[:count]
+
+    def _fold_done(self, folded, summary):
+        with self._lock:
+            self._folding = False
+            if len(self.turns) < len(folded) or any(a is not b for a, b in zip(self.turns, folded)):
+                return  # cleared in the meantime
+            del self.turns[:len(folded)]
+            self.summary = summary.strip()
+            self.summary_tokens = estimate_tokens(self.summary) if self.summary else 0
+            # A summary that outgrows its share of the budget is cut from the front
+            limit = self.token_budget // 2
+            if self.summary_tokens > limit:
+                self.summary = self.summary[-limit * CHARS_PER_TOKEN:]
+                self.summary_tokens = estimate_tokens(self.summary)
+
+    def _fold_failed(self, error):
+        # Keep the turns verbatim; the user's turn itself has succeeded
+        with self._lock:
+            self._folding = False
+            self.summary_errors += 1
+        print(f"Error: could not summarize the conversation: {error}")
+
+    def clear(self):
+        with self._lock:
+            self.turns = []
+            self.summary = ""
+            self.summary_tokens = 0
+
+
+class ConversationStore:
+    """The ConversationMemory of every open conversation, by (project, session) id."""
+
+    def __init__(self, summarize, token_budget=CHAT_MEMORY_TOKENS, max_turns=CHAT_MEMORY_TURNS, asummarize=None):
+        self.summarize = summarize
+        self.asummarize = asummarize
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self._memories = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.token_budget > 0
+
+    def get(self, project_id, session_id):
+        with self._lock:
+            key = (project_id, session_id)
+            memory = self._memories.get(key)
+            if memory is None:
+                memory = ConversationMemory(self.summarize, self.token_budget, self.max_turns, self.asummarize)
+                self._memories[key] = memory
+            return memory
+
+    def forget(self, session_id):
+        with self._lock:
+            for key in [key for key in self._memories if key[1] == session_id]:
+                del self._memories[key]
@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Callable, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+def default_responder(messages):
+    # The update agent's prompt ends with "Provide KB updates:"; give it an empty patch
+    if "Provide KB updates" in messages[-1].content:
+        return "[]"
+    return "Based on the knowledge base, the project is on track and no blockers are recorded."
+
+
+def recording_responder(messages):
+    # Like default_responder, but the update agent records every user message under
+    # /communications, so each update turn also writes to the KB (for benchmarks)
+    prompt = messages[-1].content
+    if "Provide KB updates" in prompt:
+        user_message = prompt.split("User message: ", 1)[-1].split("\nAI response:", 1)[0]
+        key = "note_" + hashlib.sha1(user_message.encode("utf-8")).hexdigest()[:12]
+        return json.dumps([{"op": "add", "path": f"/communications/{key}", "value": user_message}])
+    return default_responder(messages)
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic local stand-in for ChatOpenAI, for tests and benchmarks.
+
+    `latency` is the delay before the first token and `token_delay` the delay between
+    tokens. With streaming=True tokens are reported to on_llm_new_token callbacks the
+    same way ChatOpenAI(streaming=True) does. Use with agent.use_llm().
+    """
+
+    responder: Callable[[List[BaseMessage]], str] = default_responder
+    latency: float = 0.0
+    token_delay: float = 0.0
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _tokens(self, messages):
+        text = self.responder(messages)
+        words = text.split(" ")
+        return [word if i == len(words) - 1 else word + " " for i, word in enumerate(words)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        tokens = self._tokens(messages)
+        for token in tokens:
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            if self.streaming and run_manager:
+                run_manager.on_llm_new_token(token, chunk=ChatGenerationChunk(message=AIMessageChunk(content=token)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        tokens = self._tokens(messages)
+        for token in tokens:
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            if self.streaming and run_manager:
+                await run_manager.on_llm_new_token(token, chunk=ChatGenerationChunk(message=AIMessageChunk(content=token)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
@@ -0,0 +1,76 @@
+import os
+import threading
+
+# Collect this many turns, or wait at most this many seconds, before running one
+# update-agent call for all of them. A batch size of 1 disables batching.
+KB_UPDATE_BATCH_SIZE = int(os.environ.get("KB_UPDATE_BATCH_SIZE", 1))
+KB_UPDATE_BATCH_SECONDS = float(os.environ.get("KB_UPDATE_BATCH_SECONDS", 30))
+
+
+class UpdateBatcher:
+    """Buffers items per key and hands them to `submit(key, items)` in batches.
+
+    A batch goes out when it holds max_items items or max_delay seconds after its
+    first item arrived, whichever comes first. flush() sends everything that is
+    buffered, e.g. before shutting down.
+    """
+
+    def __init__(self, submit, max_items=KB_UPDATE_BATCH_SIZE, max_delay=KB_UPDATE_BATCH_SECONDS):
+        self.submit = submit
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self._buffers = {}      # key -> items
+        self._timers = {}       # key -> threading.Timer
+        self._lock = threading.Lock()
+        self.items = 0
+        self.batches = 0
+
+    def add(self, key, item):
+        with self._lock:
+            items = self._buffers.setdefault(key, [])
+            items.append(item)
+            self.items += 1
+            if len(items) < self.max_items:
+                if key not in self._timers:
+                    timer = self._timers[key] = threading.Timer(self.max_delay, self._expire, (key,))
+                    timer.daemon = True
+                    timer.start()
+                return
+            batch = self._take(key)
+            # Submit while holding the lock so batches of one key stay in order
+            self.submit(key, batch)
+
+    def _expire(self, key):
+        with self._lock:
+            batch = self._take(key)
+            if batch:
+                self.submit(key, batch)
+
+    def _take(self, key):
+        # Caller holds the lock
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._buffers.pop(key, [])
+        if batch:
+            self.batches += 1
+        return batch
+
+    def pending(self):
+        with self._lock:
+            return sum(len(items) for items in self._buffers.values())
+
+    def flush(self):
+        with self._lock:
+            for key in list(self._buffers):
+                batch = self._take(key)
+                if batch:
+                    self.submit(key, batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "turns": self.items,
+                "batches": self.batches,
+                "buffered": sum(len(items) for items in self._buffers.values()),
+            }
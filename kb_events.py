@@ -0,0 +1,207 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+from kb_patch import PatchError, parse_pointer
+
+# How often the polling watcher checks the KB files, and how long the inotify watcher
+# waits for a burst of file events (snapshot rename + journal append) to settle
+KB_WATCH_INTERVAL = float(os.environ.get("KB_WATCH_INTERVAL", 1.0))
+KB_WATCH_SETTLE = 0.05
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class KBChange:
+    """One change to a project's KB.
+
+    paths are the JSON Pointers that changed ("/risk/vendor_delay", or "/risk" for a
+    whole category). source is "write", "update", "patch", "undo" or "file" (an
+    edit by another process, noticed by the file watcher).
+    """
+
+    def __init__(self, project_id, paths, version, source):
+        self.project_id = project_id
+        self.paths = list(paths)
+        self.version = version
+        self.source = source
+
+    @property
+    def categories(self):
+        categories = set()
+        for path in self.paths:
+            try:
+                categories.add(parse_pointer(path)[0])
+            except (PatchError, IndexError):
+                pass
+        return categories
+
+    def __repr__(self):
+        return f"KBChange({self.project_id!r}, {self.paths!r}, version={self.version}, source={self.source!r})"
+
+
+class KBEventBus:
+    """Delivers KBChange events to subscribers, synchronously on the publishing thread.
+
+    A subscriber registered with a project_id only gets that project's changes.
+    Callbacks must be quick and thread-safe; GUIs should hand the event over to
+    their own thread (wx.CallAfter, QTimer.singleShot). An exception in one
+    callback is reported and does not stop the others.
+    """
+
+    def __init__(self):
+        self._subscribers = []      # (callback, project_id or None)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, callback, project_id=None):
+        with self._lock:
+            self._subscribers = self._subscribers + [(callback, project_id)]
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [entry for entry in self._subscribers if entry[0] != callback]
+
+    def has_subscribers(self, project_id=None):
+        return any(project_id is None or wanted in (None, project_id) for _, wanted in self._subscribers)
+
+    def publish(self, change):
+        # The list is replaced, never modified, so it can be iterated without the lock
+        self.published += 1
+        for callback, project_id in self._subscribers:
+            if project_id is not None and project_id != change.project_id:
+                continue
+            try:
+                callback(change)
+            except Exception as e:
+                print(f"Error: KB change subscriber {callback!r} failed: {e}", file=sys.stderr)
+
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class KBFileWatcher:
+    """Calls on_change() from a background thread when one of paths changes on disk.
+
+    Uses inotify on the files' directories where available (Linux) and otherwise
+    polls os.stat() every interval seconds. Atomic replacements (rename over the
+    file) are seen as well as appends. Changes made by this process trigger it too;
+    on_change has to tell them apart, e.g. by comparing the KB it reads with the
+    last one it has seen.
+    """
+
+    def __init__(self, paths, on_change, interval=KB_WATCH_INTERVAL, use_inotify=True):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.on_change = on_change
+        self.interval = interval
+        self.method = None
+        self._fd = None
+        self._wake_r = self._wake_w = None
+        self._stop = threading.Event()
+        self._thread = None
+        if use_inotify:
+            self._fd = _inotify_watch({os.path.dirname(path) for path in self.paths})
+        self.method = "poll" if self._fd is None else "inotify"
+
+    def start(self):
+        if self._thread is None:
+            if self._fd is not None:
+                self._wake_r, self._wake_w = os.pipe()
+            target = self._watch_inotify if self._fd is not None else self._watch_poll
+            self._thread = threading.Thread(target=target, name="kb-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._wake_w is not None:
+            os.write(self._wake_w, b"x")
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._wake_r = self._wake_w = None
+
+    def _changed(self):
+        try:
+            self.on_change()
+        except Exception as e:
+            print(f"Error: could not reload the changed knowledge base: {e}", file=sys.stderr)
+
+    def _watch_poll(self):
+        states = [_file_state(path) for path in self.paths]
+        while not self._stop.wait(self.interval):
+            current = [_file_state(path) for path in self.paths]
+            if current != states:
+                states = current
+                self._changed()
+
+    def _watch_inotify(self):
+        names = {os.path.basename(path) for path in self.paths}
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._fd, self._wake_r], [], [])
+            if self._wake_r in ready:
+                return
+            if not self._read_events(names):
+                continue
+            # Let the rest of the burst arrive before reloading once
+            while not self._stop.is_set() and select.select([self._fd], [], [], KB_WATCH_SETTLE)[0]:
+                self._read_events(names)
+            if not self._stop.is_set():
+                self._changed()
+
+    def _read_events(self, names):
+        # True if any of the events concerns one of our files
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        relevant = False
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].split(b"\0", 1)[0].decode("utf-8", "replace")
+            offset += length
+            relevant = relevant or name in names
+        return relevant
+
+
+def _inotify_watch(directories):
+    # An inotify descriptor watching the directories, or None if inotify is unavailable
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    fd = init(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    for directory in directories:
+        if add_watch(fd, os.fsencode(directory or "."), mask) < 0:
+            os.close(fd)
+            return None
+    return fd
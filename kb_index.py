@@ -0,0 +1,165 @@
+import heapq
+import json
+import math
+import re
+from collections import defaultdict
+
+from kb_patch import parse_pointer
+
+# Rough characters-per-token ratio for the OpenAI chat models, good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "has", "have", "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "our",
+    "should", "so", "that", "the", "their", "there", "this", "to", "us", "was", "we",
+    "what", "when", "where", "which", "who", "why", "will", "with", "you", "your",
+}
+
+# select_context() considers at most this many search hits, and gives up once this
+# many in a row were too big for the remaining budget
+MAX_CANDIDATES = 200
+MAX_SKIPPED = 20
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_MISSING = object()
+
+
+def tokenize(text):
+    words = _WORD_RE.findall(text.lower().replace("_", " "))
+    return [w for w in words if w not in STOP_WORDS and len(w) > 1]
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class KBIndex:
+    """Inverted index over the (category, key) entries of the knowledge base."""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)   # term -> {(category, key): term frequency}
+        self.entries = {}                   # (category, key) -> serialized value
+        self.entry_terms = {}               # (category, key) -> terms, for removal
+        self.categories = []
+        self.signature = None
+        self.kb_tokens = None               # (signature, token estimate of the whole KB)
+
+    def build(self, kb, signature=None):
+        self.postings = defaultdict(dict)
+        self.entries = {}
+        self.entry_terms = {}
+        self.categories = list(kb.keys())
+        for category, items in kb.items():
+            self._add_category(category, items)
+        self.signature = signature
+
+    def _add_category(self, category, items):
+        if not isinstance(items, dict):
+            items = {"value": items}
+        for key, value in items.items():
+            self._add_entry((category, key), value)
+
+    def _add_entry(self, entry, value):
+        category, key = entry
+        text = value if isinstance(value, str) else json.dumps(value)
+        terms = tokenize(f"{category} {key} {text}")
+        self.entries[entry] = text
+        self.entry_terms[entry] = terms
+        for term in terms:
+            self.postings[term][entry] = self.postings[term].get(entry, 0) + 1
+
+    def _remove_entry(self, entry):
+        self.entries.pop(entry, None)
+        for term in set(self.entry_terms.pop(entry, ())):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(entry, None)
+                if not postings:
+                    del self.postings[term]
+
+    def update(self, kb, paths, signature=None):
+        """Re-index only the entries touched by the given JSON Pointer paths."""
+        for path in paths:
+            parts = parse_pointer(path)
+            category = parts[0]
+            if len(parts) == 1 or not isinstance(kb.get(category), dict):
+                # A whole category changed
+                for entry in [e for e in self.entries if e[0] == category]:
+                    self._remove_entry(entry)
+                if category in kb:
+                    self._add_category(category, kb[category])
+            else:
+                entry = (category, parts[1])
+                self._remove_entry(entry)
+                if parts[1] in kb[category]:
+                    self._add_entry(entry, kb[category][parts[1]])
+        self.categories = list(kb.keys())
+        self.signature = signature
+
+    def sync(self, kb, signature):
+        # Rebuild only when the KB has changed since the last build
+        if signature != self.signature:
+            self.build(kb, signature)
+
+    def search(self, query, limit=MAX_CANDIDATES):
+        # Rarest terms first: once they have produced enough candidates, common terms
+        # only re-rank those instead of scoring a large part of the KB
+        terms = sorted(tokenize(query), key=lambda term: len(self.postings.get(term, ())))
+        scores = defaultdict(float)
+        total = len(self.entries) or 1
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + total / len(postings))
+            if len(scores) >= limit and len(postings) > len(scores):
+                for entry in scores:
+                    tf = postings.get(entry)
+                    if tf:
+                        scores[entry] += (1 + math.log(tf)) * idf
+                continue
+            for entry, tf in postings.items():
+                scores[entry] += (1 + math.log(tf)) * idf
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def kb_tokens(kb, index):
+    # Token estimate of the whole KB, cached on the index for its signature (the KB version)
+    if index.signature is None:
+        return estimate_tokens(json.dumps(kb, indent=2))
+    if index.kb_tokens is None or index.kb_tokens[0] != index.signature:
+        index.kb_tokens = (index.signature, estimate_tokens(json.dumps(kb, indent=2)))
+    return index.kb_tokens[1]
+
+
+def select_context(kb, index, question, token_budget, full_kb_tokens):
+    """Return the KB text to inject into a prompt for the given question.
+
+    Small knowledge bases are passed through whole. Larger ones are reduced to the
+    highest scoring entries that fit in token_budget; every category name is kept so
+    the model still sees the overall structure.
+    """
+    if kb_tokens(kb, index) <= full_kb_tokens:
+        return json.dumps(kb, indent=2)
+
+    selected = {category: {} for category in index.categories}
+    used = estimate_tokens(json.dumps(selected, indent=2))
+    skipped = 0
+    for (category, key), _score in index.search(question, MAX_CANDIDATES):
+        # The index (FTSIndex searches the database) may already be newer than kb
+        entries = kb.get(category, _MISSING)
+        value = entries.get(key, _MISSING) if isinstance(entries, dict) else entries
+        if value is _MISSING:
+            continue
+        cost = estimate_tokens(json.dumps({key: value}, indent=2))
+        if used + cost > token_budget:
+            # A smaller entry further down may still fit, but not for long
+            skipped += 1
+            if skipped >= MAX_SKIPPED:
+                break
+            continue
+        skipped = 0
+        selected.setdefault(category, {})[key] = value
+        used += cost
+    return json.dumps(selected, indent=2)
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import time
+
+from kb_patch import apply_patch, diff
+from kb_store import KBStore, atomic_write
+
+# Fold the journal into a new snapshot after this many entries
+COMPACT_EVERY = int(os.environ.get("KB_COMPACT_EVERY", 200))
+
+
+def _digest(data):
+    return None if data is None else hashlib.sha256(data).hexdigest()
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+
+
+def _ignore(op, error):
+    pass
+
+
+class JournaledKBStore(KBStore):
+    """KBStore that records changes in an append-only journal instead of rewriting the KB.
+
+    The KB file is a snapshot; every change is appended to `journal_path` as one JSON
+    line {"seq", "time", "ops", "undo"}, so the I/O per update is proportional to the
+    size of the change. The first line of the journal is a header naming the snapshot
+    (by SHA-256) it applies to. Loading reads the snapshot and replays the journal;
+    every `compact_every` entries (and on request) the journal is folded into a new
+    snapshot and the old journal is kept as `<journal>.<first>-<last>` for history.
+
+    Compaction is crash-safe: a {"compacting": hash} marker is appended before the new
+    snapshot is written, so on load we can tell a finished-but-not-rotated compaction
+    (snapshot matches the marker) from an external edit of the KB file (snapshot
+    matches neither), in which case the journal is replayed on top of the edited file.
+
+    Note that the KB file itself lags behind until the next compaction; read the KB
+    through the store, or call compact() first.
+    """
+
+    def __init__(self, path, default_factory=dict, journal_path=None, compact_every=COMPACT_EVERY):
+        super().__init__(path, default_factory)
+        self.journal_path = journal_path or path + ".journal.jsonl"
+        self.compact_every = compact_every
+        self.entries = []           # journal entries since the current snapshot
+        self._seq = 0
+        self._snapshot_digest = None
+        self._snapshot_stat = None
+        self._journal_offset = 0
+
+    def _file_stat(self):
+        return (_stat(self.path), _stat(self.journal_path))
+
+    # -- loading ------------------------------------------------------------
+
+    def _load(self, stat):
+        with self._file_locked():
+            snapshot_stat, journal_stat = self._file_stat()
+            if (self._kb is not None and snapshot_stat == self._snapshot_stat
+                    and journal_stat is not None and self._stat is not None
+                    and self._stat[1] is not None and journal_stat[0] == self._stat[1][0]
+                    and journal_stat[3] >= self._journal_offset):
+                # Only the journal grew (another process appended): replay the tail
+                kb = self._replay_tail(self._kb)
+            else:
+                kb = self._load_full()
+            return kb, self._file_stat()
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return self.default_factory(), None
+        return json.loads(data), data
+
+    def _read_journal(self, offset=0):
+        # Returns the parsed lines and the offset just past the last complete line
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return None, 0
+        lines = []
+        end = offset
+        for raw in data.splitlines(keepends=True):
+            if not raw.endswith(b"\n"):
+                break  # torn write from a crash; it is overwritten by the next append
+            try:
+                lines.append(json.loads(raw))
+            except json.JSONDecodeError:
+                break
+            end += len(raw)
+        return lines, end
+
+    def _load_full(self):
+        kb, data = self._read_snapshot()
+        digest = _digest(data)
+        self._snapshot_stat = _stat(self.path)
+        lines, end = self._read_journal()
+        header = lines[0] if lines and "snapshot" in lines[0] else None
+        entries = [line for line in (lines or []) if "ops" in line]
+        marker = lines[-1].get("compacting") if lines else None
+
+        if header is None:
+            # No journal yet (or an audit log from before journaling): the snapshot
+            # is the whole truth
+            self.entries = []
+            self._seq = entries[-1].get("seq", 0) if entries else 0
+            self._snapshot_digest = digest
+            if lines is not None:
+                self._archive_journal()
+            self._start_journal()
+            return kb
+
+        if header["snapshot"] == digest:
+            self._snapshot_digest = digest
+            self._seq = header.get("seq", 0)
+            self.entries = []
+            self._journal_offset = end
+            return self._replay(kb, entries)
+
+        if marker == digest:
+            # Crashed after writing the new snapshot but before rotating the journal
+            self.entries = []
+            self._seq = entries[-1]["seq"] if entries else header.get("seq", 0)
+            self._snapshot_digest = digest
+            self._archive_journal()
+            self._start_journal()
+            return kb
+
+        # The KB file was edited outside the store: keep the edit and re-apply the
+        # journal entries that never made it into the file, then fold them in
+        self._seq = header.get("seq", 0)
+        self.entries = []
+        self._journal_offset = end
+        kb = self._replay(kb, entries)
+        self._kb = kb
+        self._compact()
+        return kb
+
+    def _replay(self, kb, entries):
+        for entry in entries:
+            kb, _ = apply_patch(kb, entry["ops"], on_error=_ignore)
+            self.entries.append(entry)
+            self._seq = entry["seq"]
+        return kb
+
+    def _replay_tail(self, kb):
+        lines, end = self._read_journal(self._journal_offset)
+        self._journal_offset = end
+        return self._replay(kb, [line for line in lines or [] if "ops" in line])
+
+    # -- writing ------------------------------------------------------------
+
+    def _start_journal(self):
+        header = {"snapshot": self._snapshot_digest, "seq": self._seq}
+        atomic_write(self.journal_path, json.dumps(header) + "\n")
+        self._journal_offset = os.path.getsize(self.journal_path)
+
+    def _archive_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        first = self.entries[0]["seq"] if self.entries else self._seq
+        archive = f"{self.journal_path}.{first}-{self._seq}"
+        while os.path.exists(archive):
+            archive += "_"
+        os.replace(self.journal_path, archive)
+
+    def _append(self, line):
+        with open(self.journal_path, 'ab') as f:
+            # Drop a torn line left by a crash so the new entry starts on a fresh line
+            f.truncate(self._journal_offset)
+            f.seek(self._journal_offset)
+            data = (json.dumps(line) + "\n").encode("utf-8")
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_offset += len(data)
+
+    def _record(self, new_kb, ops, undo, **extra):
+        # Caller holds the file lock and has just read the latest KB
+        self._seq += 1
+        entry = {"seq": self._seq, "time": time.time(), "ops": ops, "undo": undo, **extra}
+        self._append(entry)
+        self.entries.append(entry)
+        self._kb = new_kb
+        self._stat = self._file_stat()
+        self.version += 1
+        if len(self.entries) >= self.compact_every:
+            self._compact()
+        return entry
+
+    def _commit(self, kb):
+        # write()/update() hand us a whole KB; journal only what changed
+        ops = diff(self.read(), kb)
+        if ops:
+            undo = []
+            new_kb, applied = apply_patch(self._kb, ops, undo=undo)
+            self._record(kb, applied, undo)
+        return self.version
+
+    def apply_patch(self, ops, on_error=None):
+        with self._file_locked():
+            undo = []
+            new_kb, applied = apply_patch(self.read(), ops, on_error, undo=undo)
+            if applied:
+                self._record(new_kb, applied, undo)
+            return applied
+
+    def undo(self, seq=None):
+        """Revert a journaled update (by default the most recent one not yet undone).
+
+        The revert is itself appended to the journal, so history is never rewritten.
+        Only updates since the last compaction can be undone. Returns the applied
+        operations, or [] if there was nothing to undo.
+        """
+        with self._file_locked():
+            kb = self.read()
+            undone = {entry.get("undoes") for entry in self.entries}
+            candidates = [entry for entry in self.entries
+                          if "undoes" not in entry and entry["seq"] not in undone
+                          and (seq is None or entry["seq"] == seq)]
+            if not candidates:
+                return []
+            target = candidates[-1]
+            undo = []
+            new_kb, applied = apply_patch(kb, target["undo"], on_error=_ignore, undo=undo)
+            if applied:
+                self._record(new_kb, applied, undo, undoes=target["seq"])
+            return applied
+
+    def history(self):
+        with self._lock:
+            self.read()
+            return list(self.entries)
+
+    def compact(self):
+        """Fold the journal into a new snapshot of the KB file."""
+        with self._file_locked():
+            self.read()
+            if self.entries:
+                self._compact()
+
+    def _compact(self):
+        # Caller holds the file lock and self._kb is current
+        with self._file_locked():
+            data = json.dumps(self._kb, indent=2).encode("utf-8")
+            digest = _digest(data)
+            if os.path.exists(self.journal_path):
+                self._append({"compacting": digest})
+            atomic_write(self.path, data.decode("utf-8"))
+            self._snapshot_digest = digest
+            self._snapshot_stat = _stat(self.path)
+            self._archive_journal()
+            self.entries = []
+            self._start_journal()
+            self._stat = self._file_stat()
@@ -0,0 +1,239 @@
+import copy
+
+# Structured KB updates: a list of operations on JSON Pointer paths (RFC 6901), e.g.
+#   {"op": "add", "path": "/risk/vendor_delay", "value": "Supplier may slip two weeks"}
+#   {"op": "replace", "path": "/schedule/go_live", "value": "2024-11-01"}
+#   {"op": "remove", "path": "/stakeholder/old_sponsor"}
+#   {"op": "append", "path": "/scope/deliverables", "value": "Training material"}
+# "add" creates or overwrites (creating missing parent objects), "replace" requires
+# the path to exist, "append" adds one item to a list (creating it if needed).
+OPS = ("add", "replace", "remove", "append")
+
+
+class PatchError(ValueError):
+    pass
+
+
+def parse_pointer(path):
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"Invalid path {path!r}: must start with '/'")
+    return [part.replace("~1", "/").replace("~0", "~") for part in path[1:].split("/")]
+
+
+def make_pointer(parts):
+    return "/" + "/".join(str(part).replace("~", "~0").replace("/", "~1") for part in parts)
+
+
+def _list_index(container, part, allow_end=False):
+    if part == "-" and allow_end:
+        return len(container)
+    try:
+        index = int(part)
+    except ValueError:
+        raise PatchError(f"Invalid list index {part!r}")
+    limit = len(container) if allow_end else len(container) - 1
+    if not 0 <= index <= limit:
+        raise PatchError(f"List index {index} out of range")
+    return index
+
+
+def _child(container, part, create):
+    if isinstance(container, dict):
+        if part not in container:
+            if not create:
+                raise PatchError(f"Path segment {part!r} does not exist")
+            container[part] = {}
+        return container[part]
+    if isinstance(container, list):
+        return container[_list_index(container, part)]
+    raise PatchError(f"Cannot descend into {type(container).__name__} at {part!r}")
+
+
+def _check_path(root, parts, create):
+    # Walk the parent path read-only first so a failing operation changes nothing
+    container = root
+    for part in parts[:-1]:
+        if create and isinstance(container, dict) and part not in container:
+            return  # the rest of the path will be created as objects
+        container = _child(container, part, create=False)
+    if not isinstance(container, (dict, list)):
+        raise PatchError(f"Cannot patch below a {type(container).__name__}")
+
+
+def _apply_op(root, op, copied):
+    if not isinstance(op, dict) or op.get("op") not in OPS:
+        raise PatchError(f"Invalid operation {op!r}")
+    kind = op["op"]
+    parts = parse_pointer(op.get("path"))
+    if parts == [""]:
+        raise PatchError("Cannot patch the whole knowledge base at once")
+    if kind != "remove" and "value" not in op:
+        raise PatchError(f"'{kind}' operation on {op['path']} has no value")
+    _check_path(root, parts, create=kind in ("add", "append"))
+
+    # Copy-on-write along the path: containers that are not touched stay shared
+    parent = root
+    for part in parts[:-1]:
+        child = _child(parent, part, create=kind in ("add", "append"))
+        if id(child) not in copied and isinstance(child, (dict, list)):
+            child = copy.copy(child)
+            copied.add(id(child))
+            if isinstance(parent, dict):
+                parent[part] = child
+            else:
+                parent[_list_index(parent, part)] = child
+        parent = child
+
+    last = parts[-1]
+    if isinstance(parent, dict):
+        if kind == "add":
+            parent[last] = op["value"]
+        elif kind == "replace":
+            if last not in parent:
+                raise PatchError(f"Cannot replace missing path {op['path']}")
+            parent[last] = op["value"]
+        elif kind == "remove":
+            if last not in parent:
+                raise PatchError(f"Cannot remove missing path {op['path']}")
+            del parent[last]
+        else:
+            target = parent.get(last)
+            if target is None:
+                parent[last] = [op["value"]]
+            elif isinstance(target, list):
+                parent[last] = target + [op["value"]]
+            else:
+                raise PatchError(f"Cannot append to non-list at {op['path']}")
+    elif isinstance(parent, list):
+        if kind == "add":
+            parent.insert(_list_index(parent, last, allow_end=True), op["value"])
+        elif kind == "replace":
+            parent[_list_index(parent, last)] = op["value"]
+        elif kind == "remove":
+            del parent[_list_index(parent, last)]
+        else:
+            target = parent[_list_index(parent, last)]
+            if not isinstance(target, list):
+                raise PatchError(f"Cannot append to non-list at {op['path']}")
+            parent[_list_index(parent, last)] = target + [op["value"]]
+    else:
+        raise PatchError(f"Cannot apply {kind} below a {type(parent).__name__} at {op['path']}")
+
+
+_MISSING = object()
+
+
+def _lookup(root, parts):
+    value = root
+    for part in parts:
+        if isinstance(value, dict):
+            if part not in value:
+                return _MISSING
+            value = value[part]
+        elif isinstance(value, list):
+            try:
+                value = value[_list_index(value, part)]
+            except PatchError:
+                return _MISSING
+        else:
+            return _MISSING
+    return value
+
+
+def _inverse_op(root, op):
+    # The operation that undoes op, computed against the KB before op is applied
+    if not isinstance(op, dict) or op.get("op") not in OPS:
+        raise PatchError(f"Invalid operation {op!r}")
+    parts = parse_pointer(op["path"])
+    kind = op["op"]
+    if kind in ("add", "append"):
+        # Objects created along the way are removed again as a whole
+        for depth in range(1, len(parts)):
+            if _lookup(root, parts[:depth]) is _MISSING:
+                return {"op": "remove", "path": make_pointer(parts[:depth])}
+    old = _lookup(root, parts)
+    parent = _lookup(root, parts[:-1])
+    if kind == "add" and isinstance(parent, list):
+        index = _list_index(parent, parts[-1], allow_end=True)
+        return {"op": "remove", "path": make_pointer(parts[:-1] + [index])}
+    if kind == "remove":
+        return {"op": "add", "path": op["path"], "value": old}
+    if old is _MISSING:
+        return {"op": "remove", "path": op["path"]}
+    return {"op": "replace", "path": op["path"], "value": old}
+
+
+def apply_patch(kb, ops, on_error=None, undo=None):
+    """Apply ops to kb and return (new_kb, applied_ops).
+
+    kb itself is left untouched: only the containers along the changed paths are
+    copied, everything else is shared with the original. Invalid operations raise
+    PatchError, unless on_error is given, in which case it is called with
+    (op, error) and the operation is skipped. If undo is a list, it is filled with
+    the operations that revert the patch, in the order they must be applied.
+    """
+    if not isinstance(ops, list):
+        raise PatchError("A patch must be a list of operations")
+    root = dict(kb)
+    copied = {id(root)}
+    applied = []
+    inverse = []
+    for op in ops:
+        try:
+            reverse = _inverse_op(root, op) if undo is not None else None
+            _apply_op(root, op, copied)
+        except PatchError as e:
+            if on_error is None:
+                raise
+            on_error(op, e)
+            continue
+        applied.append(op)
+        if reverse is not None:
+            inverse.append(reverse)
+    if undo is not None:
+        undo.extend(reversed(inverse))
+    return root, applied
+
+
+def diff(old, new, path=()):
+    """Operations that turn old into new, descending into nested objects."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": make_pointer(path + (key,))})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": make_pointer(path + (key,)), "value": value})
+            elif old[key] is not value and old[key] != value:
+                ops.extend(diff(old[key], value, path + (key,)))
+        return ops
+    if old == new:
+        return []
+    return [{"op": "replace", "path": make_pointer(path), "value": new}]
+
+
+def merge_to_patch(updates):
+    # The old update format: {"category": {"key": value}} merged with dict.update
+    ops = []
+    for category, entries in updates.items():
+        if isinstance(entries, dict):
+            for key, value in entries.items():
+                ops.append({"op": "add", "path": make_pointer([category, key]), "value": value})
+        else:
+            ops.append({"op": "add", "path": make_pointer([category]), "value": entries})
+    return ops
+
+
+def changed_paths(ops):
+    return [op["path"] for op in ops]
+
+
+def changed_keys(old, new):
+    """Keys of two dicts whose values differ, e.g. the changed categories of a KB.
+
+    Unchanged values are usually the same object in both (writes copy only the
+    changed paths), so most are skipped without comparing their contents.
+    """
+    return [key for key in set(old) | set(new)
+            if old.get(key) is not new.get(key) and old.get(key) != new.get(key)]
@@ -0,0 +1,134 @@
+import contextlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Keep at most this many project KBs open, and about this much KB data in memory
+# (measured as the size of the KB files on disk)
+MAX_OPEN_PROJECTS = int(os.environ.get("KB_MAX_OPEN_PROJECTS", 16))
+MAX_OPEN_BYTES = int(os.environ.get("KB_MAX_OPEN_BYTES", 256 * 1024 * 1024))
+
+_PROJECT_ID_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+
+
+def check_project_id(project_id):
+    # Project ids become directory names
+    if not isinstance(project_id, str) or not _PROJECT_ID_RE.fullmatch(project_id):
+        raise ValueError(f"Invalid project id {project_id!r}")
+    return project_id
+
+
+class ProjectKB:
+    """The open knowledge base of one project: its store and its search index.
+
+    published is the KB as of the last change event sent for the project, and
+    watcher the KBFileWatcher on its files, if anyone is subscribed to its changes.
+    users counts the ProjectRegistry.use() blocks currently working on it.
+    """
+
+    def __init__(self, project_id, store, index):
+        self.project_id = project_id
+        self.store = store
+        self.index = index
+        self.published = None
+        self.watcher = None
+        self.users = 0
+
+    def files(self):
+        return [path for path in (getattr(self.store, "path", None), getattr(self.store, "journal_path", None))
+                if path]
+
+    def size(self):
+        total = 0
+        for path in self.files():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def close(self):
+        # Leave an up-to-date KB file behind, then release the store's connection
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        self.store.compact()
+        self.store.close()
+
+
+class ProjectRegistry:
+    """Lazily opened project KBs, kept in an LRU bounded by count and size.
+
+    open_project(project_id) creates the ProjectKB on first access. When more than
+    max_open projects are open, or their KB files add up to more than max_bytes, the
+    least recently used ones are closed; they are reopened transparently on the next
+    access. The most recently used project is never closed, and neither is one in
+    use(): it is closed by a later eviction, at the earliest when its last user is done.
+    Code that keeps a ProjectKB from get() across calls should hold it with use().
+    """
+
+    def __init__(self, open_project, max_open=MAX_OPEN_PROJECTS, max_bytes=MAX_OPEN_BYTES):
+        self.open_project = open_project
+        self.max_open = max_open
+        self.max_bytes = max_bytes
+        self._projects = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, project_id):
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is None:
+                project = self._projects[project_id] = self.open_project(check_project_id(project_id))
+                self._evict()
+            else:
+                self._projects.move_to_end(project_id)
+            return project
+
+    @contextlib.contextmanager
+    def use(self, project_id):
+        # The project, kept open until the with block ends
+        with self._lock:
+            project = self.get(project_id)
+            project.users += 1
+        try:
+            yield project
+        finally:
+            with self._lock:
+                project.users -= 1
+                if not project.users and self._projects.get(project.project_id) is project:
+                    self._evict()
+
+    def _evict(self):
+        # Least recently used first, never the most recent one
+        for project_id, project in list(self._projects.items())[:-1]:
+            if len(self._projects) <= self.max_open and self.total_bytes() <= self.max_bytes:
+                break
+            if project.users:
+                continue
+            del self._projects[project_id]
+            project.close()
+
+    def total_bytes(self):
+        return sum(project.size() for project in self._projects.values())
+
+    def peek(self, project_id):
+        # The project if it is open, without opening it or changing the LRU order
+        with self._lock:
+            return self._projects.get(project_id)
+
+    def open_projects(self):
+        with self._lock:
+            return list(self._projects)
+
+    def close(self, project_id):
+        with self._lock:
+            project = self._projects.pop(project_id, None)
+            if project is not None:
+                project.close()
+
+    def close_all(self):
+        with self._lock:
+            while self._projects:
+                _, project = self._projects.popitem(last=False)
+                project.close()
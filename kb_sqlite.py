@@ -0,0 +1,321 @@
+import argparse
+import json
+import sqlite3
+import threading
+
+from kb_index import tokenize
+from kb_patch import apply_patch, diff, parse_pointer
+from kb_store import KBConflictError
+
+# How many updates can be undone (the oldest undo records are dropped beyond this)
+UNDO_LOG_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    value TEXT            -- JSON, only for categories that are not objects
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value TEXT NOT NULL,  -- JSON
+    UNIQUE (category, key)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    category, key, value, content='entries', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts(rowid, category, key, value) VALUES (new.id, new.category, new.key, new.value);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts(entries_fts, rowid, category, key, value) VALUES ('delete', old.id, old.category, old.key, old.value);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE ON entries BEGIN
+    INSERT INTO entries_fts(entries_fts, rowid, category, key, value) VALUES ('delete', old.id, old.category, old.key, old.value);
+    INSERT INTO entries_fts(rowid, category, key, value) VALUES (new.id, new.category, new.key, new.value);
+END;
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (name, value) VALUES ('revision', 0);
+CREATE TABLE IF NOT EXISTS undo_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    undo TEXT NOT NULL,   -- JSON, the kb_patch operations that revert the update
+    undoes INTEGER        -- for an undo, the seq of the update it reverted
+);
+"""
+
+
+class SQLiteKBStore:
+    """Knowledge base kept in an embedded SQLite database, one row per (category, key).
+
+    Offers the same interface as KBStore (read, snapshot, write, update, apply_patch,
+    version) and JournaledKBStore's undo() so the agent can use either. Writes only touch the rows whose entries
+    changed, inside one IMMEDIATE transaction, which also serializes writers across
+    processes. A revision counter in the database tells each process when its
+    in-memory copy is stale. search() runs an FTS5 query over categories, keys and
+    values and returns results in the same shape as KBIndex.search().
+    """
+
+    def __init__(self, path, default_factory=dict):
+        self.path = path
+        self.default_factory = default_factory
+        self.version = 0
+        self.retries = 0            # update() attempts lost to a concurrent writer
+        self._kb = None
+        self._revision = None
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        with self._lock, self._transaction():
+            if self._db.execute("SELECT COUNT(*) FROM categories").fetchone()[0] == 0:
+                self._replace_all(self.default_factory())
+
+    def close(self):
+        self._db.close()
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+    def _current_revision(self):
+        return self._db.execute("SELECT value FROM meta WHERE name = 'revision'").fetchone()[0]
+
+    def _bump_revision(self):
+        self._db.execute("UPDATE meta SET value = value + 1 WHERE name = 'revision'")
+        return self._current_revision()
+
+    # -- reading ------------------------------------------------------------
+
+    def read(self):
+        return self.read_versioned()[0]
+
+    def read_versioned(self):
+        with self._lock:
+            revision = self._current_revision()
+            if self._kb is None or revision != self._revision:
+                self._kb = self._load()
+                self._revision = revision
+                self.version += 1
+            return self._kb, self._revision
+
+    def _load(self):
+        kb = {}
+        for name, value in self._db.execute("SELECT name, value FROM categories ORDER BY position"):
+            kb[name] = {} if value is None else json.loads(value)
+        for category, key, value in self._db.execute(
+                "SELECT category, key, value FROM entries ORDER BY category, position"):
+            kb[category][key] = json.loads(value)
+        return kb
+
+    def snapshot(self):
+        return self.snapshot_versioned()[0]
+
+    def snapshot_versioned(self):
+        with self._lock:
+            kb, token = self.read_versioned()
+            return json.loads(json.dumps(kb)), token
+
+    def search(self, query, limit=200):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT category, key, bm25(entries_fts) FROM entries_fts "
+                "WHERE entries_fts MATCH ? ORDER BY bm25(entries_fts) LIMIT ?",
+                (match, limit),
+            ).fetchall()
+        # bm25() is lower-is-better; KBIndex scores are higher-is-better
+        return [((category, key), -score) for category, key, score in rows]
+
+    # -- writing ------------------------------------------------------------
+
+    def _replace_all(self, kb):
+        self._db.execute("DELETE FROM entries")
+        self._db.execute("DELETE FROM categories")
+        for position, (category, items) in enumerate(kb.items()):
+            self._write_category(category, items, position)
+        self._bump_revision()
+
+    def _write_category(self, category, items, position=None):
+        if position is None:
+            row = self._db.execute("SELECT position FROM categories WHERE name = ?", (category,)).fetchone()
+            position = row[0] if row else self._db.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM categories").fetchone()[0]
+        self._db.execute("DELETE FROM entries WHERE category = ?", (category,))
+        self._db.execute(
+            "INSERT OR REPLACE INTO categories (name, position, value) VALUES (?, ?, ?)",
+            (category, position, None if isinstance(items, dict) else json.dumps(items)),
+        )
+        if isinstance(items, dict):
+            self._db.executemany(
+                "INSERT INTO entries (category, key, position, value) VALUES (?, ?, ?, ?)",
+                [(category, key, i, json.dumps(value)) for i, (key, value) in enumerate(items.items())],
+            )
+
+    def _persist(self, new_kb, paths):
+        # Upsert or delete only the rows touched by the changed paths
+        for path in paths:
+            parts = parse_pointer(path)
+            category = parts[0]
+            if category not in new_kb:
+                self._db.execute("DELETE FROM entries WHERE category = ?", (category,))
+                self._db.execute("DELETE FROM categories WHERE name = ?", (category,))
+            elif len(parts) == 1 or not isinstance(new_kb[category], dict):
+                self._write_category(category, new_kb[category])
+            else:
+                key = parts[1]
+                exists = self._db.execute("SELECT 1 FROM categories WHERE name = ?", (category,)).fetchone()
+                if not exists:
+                    self._write_category(category, new_kb[category])
+                elif key in new_kb[category]:
+                    position = list(new_kb[category]).index(key)
+                    self._db.execute(
+                        "INSERT INTO entries (category, key, position, value) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (category, key) DO UPDATE SET value = excluded.value",
+                        (category, key, position, json.dumps(new_kb[category][key])),
+                    )
+                else:
+                    self._db.execute("DELETE FROM entries WHERE category = ? AND key = ?", (category, key))
+
+    def _commit(self, new_kb, paths, undo, undoes=None):
+        # Caller holds the lock inside a write transaction; the undo record is part of it
+        self._persist(new_kb, paths)
+        self._db.execute("INSERT INTO undo_log (undo, undoes) VALUES (?, ?)", (json.dumps(undo), undoes))
+        self._db.execute("DELETE FROM undo_log WHERE seq <= last_insert_rowid() - ?", (UNDO_LOG_SIZE,))
+        self._revision = self._bump_revision()
+        self._kb = new_kb
+        self.version += 1
+        return self.version
+
+    def write(self, kb, expected=None):
+        with self._lock, self._transaction():
+            if expected is not None and self._current_revision() != expected:
+                raise KBConflictError(self.path)
+            old = self.read()
+            ops = diff(old, kb)
+            if not ops:
+                return self.version
+            return self._commit(kb, [op["path"] for op in ops], diff(kb, old))
+
+    def update(self, mutate, max_retries=10):
+        for _ in range(max_retries):
+            kb, token = self.snapshot_versioned()
+            mutate(kb)
+            try:
+                return self.write(kb, expected=token)
+            except KBConflictError:
+                self.retries += 1
+                continue
+        raise KBConflictError(self.path)
+
+    def apply_patch(self, ops, on_error=None):
+        with self._lock, self._transaction():
+            undo = []
+            new_kb, applied = apply_patch(self.read(), ops, on_error, undo=undo)
+            if applied:
+                self._commit(new_kb, [op["path"] for op in applied], undo)
+            return applied
+
+    def compact(self):
+        pass  # SQLite manages its own storage
+
+    def undo(self, seq=None):
+        """Revert an update (by default the most recent one not yet undone).
+
+        Like the JSON journal: the revert is itself recorded, and only the last
+        UNDO_LOG_SIZE updates can be undone. Returns the applied operations, or []
+        if there was nothing to undo.
+        """
+        with self._lock, self._transaction():
+            query = ("SELECT seq, undo FROM undo_log WHERE undoes IS NULL "
+                     "AND seq NOT IN (SELECT undoes FROM undo_log WHERE undoes IS NOT NULL)")
+            if seq is not None:
+                row = self._db.execute(query + " AND seq = ?", (seq,)).fetchone()
+            else:
+                row = self._db.execute(query + " ORDER BY seq DESC LIMIT 1").fetchone()
+            if row is None:
+                return []
+            undo = []
+            new_kb, applied = apply_patch(self.read(), json.loads(row[1]), on_error=_ignore, undo=undo)
+            if applied:
+                self._commit(new_kb, [op["path"] for op in applied], undo, undoes=row[0])
+            return applied
+
+    # -- import / export ----------------------------------------------------
+
+    def import_json(self, json_path):
+        with open(json_path) as f:
+            kb = json.load(f)
+        with self._lock, self._transaction():
+            self._replace_all(kb)
+            self._kb = None
+        return self.read()
+
+    def export_json(self, json_path):
+        with open(json_path, 'w') as f:
+            json.dump(self.read(), f, indent=2)
+
+
+class FTSIndex:
+    """KBIndex stand-in for select_context() that searches the store with FTS5.
+
+    SQLite keeps the full-text index up to date with every write, so there is
+    nothing to build or update here.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.signature = None
+        self.kb_tokens = None
+
+    @property
+    def categories(self):
+        return list(self.store.read().keys())
+
+    def build(self, kb, signature=None):
+        self.signature = signature
+
+    def update(self, kb, paths, signature=None):
+        self.signature = signature
+
+    def sync(self, kb, signature):
+        self.signature = signature
+
+    def search(self, query, limit=200):
+        return self.store.search(query, limit)
+
+
+def _ignore(op, error):
+    # Parts of an undo that no longer apply (e.g. the entry was removed since) are skipped
+    pass
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes SQLite's write lock up front, so concurrent writers queue
+    # instead of failing halfway through a read-modify-write
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move a knowledge base between JSON and SQLite")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("json_file")
+    parser.add_argument("sqlite_file")
+    args = parser.parse_args()
+    store = SQLiteKBStore(args.sqlite_file)
+    if args.command == "import":
+        store.import_json(args.json_file)
+    else:
+        store.export_json(args.json_file)
@@ -0,0 +1,199 @@
+import contextlib
+import json
+import os
+import tempfile
+import threading
+
+from kb_patch import apply_patch
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# read_versioned() token for a KB file that does not exist yet; a real token, so a
+# writer that read "missing" still conflicts with one that created the file meanwhile
+MISSING_FILE = "missing"
+
+
+class KBConflictError(Exception):
+    """The KB file changed between the read and the write of an optimistic update."""
+
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    # Advisory lock shared by every process that goes through KBStore
+    with open(lock_path, 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write(path, text, mode=None):
+    # Write to a temp file in the same directory, fsync, then rename over path
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".kb-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file as 0600; keep the KB readable like a normal file
+        os.chmod(tmp_path, _file_mode(path) if mode is None else mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _file_mode(path):
+    try:
+        return os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+class KBStore:
+    """In-memory copy of a JSON knowledge base file, shared by everyone in the process.
+
+    The parsed KB is kept in memory and only re-read when the file's inode, mtime or
+    size changes. Writes go through to disk atomically (temp file + rename) while
+    holding an advisory lock on `<path>.lock`, so several processes can share one KB.
+    `version` is bumped every time the in-memory copy changes, so callers can cheaply
+    tell whether anything derived from the KB is stale.
+
+    For read-modify-write cycles use update(), which retries when another writer got
+    in between the read and the write.
+
+    apply_patch() applies a list of kb_patch operations under the lock.
+
+    The dict returned by read() is shared: treat it as read-only and use snapshot()
+    when you need a copy to modify.
+    """
+
+    def __init__(self, path, default_factory=dict):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.default_factory = default_factory
+        self.version = 0
+        self.retries = 0            # update() attempts lost to a concurrent writer
+        self._kb = None
+        self._stat = None
+        self._lock = threading.RLock()
+        self._file_lock_depth = 0
+
+    def close(self):
+        pass  # Nothing is kept open between calls
+
+    @contextlib.contextmanager
+    def _file_locked(self):
+        # Re-entrant within the process: flock would deadlock on a second open()
+        with self._lock:
+            if self._file_lock_depth:
+                self._file_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._file_lock_depth -= 1
+                return
+            with file_lock(self.lock_path):
+                self._file_lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._file_lock_depth = 0
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return MISSING_FILE
+        return (st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+
+    def read(self):
+        return self.read_versioned()[0]
+
+    def read_versioned(self):
+        # Returns the KB together with a token identifying the file revision it came from
+        with self._lock:
+            stat = self._file_stat()
+            if self._kb is None or stat != self._stat:
+                self._kb, self._stat = self._load(stat)
+                self.version += 1
+            return self._kb, self._stat
+
+    def _load(self, stat):
+        # Returns the KB and the file revision token it corresponds to
+        if stat == MISSING_FILE:
+            return self.default_factory(), stat
+        with open(self.path, 'r') as f:
+            return json.load(f), stat
+
+    def snapshot(self):
+        return self.snapshot_versioned()[0]
+
+    def snapshot_versioned(self):
+        with self._lock:
+            kb, token = self.read_versioned()
+            return json.loads(json.dumps(kb)), token
+
+    def write(self, kb, expected=None):
+        # If expected is given (a token from read_versioned), refuse to overwrite a newer file
+        with self._file_locked():
+            if expected is not None and self._file_stat() != expected:
+                raise KBConflictError(self.path)
+            return self._commit(kb)
+
+    def _commit(self, kb):
+        # Caller holds the file lock
+        atomic_write(self.path, json.dumps(kb, indent=2))
+        self._kb = kb
+        self._stat = self._file_stat()
+        self.version += 1
+        return self.version
+
+    def update(self, mutate, max_retries=10):
+        """Apply mutate(kb) to a fresh copy of the KB and write it back.
+
+        The mutation runs without holding the file lock; if someone else wrote the KB
+        in the meantime, the write is rejected and the mutation is replayed on the
+        newer copy.
+        """
+        for _ in range(max_retries):
+            kb, token = self.snapshot_versioned()
+            mutate(kb)
+            try:
+                return self.write(kb, expected=token)
+            except KBConflictError:
+                self.retries += 1
+                continue
+        raise KBConflictError(self.path)
+
+    def apply_patch(self, ops, on_error=None):
+        """Apply kb_patch operations to the latest KB and return the ones that applied.
+
+        Runs entirely under the file lock, so concurrent patches from several
+        processes are serialized rather than retried. Only the containers along the
+        changed paths are copied; readers holding the previous dict are unaffected.
+        """
+        with self._file_locked():
+            new_kb, applied = apply_patch(self.read(), ops, on_error)
+            if applied:
+                self._commit(new_kb)
+            return applied
+
@@ -0,0 +1,169 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Keep this many recent samples per histogram for the quantiles
+SAMPLES = 1024
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+def _quantile(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class _Histogram:
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+        if len(self.samples) > SAMPLES:
+            del self.samples[:len(self.samples) - SAMPLES]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": _quantile(self.samples, 0.5),
+            "p95": _quantile(self.samples, 0.95),
+        }
+
+
+class MetricsRegistry:
+    """Counters and histograms with labels, dumped as JSON or Prometheus text.
+
+    Every observation can also be written as one JSON line to `event_log` (a file
+    path, or "-" for stderr) so runs can be followed without verbose printing.
+    """
+
+    def __init__(self, prefix="pm_agent", event_log=None):
+        self.prefix = prefix
+        self._counters = {}         # name -> {label key: value}
+        self._histograms = {}       # name -> {label key: _Histogram}
+        self._lock = threading.Lock()
+        self._event_file = None
+        if event_log == "-":
+            self._event_file = sys.stderr
+        elif event_log:
+            self._event_file = open(event_log, "a", buffering=1)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+        self._event(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = _Histogram()
+            series[key].observe(value)
+        self._event(name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _event(self, name, value, labels):
+        if self._event_file is not None:
+            line = json.dumps({"time": time.time(), "metric": name, "value": value, **labels})
+            with self._lock:
+                self._event_file.write(line + "\n")
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_json(self):
+        with self._lock:
+            return {
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                             for name, series in self._counters.items()},
+                "histograms": {name: [{"labels": dict(key), **hist.to_dict()} for key, hist in series.items()]
+                               for name, series in self._histograms.items()},
+            }
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in series.items():
+                    lines.append(f"{metric}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} summary")
+                for key, hist in series.items():
+                    for q in (0.5, 0.95):
+                        lines.append(f"{metric}{_format_labels(key, [('quantile', q)])} {_quantile(hist.samples, q)}")
+                    lines.append(f"{metric}_sum{_format_labels(key)} {hist.sum}")
+                    lines.append(f"{metric}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), f, indent=2)
+
+
+def format_report(data):
+    """Human-readable tables for a to_json() dump."""
+    lines = []
+    if data["histograms"]:
+        lines.append(f"{'histogram':<28} {'labels':<28} {'count':>7} {'p50':>10} {'p95':>10} {'max':>10} {'sum':>12}")
+        for name, series in sorted(data["histograms"].items()):
+            for entry in series:
+                labels = ",".join(f"{k}={v}" for k, v in sorted(entry["labels"].items()))
+                lines.append(f"{name:<28} {labels:<28} {entry['count']:>7} {entry['p50']:>10.4g} "
+                             f"{entry['p95']:>10.4g} {entry['max']:>10.4g} {entry['sum']:>12.6g}")
+    if data["counters"]:
+        if lines:
+            lines.append("")
+        lines.append(f"{'counter':<28} {'labels':<28} {'value':>12}")
+        for name, series in sorted(data["counters"].items()):
+            for entry in series:
+                labels = ",".join(f"{k}={v}" for k, v in sorted(entry["labels"].items()))
+                lines.append(f"{name:<28} {labels:<28} {entry['value']:>12}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print a report of a metrics JSON dump")
+    parser.add_argument("dump", help="file written with AGENT_METRICS_FILE or GET /metrics.json")
+    args = parser.parse_args()
+    with open(args.dump) as f:
+        print(format_report(json.load(f)))
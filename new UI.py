@@ -1,14 +1,28 @@
 import wx
 import json
 import os
-from agent import process_user_input, read_knowledge_base, write_knowledge_base
+# With PM_AGENT_URL set, talk to a running server.py instead of loading the agent in-process
+if os.environ.get("PM_AGENT_URL"):
+    from agent_client import (process_user_input, read_knowledge_base,
+                              subscribe_kb_changes, unsubscribe_kb_changes, warm_up, shutdown)
+else:
+    from agent import (process_user_input, read_knowledge_base,
+                       subscribe_kb_changes, unsubscribe_kb_changes, warm_up, shutdown)
+from agent_worker import AgentWorker
+from resize_controller import ResizeController
+from wx_kb_tree import KBTreeCtrl
 
 class InputTextCtrl(wx.TextCtrl):
     def __init__(self, parent, id=wx.ID_ANY, value="", pos=wx.DefaultPosition, size=wx.DefaultSize, style=0, validator=wx.DefaultValidator, name=wx.TextCtrlNameStr):
         super().__init__(parent, id, value, pos, size, style, validator, name)
+        # Typing and resizing lay out the parent at most once per debounce interval,
+        # and only when the height actually changes
+        self.resizer = ResizeController(self.InputBoxHeight, self.SetInputBoxHeight, wx.CallLater)
+        self.char_height = self.GetCharHeight()
         self.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
         self.Bind(wx.EVT_TEXT, self.OnText)
-        self.SetMinSize(wx.Size(-1, self.GetCharHeight() + 10))
+        self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.resizer.apply()
 
     def OnKeyDown(self, event):
         if event.GetKeyCode() == wx.WXK_RETURN:
@@ -24,10 +38,24 @@ class InputTextCtrl(wx.TextCtrl):
         self.AdjustInputBoxSize()
         event.Skip()
 
+    def OnSize(self, event):
+        # A new width can change how many lines the text wraps to
+        self.AdjustInputBoxSize()
+        event.Skip()
+
+    def SetFont(self, font):
+        result = super().SetFont(font)
+        self.char_height = self.GetCharHeight()
+        self.AdjustInputBoxSize()
+        return result
+
     def AdjustInputBoxSize(self):
-        numLines = self.GetNumberOfLines()
-        charHeight = self.GetCharHeight()
-        height = min(numLines * charHeight + 10, 100)  # Limit max height
+        self.resizer.request()
+
+    def InputBoxHeight(self):
+        return min(self.GetNumberOfLines() * self.char_height + 10, 100)  # Limit max height
+
+    def SetInputBoxHeight(self, height):
         self.SetMinSize(wx.Size(-1, height))
         self.GetParent().Layout()
 
@@ -63,18 +91,23 @@ class ChatbotGUI(wx.Frame):
         # Input area
         self.msg_entry = InputTextCtrl(panel, style=wx.TE_MULTILINE)
 
+        # Pending indicator, shown while the agent is working on a request
+        self.status_text = wx.StaticText(panel, label="")
+
         # Adding intro text, chat log and input area to chat layout
         chat_layout.Add(intro_box_sizer, 0, wx.EXPAND | wx.ALL, 5)
         chat_layout.Add(self.chat_log, 1, wx.EXPAND | wx.ALL, 5)
+        chat_layout.Add(self.status_text, 0, wx.LEFT | wx.RIGHT, 5)
         chat_layout.Add(self.msg_entry, 0, wx.EXPAND | wx.ALL, 5)
 
         # Knowledge database window
         knowledge_sizer = wx.BoxSizer(wx.VERTICAL)
         knowledge_label = wx.StaticText(panel, label="Project Knowledge Base")
-        self.knowledge_text = wx.TextCtrl(panel, style=wx.TE_MULTILINE | wx.TE_READONLY)
+        # Only the categories and entries that changed are updated after a turn
+        self.knowledge_tree = KBTreeCtrl(panel)
 
         knowledge_sizer.Add(knowledge_label, 0, wx.ALL, 5)
-        knowledge_sizer.Add(self.knowledge_text, 1, wx.EXPAND | wx.ALL, 5)
+        knowledge_sizer.Add(self.knowledge_tree, 1, wx.EXPAND | wx.ALL, 5)
 
         # Add chat and knowledge sizers to main sizer
         main_layout.Add(chat_layout, 2, wx.EXPAND | wx.ALL, 10)
@@ -82,10 +115,18 @@ class ChatbotGUI(wx.Frame):
 
         panel.SetSizer(main_layout)
         self.load_knowledge_base()
+        # Refresh the panel whenever the KB changes, also when it is edited outside this window
+        self.kb_subscription = subscribe_kb_changes(self.OnKBChanged)
         self.Show()
 
         # Bind the OK event (triggered by Return key) to send_message
         self.Bind(wx.EVT_BUTTON, self.send_message, id=wx.ID_OK)
+        # Esc cancels queued requests
+        self.Bind(wx.EVT_CHAR_HOOK, self.OnCharHook)
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
+
+        # Agent calls run on a background thread; results come back via wx.CallAfter
+        self.worker = AgentWorker(process_user_input, wx.CallAfter)
 
     def send_message(self, event):
         user_message = self.msg_entry.GetValue()
@@ -94,11 +135,48 @@ class ChatbotGUI(wx.Frame):
         self.msg_entry.Clear()
         self.update_chat_log("You", user_message, is_user=True)
 
-        # Call agent's process_user_input function
-        response = self.get_agent_response(user_message)
+        # Call agent's process_user_input function in the background
+        self.worker.submit(user_message, self.process_response, self.process_error, self.update_status)
+        self.update_status()
 
+    def process_response(self, response):
         self.update_chat_log("PM Helper", response, is_user=False)
-        self.load_knowledge_base()  # Reload the knowledge base after each interaction
+        if self.kb_subscription is None:
+            self.load_knowledge_base()  # No change events from the remote client: reload after each interaction
+        self.update_status()
+
+    def process_error(self, error):
+        self.update_chat_log("PM Helper", f"Error: {str(error)}", is_user=False)
+        self.update_status()
+
+    def update_status(self):
+        pending = self.worker.pending_count()
+        if pending == 0:
+            self.status_text.SetLabel("")
+        elif pending == 1:
+            self.status_text.SetLabel("PM Helper is thinking... (Esc to cancel)")
+        else:
+            self.status_text.SetLabel(f"PM Helper is thinking... {pending - 1} more queued (Esc to cancel)")
+        self.status_text.GetParent().Layout()
+
+    def cancel_requests(self):
+        if self.worker.cancel_pending():
+            self.update_chat_log("PM Helper", "Cancelled.", is_user=False)
+        self.update_status()
+
+    def OnCharHook(self, event):
+        if event.GetKeyCode() == wx.WXK_ESCAPE:
+            self.cancel_requests()
+        else:
+            event.Skip()
+
+    def OnClose(self, event):
+        if self.kb_subscription is not None:
+            unsubscribe_kb_changes(self.kb_subscription)
+        # Let a running turn finish, then apply its KB update before the process exits
+        self.worker.shutdown(wait=True)
+        shutdown()
+        event.Skip()
 
     def update_chat_log(self, sender, message, is_user):
         message_panel = wx.Panel(self.chat_log)
@@ -128,24 +206,16 @@ class ChatbotGUI(wx.Frame):
         self.chat_log.Layout()
         self.chat_log.Scroll(0, self.chat_log.GetVirtualSize().GetHeight())
 
-    def get_agent_response(self, user_message):
-        try:
-            response = process_user_input(user_message)  
-            self.load_knowledge_base()  # Reload the knowledge base after each interaction
-            return response
-        except Exception as e:
-            return f"Error: {str(e)}"
-
     def load_knowledge_base(self):
-        knowledge = read_knowledge_base()
-        self.knowledge_text.Clear()
-        for category, items in knowledge.items():
-            self.knowledge_text.AppendText(f"{category}:\n")
-            for key, value in items.items():
-                self.knowledge_text.AppendText(f"  {key}: {value}\n")
-            self.knowledge_text.AppendText("\n")
+        self.knowledge_tree.show(read_knowledge_base())
+
+    def OnKBChanged(self, change):
+        # Called on the agent's worker thread or the KB file watcher's thread; only
+        # the changed categories are compared and redrawn
+        self.knowledge_tree.refresh_later(read_knowledge_base, change.categories or None)
 
 if __name__ == '__main__':
     app = wx.App()
     frame = ChatbotGUI()
+    warm_up()
     app.MainLoop()
\ No newline at end of file
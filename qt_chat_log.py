@@ -0,0 +1,141 @@
+from PySide6.QtCore import QAbstractListModel, QModelIndex, QRect, QSize, Qt, QTimer
+from PySide6.QtGui import QColor, QFont, QFontMetrics, QPainter
+from PySide6.QtWidgets import QAbstractItemView, QListView, QStyledItemDelegate
+
+IS_USER_ROLE = Qt.UserRole + 1
+
+# Share of the view width a message may take, and the padding inside and between bubbles
+USER_WIDTH = 0.7
+OTHER_WIDTH = 0.9
+PADDING = 10
+SPACING = 5
+USER_COLOR = QColor(64, 64, 64)     # Dark gray
+
+
+class ChatMessageModel(QAbstractListModel):
+    """The chat history as one (text, is_user) tuple per row; no widget per message."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._messages = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        text, is_user = self._messages[index.row()]
+        if role == Qt.DisplayRole:
+            return text
+        if role == IS_USER_ROLE:
+            return is_user
+        return None
+
+    def add_message(self, text, is_user=False):
+        row = len(self._messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._messages.append((text, is_user))
+        self.endInsertRows()
+        return row
+
+    def append_text(self, row, text):
+        message, is_user = self._messages[row]
+        self._messages[row] = (message + text, is_user)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+
+class ChatMessageDelegate(QStyledItemDelegate):
+    """Paints a message as a bubble: user messages right-aligned on dark gray.
+
+    The wrapped text rectangle of each row is cached together with the view width it
+    was computed for, so scrolling and repainting never re-measure text; only a
+    changed message or a new width does.
+    """
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.fonts = {True: QFont("Arial", 12), False: QFont("Arial", 14)}
+        self.metrics = {is_user: QFontMetrics(font) for is_user, font in self.fonts.items()}
+        self._text_rects = {}       # row -> (view width, QRect of the wrapped text)
+
+    def forget(self, row=None):
+        if row is None:
+            self._text_rects.clear()
+        else:
+            self._text_rects.pop(row, None)
+
+    def _text_rect(self, index, width):
+        cached = self._text_rects.get(index.row())
+        if cached is not None and cached[0] == width:
+            return cached[1]
+        is_user = index.data(IS_USER_ROLE)
+        max_width = max(1, int(width * (USER_WIDTH if is_user else OTHER_WIDTH)) - 2 * PADDING)
+        rect = self.metrics[is_user].boundingRect(QRect(0, 0, max_width, 1 << 24), Qt.TextWordWrap,
+                                                   index.data())
+        self._text_rects[index.row()] = (width, rect)
+        return rect
+
+    def sizeHint(self, option, index):
+        width = self.view.viewport().width()
+        return QSize(width, self._text_rect(index, width).height() + 2 * PADDING + SPACING)
+
+    def paint(self, painter, option, index):
+        is_user = index.data(IS_USER_ROLE)
+        text_rect = self._text_rect(index, self.view.viewport().width())
+        width, height = text_rect.width() + 2 * PADDING, text_rect.height() + 2 * PADDING
+        x = option.rect.right() - width - PADDING if is_user else option.rect.left() + PADDING
+        bubble = QRect(x, option.rect.top(), width, height)
+
+        painter.save()
+        if is_user:
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(USER_COLOR)
+            painter.drawRoundedRect(bubble, 15, 15)
+        painter.setPen(Qt.white)
+        painter.setFont(self.fonts[is_user])
+        painter.drawText(bubble.adjusted(PADDING, PADDING, -PADDING, -PADDING), Qt.TextWordWrap, index.data())
+        painter.restore()
+
+
+class ChatLog(QListView):
+    """Chat history view: only the rows in view are painted, and resizing re-wraps
+    text without creating, resizing or laying out a widget per message."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.messages = ChatMessageModel(self)
+        self.delegate = ChatMessageDelegate(self)
+        self.setModel(self.messages)
+        self.setItemDelegate(self.delegate)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        # Re-layout (from the cached sizes) when the width changes
+        self.setResizeMode(QListView.Adjust)
+        self.setStyleSheet("QListView { background-color: black; border: none; }")
+        self.messages.dataChanged.connect(self._message_changed)
+        self.messages.modelReset.connect(self.delegate.forget)
+
+    def add_message(self, text, is_user=False):
+        # Returns the row, to pass to append_to_message
+        row = self.messages.add_message(text, is_user)
+        QTimer.singleShot(0, self.scroll_to_bottom)
+        return row
+
+    def append_to_message(self, row, text):
+        # Used while an answer is streaming in
+        self.messages.append_text(row, text)
+        QTimer.singleShot(0, self.scroll_to_bottom)
+
+    def scroll_to_bottom(self):
+        self.scrollToBottom()
+
+    def _message_changed(self, top_left, bottom_right, roles=()):
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            self.delegate.forget(row)
+            self.delegate.sizeHintChanged.emit(self.messages.index(row))
@@ -0,0 +1,58 @@
+# Resize requests arriving within this many milliseconds are applied together
+RESIZE_DEBOUNCE_MS = 30
+
+
+class ResizeController:
+    """Coalesces a widget's resize requests into at most one layout pass per interval.
+
+    measure() returns the size the widget should have; it must be cheap and must not
+    trigger a layout. resize(size) applies it (e.g. SetMinSize plus Layout, or
+    setFixedHeight). schedule(delay_ms, callback) is the toolkit's single-shot timer:
+    wx.CallLater or QTimer.singleShot.
+
+    The first request() starts the timer and later ones are folded into it. When it
+    fires, resize() is only called if the measured size changed, and requests made
+    while resize() runs (the resize events it causes) are ignored, so a resize can't
+    feed back into another one.
+    """
+
+    def __init__(self, measure, resize, schedule, delay_ms=RESIZE_DEBOUNCE_MS):
+        self.measure = measure
+        self.resize = resize
+        self.schedule = schedule
+        self.delay_ms = delay_ms
+        self.size = None
+        self.pending = False
+        self._resizing = False
+        self.requests = 0
+        self.layout_passes = 0
+
+    def request(self, *args):
+        # Extra arguments are ignored, so it can be connected to any signal or event
+        if self._resizing:
+            return
+        self.requests += 1
+        if not self.pending:
+            self.pending = True
+            self.schedule(self.delay_ms, self._fire)
+
+    def _fire(self):
+        self.pending = False
+        self.apply()
+
+    def apply(self):
+        """Measure now and resize if needed; returns True if a layout pass ran."""
+        size = self.measure()
+        if size == self.size:
+            return False
+        self.size = size
+        self._resizing = True
+        try:
+            self.resize(size)
+        finally:
+            self._resizing = False
+        self.layout_passes += 1
+        return True
+
+    def stats(self):
+        return {"requests": self.requests, "layout_passes": self.layout_passes}
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache answers for this long, and keep at most this many in memory (0 disables the cache)
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 512))
+# Optional SQLite file for a second, persistent tier
+RESPONSE_CACHE_DB = os.environ.get("RESPONSE_CACHE_DB")
+
+# Depends on every category, e.g. because the answer agent read the whole KB with its tool
+ALL_CATEGORIES = "*"
+
+_SPACE_RE = re.compile(r"\s+")
+# Words that refer back to the conversation ("what about that one?")
+_FOLLOW_UP_RE = re.compile(
+    r"\b(it|its|that|these|those|they|them|their|he|she|him|her|above|previous|earlier|same|again|"
+    r"former|latter|else)\b", re.IGNORECASE)
+
+
+def normalize_question(question):
+    return _SPACE_RE.sub(" ", question.strip().lower()).rstrip("?!. ")
+
+
+def is_follow_up(question):
+    return _FOLLOW_UP_RE.search(question) is not None
+
+
+def cache_key(project_id, question, kb_context, history=None):
+    # The context is the KB text the answer was based on, so any change to the
+    # entries it was built from leads to a different key. history is given for
+    # answers that depend on the conversation so far.
+    text = json.dumps([project_id, normalize_question(question), kb_context, history])
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of answers, with an optional persistent SQLite tier.
+
+    Each entry records the project and the KB categories it depends on so that
+    invalidate() can drop it as soon as one of those categories changes. Hit and
+    miss counts are available from stats().
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, db_path=RESPONSE_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (response, project_id, categories, created)
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = self.disk_hits = self.misses = self.evictions = self.invalidations = 0
+        if db_path and max_entries > 0:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "project TEXT NOT NULL, categories TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[3] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, project, categories, created FROM responses WHERE key = ? AND created >= ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is not None:
+                    self._remember(key, (row[0], row[1], frozenset(json.loads(row[2])), row[3]))
+                    self.disk_hits += 1
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, response, project_id, categories):
+        if not self.enabled:
+            return
+        entry = (response, project_id, frozenset(categories), time.time())
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, project, categories, created) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, response, project_id, json.dumps(sorted(entry[2])), entry[3]),
+                )
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, project_id, categories):
+        """Drop the project's answers that depend on any of the changed categories."""
+        changed = set(categories)
+        if not changed or not self.enabled:
+            return
+        with self._lock:
+            stale = [key for key, (_, project, depends, _) in self._entries.items()
+                     if project == project_id and (ALL_CATEGORIES in depends or depends & changed)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            if self._db is not None:
+                rows = self._db.execute("SELECT key, categories FROM responses WHERE project = ?", (project_id,))
+                stale = []
+                for key, depends in rows.fetchall():
+                    depends = set(json.loads(depends))
+                    if ALL_CATEGORIES in depends or depends & changed:
+                        stale.append((key,))
+                self._db.executemany("DELETE FROM responses WHERE key = ?", stale)
+                self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,146 @@
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from kb_index import tokenize
+
+# Cosine similarity above which two questions count as the same question. Lower
+# values catch more paraphrases but also more look-alikes ("in scope" vs "out of
+# scope"); `python benchmark.py semantic-cache` shows the trade-off.
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.75))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", 1024))
+
+_NUMBER_RE = re.compile(r"\d+(?:[.,:/-]\d+)*")
+_MONTHS = {"jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+           "january", "february", "march", "april", "june", "july", "august", "september",
+           "october", "november", "december"}
+_WORD_RE = re.compile(r"[A-Za-z][\w'-]*")
+
+
+def anchors(question):
+    """Numbers, dates and names in a question: two questions that differ in them
+    ask about different things, however similar the rest of the wording is."""
+    found = set(_NUMBER_RE.findall(question))
+    for i, word in enumerate(_WORD_RE.findall(question)):
+        lower = word.lower()
+        # Capitalized words other than the first one are taken for names
+        if lower in _MONTHS or (i > 0 and word[0].isupper() and word != "I"):
+            found.add(lower)
+    return frozenset(found)
+
+
+class HashedNgramVectorizer:
+    """Embeds text as a hashed bag of words, word pairs and character n-grams.
+
+    Entirely local and deterministic (crc32, not the salted built-in hash), so vectors
+    can be compared across processes. Character n-grams make "stakeholder" and
+    "stakeholders" similar; word pairs keep "design schedule" apart from "testing
+    schedule". Vectors are L2-normalized, so a dot product is the cosine similarity.
+    """
+
+    def __init__(self, dim=4096, char_ngrams=(3, 4), word_weight=1.0, pair_weight=0.7, char_weight=0.3):
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+        self.word_weight = word_weight
+        self.pair_weight = pair_weight
+        self.char_weight = char_weight
+
+    def _features(self, text):
+        words = tokenize(text)
+        for word in words:
+            yield "w:" + word, self.word_weight
+            padded = f" {word} "
+            for n in self.char_ngrams:
+                for i in range(len(padded) - n + 1):
+                    yield "c:" + padded[i:i + n], self.char_weight
+        for pair in zip(words, words[1:]):
+            yield "p:" + " ".join(pair), self.pair_weight
+
+    def transform(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self._features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            # The top bit picks the sign, so collisions tend to cancel out
+            vector[h % self.dim] += weight if h & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """Answers for questions similar to one already answered against the same KB.
+
+    Questions are embedded with the vectorizer and kept in one matrix, so a lookup
+    is a single matrix-vector product. Entries are scoped by project and KB version:
+    only an entry stored for the same version can match, and storing an answer for a
+    new version drops the project's entries for older ones. Questions only match if
+    they mention the same numbers, dates and names (see anchors()).
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_SIZE, vectorizer=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.vectorizer = vectorizer or HashedNgramVectorizer()
+        self._vectors = np.zeros((0, self.vectorizer.dim), dtype=np.float32)
+        self._entries = []          # ((project, version), question, response, anchors), row-aligned with _vectors
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def lookup(self, question, project, version):
+        """Return (response, matched question, similarity), or None on a miss."""
+        vector = self.vectorizer.transform(question)
+        with self._lock:
+            match = self._best_match(vector, (project, version), anchors(question))
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return match
+
+    def _best_match(self, vector, scope, question_anchors):
+        if not self._entries:
+            return None
+        scores = self._vectors @ vector
+        scores[[i for i, entry in enumerate(self._entries)
+                if entry[0] != scope or entry[3] != question_anchors]] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        _, matched, response, _ = self._entries[best]
+        return response, matched, float(scores[best])
+
+    def store(self, question, response, project, version):
+        vector = self.vectorizer.transform(question)
+        scope = (project, version)
+        with self._lock:
+            # Answers for an older version of this project's KB will never match again
+            self._keep(i for i, (entry_scope, _, _, _) in enumerate(self._entries)
+                       if entry_scope[0] != project or entry_scope == scope)
+            if len(self._entries) >= self.max_entries:
+                self._keep(range(len(self._entries) - self.max_entries + 1, len(self._entries)))
+            self._vectors = np.vstack([self._vectors, vector[None, :]])
+            self._entries.append((scope, question, response, anchors(question)))
+
+    def _keep(self, rows):
+        rows = list(rows)
+        if len(rows) != len(self._entries):
+            self._vectors = self._vectors[rows]
+            self._entries = [self._entries[i] for i in rows]
+
+    def clear(self):
+        with self._lock:
+            self._vectors = np.zeros((0, self.vectorizer.dim), dtype=np.float32)
+            self._entries = []
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from aiohttp import WSMsgType, web
+
+import agent
+from kb_projects import check_project_id
+
+# How many agent turns may talk to the LLM at the same time; further requests wait
+MAX_CONCURRENT_TURNS = int(os.environ.get("AGENT_MAX_CONCURRENT_TURNS", 8))
+# Sessions idle for longer than this are dropped
+SESSION_IDLE_SECONDS = int(os.environ.get("AGENT_SESSION_IDLE_SECONDS", 3600))
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        # Turns of one conversation run one at a time, in order
+        self.lock = asyncio.Lock()
+        self.turns = 0
+        self.last_seen = time.monotonic()
+
+
+class SessionManager:
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.sessions = {}
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = Session(session_id)
+        session.last_seen = time.monotonic()
+        return session
+
+    def expire(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for session_id, session in list(self.sessions.items()):
+            if session.last_seen < cutoff and not session.lock.locked():
+                del self.sessions[session_id]
+                agent.conversations.forget(session_id)
+
+
+async def _read_json(request):
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object")
+    return body
+
+
+def _message(body, field="message"):
+    message = body.get(field) if isinstance(body, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        raise web.HTTPBadRequest(text=f"'{field}' must be a non-empty string")
+    return message
+
+
+def _project_id(value):
+    # Requests without a project work on agent.DEFAULT_PROJECT
+    if value is None:
+        return agent.DEFAULT_PROJECT
+    try:
+        return check_project_id(value)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+
+async def answer(request):
+    body = await _read_json(request)
+    message = _message(body)
+    project_id = _project_id(body.get("project_id"))
+    session = request.app["sessions"].get(request.match_info["session_id"])
+    async with session.lock, request.app["turn_slots"]:
+        response = await agent.aprocess_user_input(message, body.get("background_update"), project_id, session.id)
+        session.turns += 1
+    return web.json_response({"session_id": session.id, "response": response})
+
+
+async def stream(request):
+    # Same as /answer, but the answer is sent as a chunked text/plain body while it is generated
+    # Validate everything before prepare(): after it, an error can't become a 400 any more
+    body = await _read_json(request)
+    message = _message(body)
+    project_id = _project_id(body.get("project_id"))
+    session = request.app["sessions"].get(request.match_info["session_id"])
+    async with session.lock, request.app["turn_slots"]:
+        response = web.StreamResponse(headers={"Content-Type": "text/plain; charset=utf-8"})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        async for token in agent.astream_user_input(message, body.get("background_update"), project_id, session.id):
+            await response.write(token.encode("utf-8"))
+        session.turns += 1
+    await response.write_eof()
+    return response
+
+
+async def update(request):
+    # Run only the KB update step for a turn answered elsewhere
+    body = await _read_json(request)
+    user_message = _message(body, "user_message")
+    ai_response = _message(body, "ai_response")
+    project_id = _project_id(body.get("project_id"))
+    async with request.app["turn_slots"]:
+        await asyncio.get_running_loop().create_task(
+            agent.aupdate_kb_from_turn(user_message, ai_response), context=agent.turn_context(project_id))
+    return web.json_response({"version": agent.project_kb(project_id).store.version})
+
+
+async def read_kb(request):
+    with agent.using_project(_project_id(request.query.get("project"))) as project:
+        kb = project.store.read()
+        version = project.store.version
+    return web.json_response(kb, headers={"X-KB-Version": str(version)})
+
+
+async def stats(request):
+    semantic = agent.semantic_cache.stats() if agent.semantic_cache is not None else None
+    return web.json_response({"response_cache": agent.response_cache.stats(),
+                              "semantic_cache": semantic,
+                              "kb_updates": agent.turn_classifier.stats(),
+                              "open_projects": agent.kb_projects.open_projects()})
+
+
+async def metrics(request):
+    return web.Response(text=agent.metrics.to_prometheus(), content_type="text/plain")
+
+
+async def metrics_json(request):
+    return web.json_response(agent.metrics.to_json())
+
+
+async def websocket(request):
+    # Each text frame {"message": ...} is answered with {"token": ...} frames followed
+    # by {"done": true, "response": ...}. ?project=<id> selects the project KB.
+    project_id = _project_id(request.query.get("project"))
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    session = request.app["sessions"].get(request.match_info["session_id"])
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            continue
+        try:
+            message = _message(json.loads(msg.data))
+        except (json.JSONDecodeError, web.HTTPBadRequest):
+            await ws.send_json({"error": "expected {\"message\": \"...\"}"})
+            continue
+        async with session.lock, request.app["turn_slots"]:
+            tokens = []
+            try:
+                async for token in agent.astream_user_input(message, project_id=project_id, session_id=session.id):
+                    tokens.append(token)
+                    await ws.send_json({"token": token})
+            except Exception as e:
+                await ws.send_json({"error": str(e)})
+                continue
+            session.turns += 1
+        await ws.send_json({"done": True, "response": "".join(tokens)})
+    return ws
+
+
+async def _expire_sessions(app):
+    while True:
+        await asyncio.sleep(60)
+        app["sessions"].expire()
+
+
+async def _on_startup(app):
+    app["expiry_task"] = asyncio.create_task(_expire_sessions(app))
+    agent.warm_up()
+
+
+async def _on_cleanup(app):
+    app["expiry_task"].cancel()
+    # Let queued background KB updates land before the process goes away
+    await asyncio.to_thread(agent.flush_kb_updates)
+
+
+def create_app(max_concurrent_turns=MAX_CONCURRENT_TURNS):
+    app = web.Application()
+    app["sessions"] = SessionManager()
+    app["turn_slots"] = asyncio.Semaphore(max_concurrent_turns)
+    app.router.add_post("/sessions/{session_id}/answer", answer)
+    app.router.add_post("/sessions/{session_id}/stream", stream)
+    app.router.add_get("/sessions/{session_id}/ws", websocket)
+    app.router.add_post("/update", update)
+    app.router.add_get("/kb", read_kb)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/metrics.json", metrics_json)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the PM agent over HTTP/WebSocket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-concurrent-turns", type=int, default=MAX_CONCURRENT_TURNS)
+    args = parser.parse_args()
+    web.run_app(create_app(args.max_concurrent_turns), host=args.host, port=args.port)
@@ -0,0 +1,49 @@
+import pytest
+
+import agent
+from kb_projects import ProjectRegistry
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    registry = ProjectRegistry(agent._open_project)
+    monkeypatch.setattr(agent, "kb_projects", registry)
+    yield agent.project_kb()
+    registry.close_all()
+
+
+def test_entries_are_patched(project):
+    applied = agent.patch_knowledge_base([
+        {"op": "add", "path": "/risk/vendor_delay", "value": "Two weeks late"},
+        {"op": "append", "path": "/scope/deliverables", "value": "Training"},
+    ])
+    assert len(applied) == 2
+    kb = agent.read_knowledge_base()
+    assert kb["risk"] == {"vendor_delay": "Two weeks late"}
+    assert kb["scope"] == {"deliverables": ["Training"]}
+
+
+@pytest.mark.parametrize("op", [
+    {"op": "replace", "path": "/risk", "value": 1},
+    {"op": "replace", "path": "/risk", "value": {}},
+    {"op": "remove", "path": "/risk"},
+    {"op": "add", "path": "/risk", "value": "none"},
+    {"op": "append", "path": "/risk", "value": "x"},
+    {"op": "add", "path": "/gossip/x", "value": 1},
+    {"op": "add", "path": "risk/x", "value": 1},
+    {"op": "add", "path": "/", "value": {}},
+    "not an operation",
+])
+def test_category_level_damage_is_rejected(project, op):
+    agent.patch_knowledge_base([{"op": "add", "path": "/risk/a", "value": 1}])
+    assert agent.patch_knowledge_base([op]) == []
+    kb = agent.read_knowledge_base()
+    assert kb["risk"] == {"a": 1}
+    assert set(kb) == set(agent.PM_CATEGORIES)
+
+
+def test_a_category_can_be_set_to_an_object(project):
+    applied = agent.patch_knowledge_base([{"op": "add", "path": "/cost", "value": {"budget": "50k"}}])
+    assert len(applied) == 1
+    assert agent.read_knowledge_base()["cost"] == {"budget": "50k"}
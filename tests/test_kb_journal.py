@@ -0,0 +1,125 @@
+import hashlib
+import json
+
+import pytest
+
+from kb_journal import JournaledKBStore
+
+
+def _default():
+    return {"risk": {}, "scope": {}}
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "kb.json"), str(tmp_path / "kb.journal.jsonl")
+
+
+def _open(paths, **kwargs):
+    return JournaledKBStore(paths[0], _default, journal_path=paths[1], **kwargs)
+
+
+def _add(store, path, value):
+    return store.apply_patch([{"op": "add", "path": path, "value": value}])
+
+
+def test_updates_are_replayed_from_the_journal(paths):
+    store = _open(paths)
+    _add(store, "/risk/a", 1)
+    store.write({"risk": {"a": 1}, "scope": {"b": 2}})
+    assert _open(paths).read() == {"risk": {"a": 1}, "scope": {"b": 2}}
+    assert [entry["seq"] for entry in _open(paths).history()] == [1, 2]
+
+
+def test_torn_line_after_a_crash_is_ignored_and_overwritten(paths):
+    store = _open(paths)
+    _add(store, "/risk/a", 1)
+    with open(paths[1], "ab") as f:
+        f.write(b'{"seq": 2, "ops": [{"op": "add", "path": "/risk/b"')
+    reopened = _open(paths)
+    assert reopened.read() == {"risk": {"a": 1}, "scope": {}}
+    _add(reopened, "/risk/c", 3)
+    assert _open(paths).read() == {"risk": {"a": 1, "c": 3}, "scope": {}}
+
+
+def test_another_process_appending_is_picked_up(paths):
+    store, other = _open(paths), _open(paths)
+    store.read()
+    _add(other, "/scope/x", 1)
+    assert store.read() == {"risk": {}, "scope": {"x": 1}}
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(paths, tmp_path):
+    store = _open(paths, compact_every=3)
+    for i in range(3):
+        _add(store, f"/risk/r{i}", i)
+    assert store.entries == []
+    with open(paths[0]) as f:
+        assert json.load(f) == {"risk": {"r0": 0, "r1": 1, "r2": 2}, "scope": {}}
+    assert (tmp_path / "kb.journal.jsonl.1-3").exists()
+    _add(store, "/risk/r3", 3)
+    assert _open(paths).read()["risk"] == {"r0": 0, "r1": 1, "r2": 2, "r3": 3}
+
+
+def test_crash_between_snapshot_and_journal_rotation(paths):
+    store = _open(paths)
+    store.apply_patch([{"op": "append", "path": "/scope/items", "value": "x"}])
+    # What _compact() does before rotating the journal: marker, then the new snapshot
+    data = json.dumps(store.read(), indent=2).encode("utf-8")
+    with open(paths[1], "ab") as f:
+        f.write((json.dumps({"compacting": hashlib.sha256(data).hexdigest()}) + "\n").encode("utf-8"))
+    with open(paths[0], "wb") as f:
+        f.write(data)
+    # The append must not be replayed a second time on top of the new snapshot
+    assert _open(paths).read() == {"risk": {}, "scope": {"items": ["x"]}}
+
+
+def test_external_edit_of_the_snapshot_keeps_both(paths):
+    store = _open(paths)
+    _add(store, "/risk/a", 1)
+    store.compact()
+    _add(store, "/risk/b", 2)
+    with open(paths[0], "w") as f:
+        json.dump({"risk": {"a": 1}, "scope": {"edited": True}}, f)
+    assert _open(paths).read() == {"risk": {"a": 1, "b": 2}, "scope": {"edited": True}}
+
+
+def test_external_edit_then_reopen_archives_the_whole_journal(paths, tmp_path):
+    store = _open(paths)
+    _add(store, "/risk/a", 1)
+    _add(store, "/risk/b", 2)
+    with open(paths[0], "w") as f:
+        json.dump({"risk": {}, "scope": {"edited": True}}, f)
+    reopened = _open(paths)
+    assert reopened.read() == {"risk": {"a": 1, "b": 2}, "scope": {"edited": True}}
+    with open(tmp_path / "kb.journal.jsonl.1-2") as f:
+        lines = [json.loads(line) for line in f]
+    assert "snapshot" in lines[0]
+    assert [line["seq"] for line in lines if "ops" in line] == [1, 2]
+    assert all(line["undo"] for line in lines if "ops" in line)
+    assert "compacting" in lines[-1]
+    # The new journal starts on the folded snapshot
+    assert _open(paths).read() == reopened.read()
+    _add(reopened, "/risk/c", 3)
+    assert _open(paths).read()["risk"] == {"a": 1, "b": 2, "c": 3}
+
+
+def test_undo_reverts_latest_first_and_is_journaled(paths):
+    store = _open(paths)
+    _add(store, "/risk/a", 1)
+    store.apply_patch([{"op": "replace", "path": "/risk/a", "value": 2}])
+    assert store.undo() == [{"op": "replace", "path": "/risk/a", "value": 1}]
+    assert _open(paths).read() == {"risk": {"a": 1}, "scope": {}}
+    store.undo()
+    assert store.read() == {"risk": {}, "scope": {}}
+    assert store.undo() == []
+    assert _open(paths).undo() == []
+
+
+def test_undo_by_seq(paths):
+    store = _open(paths)
+    _add(store, "/risk/a", 1)
+    _add(store, "/scope/b", 2)
+    store.undo(1)
+    assert store.read() == {"risk": {}, "scope": {"b": 2}}
+    assert store.undo(1) == []
@@ -0,0 +1,88 @@
+import pytest
+
+from kb_patch import PatchError, apply_patch, changed_keys, diff, make_pointer, parse_pointer
+
+
+def test_pointer_escapes_round_trip():
+    assert make_pointer(["a/b", "c~d", 3]) == "/a~1b/c~0d/3"
+    assert parse_pointer("/a~1b/c~0d/3") == ["a/b", "c~d", "3"]
+    # ~01 is "~1" escaped, not "/"
+    assert parse_pointer("/~01") == ["~1"]
+
+
+@pytest.mark.parametrize("path", ["risk", "", None, 3])
+def test_pointer_must_start_with_slash(path):
+    with pytest.raises(PatchError):
+        parse_pointer(path)
+
+
+def test_add_creates_parents_and_leaves_the_original_alone():
+    kb = {"risk": {}, "scope": {"a": 1}}
+    new_kb, applied = apply_patch(kb, [{"op": "add", "path": "/risk/vendor/eta", "value": "May"}])
+    assert new_kb == {"risk": {"vendor": {"eta": "May"}}, "scope": {"a": 1}}
+    assert kb == {"risk": {}, "scope": {"a": 1}}
+    assert new_kb["scope"] is kb["scope"]
+    assert len(applied) == 1
+
+
+def test_list_end_and_index():
+    kb = {"scope": {"items": ["a", "c"]}}
+    new_kb, _ = apply_patch(kb, [
+        {"op": "add", "path": "/scope/items/-", "value": "d"},
+        {"op": "add", "path": "/scope/items/1", "value": "b"},
+        {"op": "append", "path": "/scope/new", "value": "x"},
+    ])
+    assert new_kb["scope"] == {"items": ["a", "b", "c", "d"], "new": ["x"]}
+    assert kb["scope"]["items"] == ["a", "c"]
+
+
+@pytest.mark.parametrize("op", [
+    {"op": "replace", "path": "/risk/missing", "value": 1},
+    {"op": "remove", "path": "/risk/missing"},
+    {"op": "add", "path": "/scope/items/5", "value": 1},
+    {"op": "add", "path": "/scope/items/x", "value": 1},
+    {"op": "remove", "path": "/scope/items/-"},
+    {"op": "append", "path": "/risk/text", "value": 1},
+    {"op": "add", "path": "/risk/text/below", "value": 1},
+    {"op": "add", "path": "/", "value": {}},
+    {"op": "add", "path": "/risk/x"},
+    {"op": "move", "path": "/risk/x", "value": 1},
+    {"op": "add", "path": "risk/x", "value": 1},
+])
+def test_invalid_operations_raise(op):
+    kb = {"risk": {"text": "a"}, "scope": {"items": ["a"]}}
+    with pytest.raises(PatchError):
+        apply_patch(kb, [op])
+
+
+def test_on_error_skips_only_the_bad_operation():
+    errors = []
+    new_kb, applied = apply_patch({"risk": {}}, [
+        {"op": "remove", "path": "/risk/missing"},
+        {"op": "add", "path": "/risk/a", "value": 1},
+    ], on_error=lambda op, e: errors.append(op["path"]))
+    assert new_kb == {"risk": {"a": 1}}
+    assert applied == [{"op": "add", "path": "/risk/a", "value": 1}]
+    assert errors == ["/risk/missing"]
+
+
+def test_undo_operations_restore_the_original():
+    kb = {"risk": {"a": 1, "b": [1]}, "scope": {}}
+    undo = []
+    new_kb, _ = apply_patch(kb, [
+        {"op": "replace", "path": "/risk/a", "value": 2},
+        {"op": "append", "path": "/risk/b", "value": 2},
+        {"op": "remove", "path": "/risk/a"},
+        {"op": "add", "path": "/scope/c", "value": 3},
+    ], undo=undo)
+    restored, _ = apply_patch(new_kb, undo)
+    assert restored == kb
+
+
+def test_diff_turns_old_into_new():
+    old = {"risk": {"a": 1, "b": {"c": 2}}, "scope": {"x": 1}}
+    new = {"risk": {"b": {"c": 3}, "d": 4}, "scope": {"x": 1}, "cost": {}}
+    patched, _ = apply_patch(old, diff(old, new))
+    assert patched == new
+    assert diff(new, new) == []
+    assert sorted(changed_keys(old, new)) == ["cost", "risk"]
@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+from kb_projects import ProjectKB, ProjectRegistry
+from kb_sqlite import FTSIndex, SQLiteKBStore
+
+
+@pytest.fixture
+def registry(tmp_path):
+    def open_project(project_id):
+        store = SQLiteKBStore(str(tmp_path / f"{project_id}.sqlite3"), lambda: {"risk": {}})
+        return ProjectKB(project_id, store, FTSIndex(store))
+
+    registry = ProjectRegistry(open_project, max_open=1)
+    yield registry
+    registry.close_all()
+
+
+def test_least_recently_used_project_is_closed(registry):
+    a = registry.get("a")
+    registry.get("b")
+    assert registry.open_projects() == ["b"]
+    with pytest.raises(sqlite3.ProgrammingError):
+        a.store.read()
+
+
+def test_project_in_use_is_not_closed(registry):
+    with registry.use("a") as a:
+        registry.get("b")
+        a.store.apply_patch([{"op": "add", "path": "/risk/x", "value": 1}])
+        assert a.store.read() == {"risk": {"x": 1}}
+        assert registry.open_projects() == ["a", "b"]
+    # Closed once its last user is done
+    assert registry.open_projects() == ["b"]
+    assert registry.get("a").store.read() == {"risk": {"x": 1}}
+
+
+def test_nested_use(registry):
+    with registry.use("a") as a:
+        with registry.use("a"):
+            registry.get("b")
+        assert a.users == 1
+        assert a.store.read() == {"risk": {}}
+    assert a.users == 0
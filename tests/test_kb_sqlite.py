@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from kb_index import select_context
+from kb_sqlite import FTSIndex, SQLiteKBStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteKBStore(str(tmp_path / "kb.sqlite3"), lambda: {"risk": {}, "scope": {}})
+    yield store
+    store.close()
+
+
+def test_patch_and_reload(store, tmp_path):
+    store.apply_patch([{"op": "add", "path": "/risk/vendor", "value": "late"}])
+    reopened = SQLiteKBStore(str(tmp_path / "kb.sqlite3"))
+    assert reopened.read() == {"risk": {"vendor": "late"}, "scope": {}}
+    reopened.close()
+
+
+def test_undo_reverts_latest_update_first(store):
+    store.apply_patch([{"op": "add", "path": "/risk/vendor", "value": "late"}])
+    kb = store.snapshot()
+    kb["risk"]["vendor"] = "on time"
+    kb["scope"]["mobile"] = "out"
+    store.write(kb)
+
+    store.undo()
+    assert store.read() == {"risk": {"vendor": "late"}, "scope": {}}
+    store.undo()
+    assert store.read() == {"risk": {}, "scope": {}}
+    assert store.undo() == []
+
+
+def test_undo_by_seq_and_not_twice(store):
+    store.apply_patch([{"op": "add", "path": "/risk/a", "value": 1}])
+    store.apply_patch([{"op": "add", "path": "/scope/b", "value": 2}])
+    assert store.undo(1) == [{"op": "remove", "path": "/risk/a"}]
+    assert store.read() == {"risk": {}, "scope": {"b": 2}}
+    assert store.undo(1) == []
+
+
+def test_search_finds_entries(store):
+    store.apply_patch([{"op": "add", "path": "/risk/vendor_delay", "value": "Supplier ships two weeks late"}])
+    assert store.search("supplier")[0][0] == ("risk", "vendor_delay")
+
+
+def test_select_context_skips_hits_newer_than_the_kb(store):
+    # FTSIndex searches the database, which may have moved on since kb was read
+    index = FTSIndex(store)
+    store.apply_patch([{"op": "add", "path": "/risk/old", "value": "vendor delay"}])
+    kb = store.read()
+    store.apply_patch([{"op": "add", "path": "/risk/new", "value": "vendor delay added later"},
+                       {"op": "add", "path": "/procurement/po", "value": "vendor delay on the order"}])
+    index.sync(kb, store.version)
+    context = select_context(kb, index, "vendor delay", token_budget=1000, full_kb_tokens=1)
+    assert json.loads(context)["risk"] == {"old": "vendor delay"}
+    assert "po" not in context
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from kb_store import KBConflictError, KBStore
+
+
+def test_write_is_visible_to_a_new_store(tmp_path):
+    path = str(tmp_path / "kb.json")
+    KBStore(path).write({"risk": {"a": 1}})
+    assert KBStore(path).read() == {"risk": {"a": 1}}
+    assert list(tmp_path.glob(".kb-*.tmp")) == []
+
+
+def test_read_is_cached_until_the_file_changes(tmp_path):
+    path = tmp_path / "kb.json"
+    store = KBStore(str(path), lambda: {"risk": {}})
+    first = store.read()
+    assert store.read() is first
+    path.write_text(json.dumps({"risk": {"edited": True}}))
+    assert store.read() == {"risk": {"edited": True}}
+
+
+def test_write_refuses_a_stale_token(tmp_path):
+    path = str(tmp_path / "kb.json")
+    store, other = KBStore(path), KBStore(path)
+    store.write({"risk": {}})
+    _, token = store.read_versioned()
+    other.write({"risk": {"b": 2}})
+    with pytest.raises(KBConflictError):
+        store.write({"risk": {"a": 1}}, expected=token)
+
+
+def test_update_retries_after_a_concurrent_write(tmp_path):
+    path = str(tmp_path / "kb.json")
+    store, other = KBStore(path), KBStore(path)
+    store.write({"risk": {}})
+    calls = []
+
+    def mutate(kb):
+        calls.append(1)
+        if len(calls) == 1:
+            other.update(lambda kb: kb["risk"].update(other_writer=True))
+        kb["risk"]["mine"] = True
+
+    store.update(mutate)
+    assert store.read() == {"risk": {"other_writer": True, "mine": True}}
+    assert store.retries == 1
+
+
+def test_apply_patch_keeps_unchanged_categories_shared(tmp_path):
+    store = KBStore(str(tmp_path / "kb.json"), lambda: {"risk": {}, "scope": {}})
+    before = store.read()
+    store.apply_patch([{"op": "add", "path": "/risk/a", "value": 1}])
+    after = store.read()
+    assert after == {"risk": {"a": 1}, "scope": {}}
+    assert after["scope"] is before["scope"]
+
+
+def test_update_from_a_missing_file_still_detects_conflicts(tmp_path):
+    path = str(tmp_path / "kb.json")
+    store, other = KBStore(path, lambda: {"risk": {}}), KBStore(path, lambda: {"risk": {}})
+    calls = []
+
+    def mutate(kb):
+        calls.append(1)
+        if len(calls) == 1:
+            other.update(lambda kb: kb["risk"].update(other_writer=True))
+        kb["risk"]["mine"] = True
+
+    store.update(mutate)
+    assert KBStore(path).read() == {"risk": {"other_writer": True, "mine": True}}
+    assert store.retries == 1
+
+
+def test_write_expecting_a_missing_file_conflicts_once_it_exists(tmp_path):
+    path = str(tmp_path / "kb.json")
+    store = KBStore(path)
+    _, token = store.read_versioned()
+    KBStore(path).write({"risk": {}})
+    with pytest.raises(KBConflictError):
+        store.write({"scope": {}}, expected=token)
@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from semantic_cache import SemanticCache, anchors  # noqa: E402
+
+
+def test_paraphrase_matches():
+    cache = SemanticCache()
+    cache.store("What is the total budget?", "50k", "p", 1)
+    assert cache.lookup("What is the total budget for the project?", "p", 1)[0] == "50k"
+
+
+def test_different_dates_or_names_never_match():
+    cache = SemanticCache(threshold=0.5)
+    cache.store("The go-live date moved to March 3", "Noted.", "p", 1)
+    cache.store("Is Alice the sponsor?", "Yes.", "p", 1)
+    assert cache.lookup("The go-live date moved to April 9", "p", 1) is None
+    assert cache.lookup("Is Bob the sponsor?", "p", 1) is None
+
+
+def test_other_kb_version_never_matches():
+    cache = SemanticCache()
+    cache.store("What is the total budget?", "50k", "p", 1)
+    assert cache.lookup("What is the total budget?", "p", 2) is None
+
+
+def test_anchors():
+    assert anchors("The go-live date moved to March 3") == {"march", "3"}
+    assert anchors("What is the budget?") == set()
@@ -0,0 +1,36 @@
+import pytest
+
+from turn_classifier import MUTATION_THRESHOLD, TurnClassifier, mutation_score
+
+
+@pytest.mark.parametrize("message", [
+    "Alice is the sponsor",
+    "The sponsor is Alice.",
+    "Can you add Alice to the stakeholders?",
+    "Could you record that the vendor is Acme?",
+    "Can we mark the design phase as done?",
+    "Please set the budget to 50k",
+    "The go-live date moved to March 3.",
+    "We decided to drop the mobile app from scope.",
+])
+def test_facts_and_change_requests_need_an_update(message):
+    assert mutation_score(message) >= MUTATION_THRESHOLD
+
+
+@pytest.mark.parametrize("message", [
+    "What is the budget?",
+    "Who is the sponsor?",
+    "Can you tell me the budget?",
+    "How are we doing on schedule?",
+    "Summarize the risks.",
+    "Thanks!",
+])
+def test_questions_skip_the_update(message):
+    assert mutation_score(message) < MUTATION_THRESHOLD
+
+
+def test_classifier_counts_avoided_calls():
+    classifier = TurnClassifier()
+    assert classifier.needs_update("The sponsor is Alice.")
+    assert not classifier.needs_update("Who is the sponsor?")
+    assert classifier.stats() == {"update_calls": 1, "update_calls_avoided": 1, "avoided_rate": 0.5}
@@ -0,0 +1,106 @@
+import re
+import threading
+
+from kb_index import tokenize
+
+# Turns scoring at least this much are sent to the update agent
+MUTATION_THRESHOLD = 1.0
+
+_QUESTION_START_RE = re.compile(
+    r"^(what|what's|whats|who|who's|whom|whose|when|where|which|why|how|is|are|was|were|do|does|did|"
+    r"can|could|should|would|will|shall|has|have|had|any|list|show|tell|give|summarize|summarise|explain|describe)\b",
+    re.IGNORECASE,
+)
+_SENTENCE_RE = re.compile(r"[^.!?\n]+[.!?]?")
+# Polite requests phrased as questions ("Can you add ...?", "Could we mark ...?")
+_REQUEST_RE = re.compile(r"^(please\s+)?(can|could|would|will)\s+(you|we|i)\b|\bplease\b", re.IGNORECASE)
+# Verbs asking for the KB to change; they count in full inside a request
+_REQUEST_VERBS = {
+    "add", "record", "mark", "set", "change", "update", "remove", "delete", "note", "log", "save",
+    "put", "move", "rename", "track", "assign", "remember", "replace", "include",
+}
+# "X is Y": a statement with a copula usually states a fact
+_COPULAS = {"is", "are", "was", "were", "isn't", "aren't", "wasn't", "weren't"}
+COPULA_WEIGHT = 0.6
+
+# Words that announce a new fact or a change to one
+_MUTATION_WORDS = {
+    "add": 1.0, "added": 1.0, "update": 1.0, "updated": 1.0, "record": 1.0, "note": 0.6,
+    "remember": 1.0, "set": 1.0, "change": 1.0, "changed": 1.0, "mark": 1.0, "marked": 1.0, "remove": 1.0, "removed": 1.0,
+    "now": 0.6, "moved": 1.0, "postponed": 1.0, "delayed": 1.0, "slipped": 1.0, "rescheduled": 1.0,
+    "agreed": 1.0, "decided": 1.0, "approved": 1.0, "rejected": 1.0, "signed": 1.0, "cancelled": 1.0,
+    "canceled": 1.0, "hired": 1.0, "joined": 1.0, "left": 0.8, "replaced": 1.0, "assigned": 0.6,
+    "increased": 1.0, "reduced": 1.0, "cut": 0.8, "raised": 0.8, "new": 0.6, "identified": 0.8,
+    "completed": 1.0, "finished": 1.0, "started": 0.8, "launched": 1.0, "confirmed": 1.0,
+    "we've": 0.4, "we're": 0.4, "our": 0.2, "going": 0.4, "planned": 0.6, "scheduled": 0.6,
+}
+# Concrete values: dates, amounts, percentages
+_VALUE_RE = re.compile(
+    r"(\d{4}-\d{2}-\d{2}|\$\s?\d|\d+\s?(k|m|%|percent|days|weeks|months|hours)\b|"
+    r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}\b|\b\d{1,2}(st|nd|rd|th)\b)",
+    re.IGNORECASE,
+)
+
+
+def _is_question(sentence):
+    sentence = sentence.strip()
+    return sentence.endswith("?") or bool(_QUESTION_START_RE.match(sentence))
+
+
+def mutation_score(user_input):
+    """Score how likely a user message is to carry new project facts.
+
+    Every change word or concrete value adds to the score, at half weight inside a
+    question ("What changed?"). A request phrased as a question ("Can you add
+    ...?") is not a question: its change verbs count in full. Statements also score
+    by length and for stating that something is something ("Alice is the
+    sponsor"), so most statements are treated as possible facts: a wasted update
+    call is cheaper than a lost fact. Only the user's message counts; the answers
+    come from the KB itself.
+    """
+    score = 0.0
+    for sentence in _SENTENCE_RE.findall(user_input):
+        terms = tokenize(sentence)
+        if not terms:
+            continue
+        words = re.findall(r"[a-z0-9']+", sentence.lower())
+        sentence_score = sum(_MUTATION_WORDS.get(word, 0.0) for word in words)
+        sentence_score += 0.8 * len(_VALUE_RE.findall(sentence))
+        if _REQUEST_RE.search(sentence.strip()):
+            sentence_score = max(sentence_score, sum(1.0 for word in words if word in _REQUEST_VERBS))
+        elif _is_question(sentence):
+            sentence_score *= 0.5
+        else:
+            sentence_score += 0.25 * min(len(terms), 4)
+            if _COPULAS.intersection(words):
+                sentence_score += COPULA_WEIGHT
+        score += sentence_score
+    return score
+
+
+class TurnClassifier:
+    """Decides whether a turn needs the update agent, and counts the calls it saved."""
+
+    def __init__(self, threshold=MUTATION_THRESHOLD):
+        self.threshold = threshold
+        self.mutations = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def needs_update(self, user_input):
+        mutation = mutation_score(user_input) >= self.threshold
+        with self._lock:
+            if mutation:
+                self.mutations += 1
+            else:
+                self.skipped += 1
+        return mutation
+
+    def stats(self):
+        with self._lock:
+            turns = self.mutations + self.skipped
+            return {
+                "update_calls": self.mutations,
+                "update_calls_avoided": self.skipped,
+                "avoided_rate": self.skipped / turns if turns else 0.0,
+            }
@@ -0,0 +1,127 @@
+import threading
+
+import wx
+
+from kb_patch import changed_keys
+
+_NOTHING = object()
+
+
+class KBTreeCtrl(wx.TreeCtrl):
+    """The knowledge base side panel: one node per category, entries below it.
+
+    show(kb) compares the new KB with the one on screen and only touches the
+    categories and entries that differ, so a refresh after a turn costs a few tree
+    updates instead of rebuilding the whole panel. Entries are only created when
+    their category is first expanded.
+
+    refresh_later() may be called from any thread, e.g. by a KB change subscriber.
+    """
+
+    def __init__(self, parent):
+        super().__init__(parent, style=wx.TR_DEFAULT_STYLE | wx.TR_HIDE_ROOT | wx.TR_LINES_AT_ROOT)
+        self.root = self.AddRoot("Knowledge Base")
+        self.kb = {}
+        self._categories = {}   # category -> tree item
+        self._entries = {}      # category -> {key: tree item}, for expanded categories only
+        self._pending = _NOTHING  # categories to refresh (None: all), or _NOTHING
+        self._pending_lock = threading.Lock()
+        self.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.OnExpanding)
+
+    def show(self, kb, categories=None):
+        """Update the tree to kb; categories, if known, limits the comparison to them."""
+        if kb is self.kb:
+            return
+        old, self.kb = self.kb, kb
+        if categories is None:
+            categories = changed_keys(old, kb)
+        if not categories:
+            return
+        self.Freeze()
+        try:
+            for category in categories:
+                self._update_category(category, old.get(category), kb.get(category))
+            # New categories are appended in the KB's order
+            for category in kb:
+                if category in categories and category not in self._categories:
+                    self._add_category(category, kb[category])
+        finally:
+            self.Thaw()
+
+    def refresh_later(self, read_kb, categories=None):
+        """Show read_kb() on the GUI thread, comparing only categories if given.
+
+        Calls made before the refresh runs are folded into one, so a burst of
+        changes costs one read and one tree update.
+        """
+        with self._pending_lock:
+            pending = self._pending
+            if pending is _NOTHING:
+                self._pending = None if categories is None else set(categories)
+            elif pending is not None:
+                self._pending = None if categories is None else pending | set(categories)
+        if pending is _NOTHING:
+            wx.CallAfter(self._refresh, read_kb)
+
+    def _refresh(self, read_kb):
+        with self._pending_lock:
+            categories, self._pending = self._pending, _NOTHING
+        self.show(read_kb(), categories)
+
+    def _update_category(self, category, old, new):
+        item = self._categories.get(category)
+        if item is None:
+            return
+        if new is None:
+            self.Delete(item)
+            del self._categories[category]
+            self._entries.pop(category, None)
+            return
+        self.SetItemText(item, self._category_label(category, new))
+        self.SetItemHasChildren(item, bool(new))
+        items = self._entries.get(category)
+        if items is None:
+            return  # Not expanded yet, filled in by OnExpanding
+        if not isinstance(old, dict) or not isinstance(new, dict):
+            self.DeleteChildren(item)
+            self._entries[category] = self._add_entries(item, new)
+            return
+        changed = set(changed_keys(old, new))
+        for key in changed:
+            if key not in new and key in items:
+                self.Delete(items.pop(key))
+        for key, value in new.items():
+            if key in changed:
+                if key in items:
+                    self.SetItemText(items[key], self._entry_label(key, value))
+                else:
+                    items[key] = self.AppendItem(item, self._entry_label(key, value))
+
+    def _add_category(self, category, entries):
+        item = self.AppendItem(self.root, self._category_label(category, entries), data=category)
+        self.SetItemHasChildren(item, bool(entries))
+        self._categories[category] = item
+
+    def _add_entries(self, item, entries):
+        if not isinstance(entries, dict):
+            return {None: self.AppendItem(item, str(entries))}
+        return {key: self.AppendItem(item, self._entry_label(key, value)) for key, value in entries.items()}
+
+    def OnExpanding(self, event):
+        item = event.GetItem()
+        category = self.GetItemData(item)
+        if category in self._categories and category not in self._entries:
+            self.Freeze()
+            try:
+                self._entries[category] = self._add_entries(item, self.kb.get(category))
+            finally:
+                self.Thaw()
+        event.Skip()
+
+    @staticmethod
+    def _category_label(category, entries):
+        return f"{category} ({len(entries)})" if isinstance(entries, (dict, list)) else category
+
+    @staticmethod
+    def _entry_label(key, value):
+        return f"{key}: {value}"